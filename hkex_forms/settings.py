@@ -78,10 +78,59 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Batch and background workers write snapshots concurrently, wait for locks instead of failing
+        "OPTIONS": {"timeout": 30},
     }
 }
 
 
+# Shareholding snapshot store used by HKEXConnection: "database" (models) or "columnar" (memory-mapped files)
+HKEX_SNAPSHOT_STORE = "database"
+HKEX_COLUMNAR_STORE_DIR = BASE_DIR / "data" / "columnar"
+
+# Sessions (HTTP or headless Chrome) kept open per process and reused across analyses, closed after being idle this many seconds
+HKEX_SESSION_POOL_SIZE = 4
+HKEX_SESSION_IDLE_TIMEOUT = 300
+# Seconds an analysis waits for a session when all HKEX_SESSION_POOL_SIZE of them are checked out, before failing
+HKEX_SESSION_CHECKOUT_TIMEOUT = 120
+
+
+# Analysis results reused across jobs, kept in the database so that the web process answers repeated requests from the
+# results of the hkex_worker process (create the tables with createcachetable). DatabaseCache culls 1/CULL_FREQUENCY of
+# the entries once MAX_ENTRIES is reached: CULL_FREQUENCY equal to MAX_ENTRIES evicts one entry at a time. Holdings time
+# series (hkex_series) are far larger than job results (hkex_summaries), re-thresholding a cached range needs no fetch.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "hkex_series": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "hkex_series_cache",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 32, "CULL_FREQUENCY": 32},
+    },
+    "hkex_summaries": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "hkex_summaries_cache",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 1024, "CULL_FREQUENCY": 1024},
+    },
+}
+
+
+# Progress of analyses goes to the console, set the "myapp" level to DEBUG for per-stage timings
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "myapp": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
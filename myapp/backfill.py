@@ -0,0 +1,261 @@
+import datetime
+import logging
+import time
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import BackfillRun, BackfillUnit
+from .store import defaultStore, isFinal, toDate
+
+logger = logging.getLogger(__name__)
+
+class BackfillProgress():
+
+    """Throughput of the current execution of a backfill run"""
+
+    def __init__(self, run, remaining):
+        self.run = run
+        self.remaining = remaining
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def unitsPerSecond(self):
+        elapsed = time.monotonic() - self.start
+        return (self.done + self.failed) / elapsed if elapsed > 0 else 0
+
+    def eta(self):
+
+        """Seconds left at the current rate, None before the first commit"""
+
+        rate = self.unitsPerSecond()
+        return (self.remaining - self.done - self.failed) / rate if rate > 0 else None
+
+    def __str__(self):
+        eta = self.eta()
+        return (str(self.run) + ': ' + str(self.done + self.failed) + '/' + str(self.remaining) + ' units, ' + str(self.failed) + ' failed, '
+                + '%.1f units/s, ETA %s' % (self.unitsPerSecond(), datetime.timedelta(seconds = round(eta)) if eta != None else '-'))
+
+def planBackfill(stock_codes, start_date, end_date, store = None):
+
+    """
+    Plans a backfill run with one unit per stock code and trading day between start and end date that is not stored yet
+
+    Parameters
+    ----------
+    stock_codes : list of str
+        HK Stock Codes
+    start_date, end_date : str
+        Date range (YYYY/MM/DD), dates that are not final yet (see store.isFinal) are left out
+    store : SnapshotStore or ColumnarStore, optional
+        Store consulted for snapshots already loaded, defaults to defaultStore()
+
+    Returns
+    -------
+    BackfillRun
+    """
+
+    from .hkex import normalizeStockCode
+    from .tradingcalendar import planDates
+
+    store = store if store != None else defaultStore()
+
+    dates = [d for d in planDates(start_date, end_date).dates if isFinal(d)]
+
+    with transaction.atomic():
+        run = BackfillRun.objects.create(start_date = toDate(start_date), end_date = toDate(end_date))
+
+        for stock_code in dict.fromkeys(normalizeStockCode(stock_code) for stock_code in stock_codes):
+            BackfillUnit.objects.bulk_create([BackfillUnit(run = run, stock_code = stock_code, date = toDate(d))
+                                              for d in store.missingDates(stock_code, dates)],
+                                             batch_size = 5000)
+
+    return run
+
+def backfillStats(run):
+
+    """Returns the number of units of the run in each status"""
+
+    stats = {BackfillUnit.PENDING: 0, BackfillUnit.DONE: 0, BackfillUnit.FAILED: 0}
+    stats.update(dict(run.units.values_list('status').annotate(units = Count('id')).order_by()))
+
+    return stats
+
+def iterPendingUnits(units, batch_size = 500):
+
+    """Yields the units of a queryset in id order, batch_size at a time, with the id as cursor"""
+
+    cursor = 0
+    while True:
+        batch = list(units.filter(id__gt = cursor).order_by('id')[:batch_size])
+        if len(batch) == 0:
+            return
+        cursor = batch[-1].id
+
+        yield from batch
+
+def iterFetchUnits(units, pool, max_workers = 4, retries = 2, backoff = 1.0, rate_limiter = None):
+
+    """
+    Fetches units of any stock codes in parallel on sessions of pool, yielding (unit, snapshot, error) in the order
+    they complete, error is None for fetched units. Units are read from the iterable as sessions free up, at most
+    2 x max_workers of them in flight, so stock codes with only a few pending dates do not leave sessions idle
+    """
+
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from .fetchers import FetchReport, fetchWithRetries
+    from .instrumentation import increment
+
+    report = FetchReport()
+    units = iter(units)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+
+        def submitNext():
+            for unit in units:
+                d = unit.date.strftime('%Y/%m/%d')
+                in_flight[executor.submit(fetchWithRetries, unit.stock_code, d, pool, report, retries, backoff, rate_limiter)] = unit
+                return
+
+        for _ in range(2 * max_workers):
+            submitNext()
+
+        try:
+            while len(in_flight) > 0:
+                done, _ = wait(in_flight, return_when = FIRST_COMPLETED)
+
+                for future in done:
+                    unit = in_flight.pop(future)
+                    submitNext()
+
+                    try:
+                        snapshot, error = future.result(), None
+                    except Exception as e:
+                        snapshot, error = None, type(e).__name__ + ': ' + str(e)
+                        increment('fetch_failures')
+                        logger.warning('Could not fetch stock code %s as of %s - %s', unit.stock_code, unit.date, error)
+
+                    yield unit, snapshot, error
+
+        finally:
+            # Interrupted runs do not fetch what they will never commit
+            for future in in_flight:
+                future.cancel()
+
+def commitUnits(store, fetched):
+
+    """
+    Stores the snapshots of a batch of fetched units, grouped per stock code, and records the outcome of every unit in
+    the same transaction. fetched holds (unit, snapshot, error) as yielded by iterFetchUnits, returns the number of
+    units done
+    """
+
+    snapshots = {}
+    for unit, snapshot, _ in sorted(fetched, key = lambda outcome: (outcome[0].stock_code, outcome[0].date)):
+        if snapshot != None:
+            snapshots.setdefault(unit.stock_code, {})[unit.date.strftime('%Y/%m/%d')] = snapshot
+
+    done = [unit.id for unit, snapshot, _ in fetched if snapshot != None]
+
+    with transaction.atomic():
+        for stock_code, stock_snapshots in snapshots.items():
+            store.putMany(stock_code, stock_snapshots)
+
+        BackfillUnit.objects.filter(id__in = done).update(status = BackfillUnit.DONE, attempts = F('attempts') + 1, error = '')
+
+        for unit, snapshot, error in fetched:
+            if snapshot == None:
+                BackfillUnit.objects.filter(id = unit.id).update(status = BackfillUnit.FAILED,
+                                                                 attempts = F('attempts') + 1,
+                                                                 error = error or 'Not fetched'
+                                                                 )
+
+    return len(done)
+
+def runBackfill(run, store = None, backend = 'http', url = None, max_workers = 4, rate_limit = 4, retries = 2, commit_size = 50,
+                retry_failed = False, progress = None, index = True):
+
+    """
+    Executes the pending units of a backfill run. Units of all stock codes are fetched concurrently, and every
+    commit_size fetched units are stored together with their status in one transaction, so an interrupted run
+    resumes from its uncommitted units when run again. Once all units are executed, the snapshots loaded by the run
+    are folded into the participant index
+
+    Parameters
+    ----------
+    run : BackfillRun
+        Run planned by planBackfill
+    store : SnapshotStore or ColumnarStore, optional
+        Store the snapshots are written to, defaults to defaultStore()
+    backend, url, max_workers, rate_limit, retries
+        Fetch options as for HKEXConnection, max_workers bounds the units fetched in parallel
+    commit_size : int
+        Units fetched and committed per transaction
+    retry_failed : bool
+        Also execute units that failed in earlier executions
+    progress : callable, optional
+        Called as progress(BackfillProgress) after each commit
+    index : bool
+        Update the participant index (see participants.indexStock) of the stock codes loaded, once the run is done
+
+    Returns
+    -------
+    dict
+        Units of the run in each status (see backfillStats)
+    """
+
+    from contextlib import closing
+    from .fetchers import HKEX_URL, getRateLimiter, sharedPool
+    from .participants import indexStock
+
+    store = store if store != None else defaultStore()
+    url = url if url != None else HKEX_URL
+
+    pool = sharedPool(backend, url, max_workers)
+    rate_limiter = getRateLimiter(url, rate_limit)
+
+    statuses = [BackfillUnit.PENDING] + ([BackfillUnit.FAILED] if retry_failed else [])
+    units = run.units.filter(status__in = statuses)
+
+    tracker = BackfillProgress(run, units.count())
+
+    run.status = BackfillRun.RUNNING
+    run.save(update_fields = ['status', 'updated_at'])
+
+    def commit(fetched):
+        done = commitUnits(store, fetched)
+        tracker.done += done
+        tracker.failed += len(fetched) - done
+
+        logger.info('%s', tracker)
+        if progress != None:
+            progress(tracker)
+
+    try:
+        fetched = []
+        with closing(iterFetchUnits(iterPendingUnits(units), pool, max_workers, retries, rate_limiter = rate_limiter)) as outcomes:
+            for outcome in outcomes:
+                fetched.append(outcome)
+                if len(fetched) >= commit_size:
+                    commit(fetched)
+                    fetched = []
+
+        if len(fetched) > 0:
+            commit(fetched)
+
+        # Also covers stock codes loaded by earlier executions of the run, indexStock skips those already indexed
+        if index:
+            for stock_code in run.units.filter(status = BackfillUnit.DONE).values_list('stock_code', flat = True).distinct().order_by('stock_code'):
+                indexStock(stock_code, store)
+
+        run.status = BackfillRun.DONE
+
+    finally:
+        # Interrupted runs keep their pending units for the next execution
+        if run.status != BackfillRun.DONE:
+            run.status = BackfillRun.STOPPED
+        run.save(update_fields = ['status', 'updated_at'])
+
+    return backfillStats(run)
@@ -0,0 +1,212 @@
+import logging
+
+import pandas as pd
+
+from .changes import CHG_SUMMARY_COLUMNS
+from .instrumentation import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Sessions shared by every stock code analysed in the current worker process
+WORKER_POOL = None
+
+def initWorker(backend, url, max_workers):
+
+    """Prepares a batch worker process: Django setup and a fetcher pool shared across stock codes"""
+
+    global WORKER_POOL
+
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    from multiprocessing.util import Finalize
+    from .fetchers import closeSharedPools, sharedPool
+
+    WORKER_POOL = sharedPool(backend, url, max_workers)
+
+    # Worker processes leave through os._exit, skipping atexit, multiprocessing finalizers still run
+    Finalize(WORKER_POOL, closeSharedPools, exitpriority = 10)
+
+def analyseStock(stock_code, start_date, end_date, chg_threshold, incremental, connection_options, collect_metrics = False):
+
+    """
+    Runs the change analysis of a single stock code within a batch
+
+    Returns
+    -------
+    tuple
+        (stock_code, chg_summary, failed_dates, error, metrics) where error is None when the analysis completed and
+        metrics the instrumentation of this stock code when collect_metrics is set (worker processes), None otherwise
+    """
+
+    from .hkex import HKEXInput, HKEXConnection
+
+    if collect_metrics:
+        METRICS.reset()
+
+    hkex_obj = HKEXConnection(HKEXInput(stock_code, start_date, end_date, chg_threshold),
+                              pool = WORKER_POOL,
+                              **connection_options
+                              )
+
+    try:
+        if incremental:
+            hkex_obj.runIncrementalChangeAnalysis()
+        else:
+            hkex_obj.runChangeAnalysis()
+    except Exception as e:
+        return stock_code, None, [], type(e).__name__ + ': ' + str(e), METRICS.export() if collect_metrics else None
+    finally:
+        hkex_obj.close()
+
+    failed_dates = sorted(hkex_obj.fetch_report.failed) if hkex_obj.fetch_report != None else []
+
+    return stock_code, hkex_obj.chg_summary, failed_dates, None, METRICS.export() if collect_metrics else None
+
+class BatchResult():
+
+    """Consolidated outcome of a batch change analysis"""
+
+    def __init__(self):
+        self.chg_summary = pd.DataFrame(columns = ['Stock Code'] + CHG_SUMMARY_COLUMNS)
+        self.transfers = None
+        self.failed = {}
+        self.failed_dates = {}
+
+    def __str__(self):
+
+        report = (str(self.chg_summary['Stock Code'].nunique()) + ' stock codes with changes, ' +
+                  str(len(self.chg_summary)) + ' changes, ' +
+                  (str(len(self.transfers)) + ' probable transfers, ' if self.transfers is not None else '') +
+                  str(len(self.failed)) + ' stock codes failed')
+
+        for stock_code, error in sorted(self.failed.items()):
+            report += '\n  ' + stock_code + ': ' + error
+
+        for stock_code, dates in sorted(self.failed_dates.items()):
+            report += '\n  ' + stock_code + ': missing dates ' + ', '.join(dates)
+
+        return report
+
+def runBatchChangeAnalysis(stock_codes, start_date, end_date, chg_threshold, processes = 4,
+                           backend = 'http', url = None, max_workers = 4, rate_limit = 4, incremental = False, output = None,
+                           transfers_output = None, progress = None, **connection_options):
+
+    """
+    Parameters
+    ----------
+    stock_codes : list of str
+        HK Stock Codes to analyse
+    start_date : str
+        Start date of analysis
+    end_date : str
+        End date of analysis
+    chg_threshold : float
+        Threshold used to identify transactions between parties
+    processes : int
+        Number of stock codes analysed in parallel, each in its own process. 1 runs in the calling process.
+    backend : str
+        Fetch backend of each worker, see HKEXConnection
+    url : str, optional
+        Address of the searchsdw.aspx page, defaults to the HKEX website
+    max_workers : int
+        Number of sessions per worker process, shared by all of its stock codes
+    rate_limit : float, optional
+        Maximum number of requests per second sent to the host by the whole batch, split evenly across processes
+    incremental : bool
+        Only fetch and diff dates after the last ones analysed for each stock code, see runIncrementalChangeAnalysis
+    output : str, optional
+        Path of the consolidated change report (CSV)
+    transfers_output : str, optional
+        Path of the probable transfers matched across all stock codes of the change report (CSV)
+    progress : callable, optional
+        Called as progress(stock_codes_done, stock_codes_total, stock_code) as each stock code completes
+    connection_options
+        Further HKEXConnection options (retries, selenium_fallback)
+
+    Returns
+    -------
+    BatchResult
+    """
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from django.db import connections
+    from .fetchers import HKEX_URL
+    from .hkex import normalizeStockCode
+
+    stock_codes = list(dict.fromkeys(normalizeStockCode(stock_code) for stock_code in stock_codes))
+    url = url if url != None else HKEX_URL
+    connection_options = dict(connection_options,
+                              backend = backend,
+                              url = url,
+                              max_workers = max_workers,
+                              rate_limit = rate_limit / processes if rate_limit else None
+                              )
+
+    result = BatchResult()
+    summaries = []
+    done = []
+
+    def collect(outcome):
+        stock_code, chg_summary, failed_dates, error, metrics = outcome
+
+        # Worker processes keep their own instrumentation, fold it into this process
+        if metrics != None:
+            METRICS.merge(metrics)
+
+        done.append(stock_code)
+        if progress != None:
+            progress(len(done), len(stock_codes), stock_code)
+
+        if error != None:
+            logger.warning('Change analysis failed for stock code %s - %s', stock_code, error)
+            result.failed[stock_code] = error
+            return
+
+        if len(failed_dates) > 0:
+            result.failed_dates[stock_code] = failed_dates
+
+        if chg_summary is not None:
+            chg_summary = chg_summary.copy()
+            chg_summary.insert(0, 'Stock Code', stock_code)
+            summaries.append(chg_summary)
+
+    if processes == 1:
+        initWorker(backend, url, max_workers)
+        for stock_code in stock_codes:
+            collect(analyseStock(stock_code, start_date, end_date, chg_threshold, incremental, connection_options))
+
+    else:
+        # Database connections must not be shared with forked workers
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers = processes,
+                                 initializer = initWorker,
+                                 initargs = (backend, url, max_workers)
+                                 ) as executor:
+            futures = [executor.submit(analyseStock, stock_code, start_date, end_date, chg_threshold, incremental, connection_options, True)
+                       for stock_code in stock_codes]
+
+            for future in as_completed(futures):
+                collect(future.result())
+
+    if len(summaries) > 0:
+        result.chg_summary = (pd.concat(summaries, ignore_index = True)
+                              .sort_values(['Stock Code', 'Date of Transaction', 'Participant ID'], kind = 'stable')
+                              .reset_index(drop = True)
+                              )
+
+    if output != None:
+        result.chg_summary.to_csv(output, index = False)
+
+    if transfers_output != None:
+        from .transfers import matchTransfers, summaryChanges
+
+        # One vectorised pass over every stock code and date of the batch
+        result.transfers = matchTransfers(summaryChanges(result.chg_summary))
+        result.transfers.to_csv(transfers_output, index = False)
+
+    return result
@@ -0,0 +1,457 @@
+import contextlib
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+
+from .standin import FIXTURES_DIR, HKEXStandIn, HKEXStandInServer, syntheticPage
+
+# Last date of the analysis windows, the stand-in serves recorded pages where there are any and synthetic ones otherwise
+BENCHMARK_END_DATE = '2022/09/19'
+
+# Pages the parser is benchmarked on when none were recorded from HKEX
+SYNTHETIC_PAGES = [('00001', '2022/09/15'), ('00001', '2022/09/16'), ('00001', '2022/09/19'), ('00700', '2022/09/16'), ('00700', '2022/09/19')]
+
+def timeCall(function, *args, repeat = 5):
+
+    """Returns the best wall time in seconds of repeat calls of function(*args)"""
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+
+    return best
+
+@contextlib.contextmanager
+def quietLogs():
+
+    """Keeps the per-date progress messages of the analyses out of the benchmark output"""
+
+    app_logger = logging.getLogger('myapp')
+    level = app_logger.level
+    app_logger.setLevel(logging.WARNING)
+
+    try:
+        yield
+    finally:
+        app_logger.setLevel(level)
+
+def latencyStats(timings):
+
+    """Summary (seconds) of a list of individual timings"""
+
+    timings = np.asarray(timings, dtype = float)
+
+    return {'n': len(timings),
+            'mean_s': float(timings.mean()),
+            'median_s': float(np.median(timings)),
+            'p95_s': float(np.percentile(timings, 95)),
+            'min_s': float(timings.min()),
+            'max_s': float(timings.max())
+            }
+
+@contextlib.contextmanager
+def peakMemory():
+
+    """Tracks the peak of Python allocations within the block, readable as result['peak_bytes'] afterwards"""
+
+    result = {}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    try:
+        yield result
+    finally:
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+        if not tracing:
+            tracemalloc.stop()
+
+class MemoryStore():
+
+    """Snapshot store held in memory, keeps benchmark runs independent of the database and of each other"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def load(self, stock_code, dates):
+        return {d: self.snapshots[(stock_code, d)] for d in dates if (stock_code, d) in self.snapshots}
+
+    def missingDates(self, stock_code, dates):
+        return [d for d in dates if (stock_code, d) not in self.snapshots]
+
+    def put(self, stock_code, d, shareholding_data, total_issue):
+        self.snapshots[(stock_code, d)] = (shareholding_data, total_issue)
+
+def recordedPages(fixtures_dir = FIXTURES_DIR):
+
+    """Returns the result pages recorded from HKEX (see hkex_record_pages) as a dict of <stock_code>/<YYYYMMDD> to HTML source"""
+
+    return {path.parent.name + '/' + path.stem: path.read_text(encoding = 'utf-8')
+            for path in sorted(fixtures_dir.glob('*/*.html'))}
+
+def syntheticPages(pages = SYNTHETIC_PAGES):
+
+    """Returns synthetic result pages of (stock code, date) pairs as a dict of <stock_code>/<YYYYMMDD> to HTML source"""
+
+    return {stock_code + '/' + d.replace('/',''): syntheticPage(stock_code, d) for stock_code, d in pages}
+
+def benchmarkParser(pages = None, repeat = 5):
+
+    """
+    Compares the dedicated result page parser against the generic pd.read_html path on the pages recorded from HKEX,
+    on synthetic pages when none were recorded. Timings on synthetic pages say little about real ones, their markup
+    is generated by the stand-in
+
+    Returns
+    -------
+    dict
+        Best per-page parse time (seconds) of each parser, their ratio, the pages used and their source ('recorded',
+        'synthetic' or 'given')
+    """
+
+    import pandas as pd
+    from .parser import parseResultPage, parseResultPageReadHtml
+
+    source = 'given'
+    if pages == None:
+        pages = recordedPages()
+        source = 'recorded'
+    if len(pages) == 0:
+        pages = syntheticPages()
+        source = 'synthetic'
+
+    results = {'source': source, 'pages': len(pages), 'per_page': {}}
+    read_html_total = 0
+    dedicated_total = 0
+
+    for name, page_source in pages.items():
+        # Both parsers must agree before their timings are comparable
+        expected, expected_total_issue = parseResultPageReadHtml(page_source)
+        parsed, total_issue = parseResultPage(page_source)
+        pd.testing.assert_frame_equal(parsed, expected, check_dtype = False)
+        assert total_issue == expected_total_issue
+
+        read_html = timeCall(parseResultPageReadHtml, page_source, repeat = repeat)
+        dedicated = timeCall(parseResultPage, page_source, repeat = repeat)
+
+        results['per_page'][name] = {'rows': len(parsed), 'read_html_s': read_html, 'dedicated_s': dedicated}
+        read_html_total += read_html
+        dedicated_total += dedicated
+
+    if len(pages) > 0:
+        results['read_html_s'] = read_html_total / len(pages)
+        results['dedicated_s'] = dedicated_total / len(pages)
+        results['speedup'] = read_html_total / dedicated_total
+
+    return results
+
+def analysisWindow(dates, end_date = BENCHMARK_END_DATE):
+
+    """Returns the start date of a window of the given number of trading days ending on end_date"""
+
+    from .tradingcalendar import defaultCalendar
+
+    calendar = defaultCalendar()
+
+    start_date = end_date
+    for _ in range(dates - 1):
+        start_date = calendar.previousTradingDay(start_date)
+
+    return start_date
+
+def benchmarkFetch(stock_codes = ('00001', '00700'), dates = 20, latency = 0):
+
+    """
+    Measures per-date fetch + parse latency of the HTTP backend against the local stand-in, serving the recorded pages
+    and synthetic pages for other dates
+
+    Returns
+    -------
+    dict
+        Latency statistics of fetching, parsing and both, over all stock codes and dates
+    """
+
+    from .fetchers import HttpFetcher
+    from .parser import parseResultPage
+    from .tradingcalendar import defaultCalendar
+
+    trading_days = defaultCalendar().tradingDays(analysisWindow(dates), BENCHMARK_END_DATE)
+
+    fetch_times = []
+    parse_times = []
+
+    with HKEXStandInServer(HKEXStandIn(latency = latency)) as server:
+        fetcher = HttpFetcher(server.url)
+        try:
+            for stock_code in stock_codes:
+                for d in trading_days:
+                    start = time.perf_counter()
+                    page_source = fetcher.fetchPage(stock_code, d)
+                    fetched = time.perf_counter()
+                    parseResultPage(page_source)
+                    fetch_times.append(fetched - start)
+                    parse_times.append(time.perf_counter() - fetched)
+        finally:
+            fetcher.close()
+
+    return {'stock_codes': list(stock_codes),
+            'fetch': latencyStats(fetch_times),
+            'parse': latencyStats(parse_times),
+            'fetch_parse': latencyStats(np.add(fetch_times, parse_times))
+            }
+
+def benchmarkChangeAnalysis(sizes = (20, 250, 1000), stock_code = '00700', chg_threshold = 0.01, max_workers = 4, latency = 0):
+
+    """
+    Measures end-to-end runChangeAnalysis time for windows of the given numbers of trading days, cold (every date
+    fetched from the stand-in and parsed) and warm (every date already in the snapshot store), and the peak memory
+    of the analysis itself
+
+    Returns
+    -------
+    dict
+        Per window size: dates, changes found, cold/warm seconds and peak bytes
+    """
+
+    from .fetchers import FetcherPool, makeFetcher
+    from .hkex import HKEXInput, HKEXConnection
+
+    results = {}
+
+    with HKEXStandInServer(HKEXStandIn(latency = latency)) as server:
+        for size in sizes:
+            store = MemoryStore()
+            hkex_input = HKEXInput(stock_code, analysisWindow(size), BENCHMARK_END_DATE, chg_threshold)
+            result = {}
+
+            # tracemalloc slows allocation heavy code (and the in-process stand-in) several fold, so timings come
+            # from untraced runs and the peak from a further warm run
+            for run in ['cold', 'warm', 'peak']:
+                # Sessions of a pool of its own, cold runs include connecting to the stand-in
+                pool = FetcherPool(lambda: makeFetcher('http', server.url), max_workers)
+                hkex_obj = HKEXConnection(hkex_input, store = store, url = server.url, selenium_fallback = False,
+                                          max_workers = max_workers, rate_limit = None, pool = pool)
+                try:
+                    with quietLogs(), (peakMemory() if run == 'peak' else contextlib.nullcontext({})) as memory:
+                        start = time.perf_counter()
+                        hkex_obj.runChangeAnalysis()
+                        elapsed = time.perf_counter() - start
+                finally:
+                    hkex_obj.close()
+                    pool.close()
+
+                if run == 'peak':
+                    result['peak_bytes'] = memory['peak_bytes']
+                else:
+                    result[run + '_s'] = elapsed
+
+            result['dates'] = len(hkex_obj.date_plan.dates)
+            result['changes'] = 0 if hkex_obj.chg_summary is None else len(hkex_obj.chg_summary)
+            results[str(size)] = result
+
+    return results
+
+def benchmarkViews(repeat = 5, participants = 250, dates = 250):
+
+    """
+    Measures response times of the web views for a completed job with synthetic results, inside a transaction
+    that is rolled back so that nothing is left in the database
+
+    Returns
+    -------
+    dict
+        Best response time (seconds) and size of each view, the chart both rendered and served from the cache
+    """
+
+    import pandas as pd
+    from django.core.cache import cache
+    from django.db import transaction
+    from django.test import Client
+    from .changes import CHG_SUMMARY_COLUMNS
+    from .charts import chartKey
+    from .jobs import saveResults
+    from .models import AnalysisJob
+    from .standin import syntheticSnapshot
+
+    rng = np.random.default_rng(0)
+
+    rows, total_issue = syntheticSnapshot('00700', BENCHMARK_END_DATE, participants)
+    shareholding_data = pd.DataFrame(rows, columns = ['participant_id', 'participant_name', 'participant_address', 'participant_shares'])
+    shareholding_data['participant_pct_holding'] = shareholding_data['participant_shares'] / total_issue
+
+    changes = participants * dates // 20
+    chg_summary = pd.DataFrame({CHG_SUMMARY_COLUMNS[0]: rng.choice(shareholding_data['participant_id'], changes),
+                                CHG_SUMMARY_COLUMNS[1]: 'PARTICIPANT',
+                                CHG_SUMMARY_COLUMNS[2]: rng.normal(0, 0.02, changes),
+                                CHG_SUMMARY_COLUMNS[3]: pd.Timestamp(BENCHMARK_END_DATE) - pd.to_timedelta(rng.integers(0, dates, changes), unit = 'D')
+                                })
+
+    client = Client()
+    results = {}
+
+    def timeView(name, url, **headers):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url, **headers)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, name + ' returned ' + str(response.status_code)
+        results[name] = {'best_s': min(timings), 'bytes': len(content)}
+
+    with transaction.atomic():
+        job = AnalysisJob.objects.create(stock_code = '00700',
+                                         start_date = analysisWindow(dates),
+                                         end_date = BENCHMARK_END_DATE,
+                                         chg_threshold = 0.01,
+                                         status = AnalysisJob.DONE
+                                         )
+        saveResults(job, shareholding_data, chg_summary)
+
+        timeView('job_page', '/jobs/' + str(job.id) + '/')
+        timeView('job_status', '/jobs/' + str(job.id) + '/status/')
+
+        # Render the chart on every request, then serve it from the cache
+        timings = []
+        for _ in range(repeat):
+            cache.delete(chartKey(job.stock_code, job.end_date, 10))
+            start = time.perf_counter()
+            response = client.get('/jobs/' + str(job.id) + '/chart.png')
+            timings.append(time.perf_counter() - start)
+        results['chart_render'] = {'best_s': min(timings), 'bytes': len(response.content)}
+        timeView('chart_cached', '/jobs/' + str(job.id) + '/chart.png')
+
+        timeView('changes_json', '/jobs/' + str(job.id) + '/changes/?sort=-pct_change&page=2')
+        timeView('changes_csv', '/jobs/' + str(job.id) + '/changes.csv')
+
+        cache.delete(chartKey(job.stock_code, job.end_date, 10))
+        transaction.set_rollback(True)
+
+    results['changes'] = changes
+
+    return results
+
+# Modules loaded on start by the web front end, by hkex_worker before its first job and by an analysis
+IMPORT_TARGETS = ['myapp.urls', 'myapp.management.commands.hkex_worker', 'myapp.hkex']
+
+IMPORT_SCRIPT = """
+import sys
+try:
+    import resource
+except ImportError:
+    resource = None
+import django
+django.setup()
+sys.stderr.write('-- setup done\\n')
+import {module}
+if resource != None:
+    sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+"""
+
+def parseImportTime(lines):
+
+    """
+    Parses python -X importtime output
+
+    Returns
+    -------
+    tuple
+        (seconds, packages) where seconds is the cumulative time of the outermost imports and packages maps each
+        top-level package to the time spent in its own modules, slowest first
+    """
+
+    total = 0
+    packages = {}
+    entries = []
+
+    for line in lines:
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        columns = line[len('import time:'):].split('|')
+        self_us = int(columns[0])
+        cumulative_us = int(columns[1])
+        name = columns[2][1:].rstrip()
+        entries.append((len(name) - len(name.lstrip()), cumulative_us))
+
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us / 1e6
+
+    # Outermost imports include everything below them
+    if len(entries) > 0:
+        depth = min(depth for depth, _ in entries)
+        total = sum(cumulative_us for entry_depth, cumulative_us in entries if entry_depth == depth) / 1e6
+
+    return total, dict(sorted(packages.items(), key = lambda item: -item[1]))
+
+def importTimes(module, repeat = 3):
+
+    """
+    Measures the cold start cost of importing module in a fresh interpreter after django.setup(), keeping the
+    fastest of repeat runs
+
+    Returns
+    -------
+    dict
+        setup_s (django.setup()), import_s (module and everything it pulls in), peak_rss_bytes of the interpreter
+        (None where unavailable) and packages, the import time of each top-level package loaded by the module
+    """
+
+    import os
+    import subprocess
+    import sys
+    from django.conf import settings
+
+    best = None
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT.format(module = module)],
+                                   capture_output = True, text = True, cwd = settings.BASE_DIR, env = os.environ.copy())
+        if completed.returncode != 0:
+            raise RuntimeError('Could not import ' + module + ': ' + completed.stderr.strip().splitlines()[-1])
+
+        lines = completed.stderr.splitlines()
+        marker = lines.index('-- setup done')
+
+        setup_s, _ = parseImportTime(lines[:marker])
+        import_s, packages = parseImportTime(lines[marker + 1:])
+
+        if best == None or import_s < best['import_s']:
+            best = {'setup_s': setup_s,
+                    'import_s': import_s,
+                    'peak_rss_bytes': int(completed.stdout) if completed.stdout.strip() else None,
+                    'packages': packages
+                    }
+
+    return best
+
+def benchmarkImports(modules = IMPORT_TARGETS, repeat = 3):
+
+    """Import cost of each cold start target (see importTimes)"""
+
+    return {module: importTimes(module, repeat) for module in modules}
+
+def compareResults(baseline, results, path = ''):
+
+    """
+    Lists the timings of results that changed against a baseline run, as (name, baseline seconds, seconds, ratio)
+    tuples for every key ending in _s found in both
+    """
+
+    ratios = []
+
+    for key, value in results.items():
+        if key not in baseline:
+            continue
+        name = path + '.' + key if path else key
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            ratios += compareResults(baseline[key], value, name)
+        elif key.endswith('_s') and baseline[key]:
+            ratios.append((name, baseline[key], value, value / baseline[key]))
+
+    return ratios
@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+CHG_SUMMARY_COLUMNS = ['Participant ID',
+                       'Name of CCASS Participant',
+                       '% Change in total number of Issued Shares/ Warrants/ Units held',
+                       'Date of Transaction'
+                       ]
+
+def buildHoldingMatrix(shareholding_data, values = 'participant_pct_holding'):
+
+    """
+    Parameters
+    ----------
+    shareholding_data : DataFrame
+        Long-format participant rows with participant_id, participant_name, date and values columns
+    values : str
+        Column laid out in the matrix
+
+    Returns
+    -------
+    tuple
+        (dates, participant_ids, participant_names, matrix) where matrix is a dense dates x participants array,
+        with 0 for participants absent on a date. A participant listed on several rows of a date holds their sum,
+        as in concentrationMetrics. Dates and participant IDs are sorted.
+    """
+
+    # Map participant IDs and dates to integer codes
+    participant_codes, participant_ids = pd.factorize(shareholding_data['participant_id'], sort = True)
+    date_codes, dates = pd.factorize(shareholding_data['date'], sort = True)
+
+    participant_names = np.empty(len(participant_ids), dtype = object)
+    participant_names[participant_codes] = shareholding_data['participant_name'].to_numpy()
+
+    # Accumulate rather than assign, an assignment keeps only the last of repeated (date, participant) rows
+    matrix = np.zeros((len(dates), len(participant_ids)))
+    np.add.at(matrix, (date_codes, participant_codes), shareholding_data[values].to_numpy(dtype = float))
+
+    return np.asarray(dates), np.asarray(participant_ids), participant_names, matrix
+
+def computeChangeSummary(shareholding_data, chg_threshold, previous = None):
+
+    """
+    Parameters
+    ----------
+    shareholding_data : DataFrame
+        Long-format participant rows with participant_id, participant_name, participant_pct_holding and date columns
+    chg_threshold : float
+        Minimum absolute change in % holding between consecutive dates reported
+    previous : DataFrame, optional
+        Holding vector (participant_id, participant_name, participant_pct_holding) preceding the first date,
+        so that the first date is diffed against it instead of being the baseline
+
+    Returns
+    -------
+    DataFrame or None
+        Summary of changes above threshold ordered by date and participant ID, None if there are none
+    """
+
+    if previous is not None:
+        # Baseline row sorts before any YYYY/MM/DD date
+        shareholding_data = pd.concat([previous[['participant_id', 'participant_name', 'participant_pct_holding']].assign(date = ''),
+                                       shareholding_data[['participant_id', 'participant_name', 'participant_pct_holding', 'date']]
+                                       ], ignore_index = True)
+
+    dates, participant_ids, participant_names, matrix = buildHoldingMatrix(shareholding_data)
+
+    # Difference in % holdings between consecutive dates, computed in place
+    matrix[1:] -= matrix[:-1]
+    matrix[0] = 0
+
+    # Extract threshold breaches in a single pass
+    date_idx, participant_idx = np.nonzero((np.abs(matrix) >= chg_threshold) & (matrix != 0))
+
+    if len(date_idx) == 0:
+        return None
+
+    return pd.DataFrame({CHG_SUMMARY_COLUMNS[0]: participant_ids[participant_idx],
+                         CHG_SUMMARY_COLUMNS[1]: participant_names[participant_idx],
+                         CHG_SUMMARY_COLUMNS[2]: matrix[date_idx, participant_idx],
+                         CHG_SUMMARY_COLUMNS[3]: pd.to_datetime(dates[date_idx])
+                         })
+
+def latestHoldings(shareholding_data):
+
+    """Returns the holding vector (participant_id, participant_name, participant_pct_holding) of the last date of shareholding_data"""
+
+    last_date = shareholding_data['date'].max()
+
+    return (shareholding_data.loc[shareholding_data['date'] == last_date, ['participant_id', 'participant_name', 'participant_pct_holding']]
+            .reset_index(drop = True)
+            )
@@ -0,0 +1,95 @@
+import hashlib
+import threading
+
+from django.core.cache import cache
+
+from .store import isFinal, toDate
+
+CHART_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Agg canvases are independent, but text layout in matplotlib shares font caches between threads
+RENDER_LOCK = threading.Lock()
+
+def chartKey(stock_code, d, top_n):
+
+    """Cache key of the top participants chart of a stock code as of date d"""
+
+    return 'hkex-chart:' + stock_code + ':' + toDate(d).isoformat() + ':' + str(top_n)
+
+def chartETag(stock_code, d, top_n):
+    return hashlib.md5(chartKey(stock_code, d, top_n).encode()).hexdigest()
+
+def renderTopParticipants(shareholding_data, top_n = 10):
+
+    """
+    Renders a bar chart of the participants with the largest holdings, using a Figure of its own instead of the
+    global pyplot state so that concurrent requests cannot draw on each other's axes
+
+    Parameters
+    ----------
+    shareholding_data : DataFrame
+        Holdings sorted by participant_pct_holding, descending
+    top_n : int
+        Number of participants to plot
+
+    Returns
+    -------
+    bytes
+        PNG image
+    """
+
+    from io import BytesIO
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import matplotlib.ticker as mtick
+
+    top = shareholding_data.head(top_n)
+
+    with RENDER_LOCK:
+        fig = Figure(figsize = (16, 10))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+
+        ax.bar(range(len(top)), top['participant_pct_holding'].astype(float), label = 'participant_pct_holding')
+        ax.set_xticks(range(len(top)))
+        ax.set_xticklabels(top['participant_name'], rotation = 90)
+        ax.set_xlabel('participant_name')
+        ax.set_title('Top ' + str(top_n) + ' Participants by Shareholding')
+        ax.yaxis.set_major_formatter(mtick.PercentFormatter(1.0))
+        ax.legend()
+
+        fig.tight_layout()
+
+        buffer = BytesIO()
+        fig.savefig(buffer, format = 'png')
+
+    return buffer.getvalue()
+
+def topParticipantsChart(stock_code, d, top_n, loadShareholdingData):
+
+    """
+    Returns the PNG of the top participants chart of a stock code as of date d, rendering it only on a cache miss
+
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    d : str
+        Shareholding date of the holdings plotted
+    top_n : int
+        Number of participants to plot
+    loadShareholdingData : callable
+        Returns the holdings to plot, only called when the chart is not cached
+    """
+
+    key = chartKey(stock_code, d, top_n)
+
+    png = cache.get(key)
+    if png == None:
+        png = renderTopParticipants(loadShareholdingData(), top_n)
+
+        # Charts of past dates never change, today's holdings may still be revised
+        if isFinal(d):
+            cache.set(key, png, CHART_CACHE_TIMEOUT)
+
+    return png
@@ -0,0 +1,355 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .store import SNAPSHOT_COLUMNS, isFinal, toDate
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# One row per stored snapshot, facts of a snapshot are rows [offset, offset + count) of the fact arrays
+INDEX_DTYPE = np.dtype([('date', '<i4'), ('total_issue', '<i8'), ('offset', '<i8'), ('count', '<i8')])
+
+FACT_DTYPES = {'codes': np.dtype('<i4'),
+               'dates': np.dtype('<i4'),
+               'shares': np.dtype('<i8')
+               }
+
+def toDayNumber(d):
+
+    """Days since 1970/01/01, the int32 date representation of the fact table"""
+
+    return (toDate(d) - EPOCH).days
+
+def fromDayNumber(n):
+    return EPOCH + datetime.timedelta(days = int(n))
+
+# Thread locks by stock code directory, flock only serialises across processes
+DIRECTORY_LOCKS = {}
+DIRECTORY_LOCKS_LOCK = threading.Lock()
+
+def directoryLock(path):
+
+    """Returns the thread lock of a stock code directory, so that writers of different stock codes do not wait on each other"""
+
+    key = str(Path(path).resolve())
+
+    with DIRECTORY_LOCKS_LOCK:
+        if key not in DIRECTORY_LOCKS:
+            DIRECTORY_LOCKS[key] = threading.Lock()
+        return DIRECTORY_LOCKS[key]
+
+@contextlib.contextmanager
+def lockedDirectory(path):
+
+    """Serialises writers of a stock code directory across threads and processes"""
+
+    with directoryLock(path):
+        with open(path / '.lock', 'a+b') as lock_file:
+            if os.name == 'nt':
+                import msvcrt
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == 'nt':
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+class ColumnarStore():
+
+    def __init__(self, root = None):
+
+        """
+        Snapshot store keeping each stock code as a participant dimension table (participant ID, name and address
+        interned once) and a fact table of int32 participant code, int32 date and int64 shares in flat files that
+        are memory-mapped on read, so that date slices are loaded lazily.
+
+        Parameters
+        ----------
+        root : str or Path, optional
+            Directory of the store, defaults to the HKEX_COLUMNAR_STORE_DIR setting
+        """
+
+        if root == None:
+            from django.conf import settings
+            root = settings.HKEX_COLUMNAR_STORE_DIR
+
+        self.root = Path(root)
+
+    def stockDirectory(self, stock_code):
+        return self.root / stock_code
+
+    def readIndex(self, stock_code):
+
+        """Returns the snapshot index of the stock code, only rows of fully written snapshots"""
+
+        path = self.stockDirectory(stock_code) / 'index.bin'
+
+        if not path.exists():
+            return np.zeros(0, dtype = INDEX_DTYPE)
+
+        index = np.fromfile(path, dtype = np.uint8)
+
+        return index[:len(index) - len(index) % INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+
+    def readParticipants(self, stock_code):
+
+        """Returns the participant dimension table of the stock code, row i describing participant code i"""
+
+        path = self.stockDirectory(stock_code) / 'participants.json'
+
+        if not path.exists():
+            return pd.DataFrame(columns = SNAPSHOT_COLUMNS[:3])
+
+        with open(path, encoding = 'utf-8') as participants_file:
+            return pd.DataFrame(json.load(participants_file), columns = SNAPSHOT_COLUMNS[:3])
+
+    def mapFacts(self, stock_code, column):
+
+        """Memory-maps a column of the fact table, nothing is read until the array is sliced"""
+
+        path = self.stockDirectory(stock_code) / (column + '.bin')
+
+        if not path.exists() or path.stat().st_size == 0:
+            return np.zeros(0, dtype = FACT_DTYPES[column])
+
+        return np.memmap(path, dtype = FACT_DTYPES[column], mode = 'r')
+
+    def storedStockCodes(self):
+
+        """Returns the stock codes with at least one stored snapshot, sorted"""
+
+        if not self.root.exists():
+            return []
+
+        return sorted(path.name for path in self.root.iterdir() if (path / 'index.bin').exists())
+
+    def storedDates(self, stock_code):
+
+        """Returns the dates (datetime.date) of all stored snapshots of the stock code, sorted"""
+
+        return [fromDayNumber(n) for n in np.unique(self.readIndex(stock_code)['date'])]
+
+    def missingDates(self, stock_code, dates):
+
+        """Returns the subset of dates for which no snapshot is stored, in the order given"""
+
+        stored = set(self.readIndex(stock_code)['date'].tolist())
+
+        return [d for d in dates if toDayNumber(d) not in stored]
+
+    def get(self, stock_code, d):
+
+        """Returns (shareholding_data, total_issue) if the snapshot is stored, None otherwise"""
+
+        return self.load(stock_code, [d]).get(d)
+
+    def load(self, stock_code, dates):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        dates : list of str
+            Shareholding dates to load
+
+        Returns
+        -------
+        dict
+            Maps each stored date (as passed in) to a (shareholding_data, total_issue) tuple
+        """
+
+        index = self.readIndex(stock_code)
+        if len(index) == 0:
+            return {}
+
+        # First written snapshot wins should a date have been stored twice
+        index_dates, first = np.unique(index['date'], return_index = True)
+        positions = dict(zip(index_dates.tolist(), first.tolist()))
+
+        participants = None
+        codes = self.mapFacts(stock_code, 'codes')
+        shares = self.mapFacts(stock_code, 'shares')
+
+        result = {}
+        for d in dates:
+            position = positions.get(toDayNumber(d))
+            if position == None:
+                continue
+
+            if participants is None:
+                participants = self.readParticipants(stock_code).to_numpy()
+
+            # Only the pages backing this date slice are read from disk
+            entry = index[position]
+            snapshot_codes = np.asarray(codes[entry['offset']:entry['offset'] + entry['count']])
+            shareholding_data = pd.DataFrame(participants[snapshot_codes], columns = SNAPSHOT_COLUMNS[:3])
+            shareholding_data['participant_shares'] = np.asarray(shares[entry['offset']:entry['offset'] + entry['count']])
+
+            result[d] = (shareholding_data, int(entry['total_issue']))
+
+        return result
+
+    def loadFacts(self, stock_code, start_date = None, end_date = None):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        start_date : str, optional
+            First date of the slice, defaults to the first stored date
+        end_date : str, optional
+            Last date of the slice, defaults to the last stored date
+
+        Returns
+        -------
+        tuple
+            (participants, codes, dates, shares, totals) where participants is the dimension table, codes/dates/shares
+            the int32/int32/int64 fact columns of the date slice and totals maps each int32 date to its total issue
+        """
+
+        index = self.readIndex(stock_code)
+
+        start = toDayNumber(start_date) if start_date != None else np.iinfo(np.int32).min
+        end = toDayNumber(end_date) if end_date != None else np.iinfo(np.int32).max
+
+        index_dates, first = np.unique(index['date'], return_index = True)
+        entries = index[first[(index_dates >= start) & (index_dates <= end)]]
+
+        # Gather the fact rows of each snapshot in the slice, in date order
+        rows = np.concatenate([np.arange(entry['offset'], entry['offset'] + entry['count']) for entry in entries]) if len(entries) > 0 else np.zeros(0, dtype = np.int64)
+
+        return (self.readParticipants(stock_code),
+                np.asarray(self.mapFacts(stock_code, 'codes')[rows]),
+                np.asarray(self.mapFacts(stock_code, 'dates')[rows]),
+                np.asarray(self.mapFacts(stock_code, 'shares')[rows]),
+                dict(zip(entries['date'].tolist(), entries['total_issue'].tolist()))
+                )
+
+    def put(self, stock_code, d, shareholding_data, total_issue):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        d : str
+            Shareholding date
+        shareholding_data : DataFrame
+            Cleaned participant rows containing at least SNAPSHOT_COLUMNS
+        total_issue : int
+            Total number of issued shares as of date d
+        """
+
+        self.putMany(stock_code, {d: (shareholding_data, total_issue)})
+
+    def putMany(self, stock_code, snapshots):
+
+        """
+        Stores several snapshots of a stock code (dict of date to (shareholding_data, total_issue)) under one lock,
+        reading and rewriting the participant dimension table once and appending each fact column in a single write.
+        Dates already stored or not final are skipped
+        """
+
+        from .concentration import recordConcentrations
+
+        snapshots = {d: snapshot for d, snapshot in snapshots.items() if isFinal(d)}
+        if len(snapshots) == 0:
+            return
+
+        path = self.stockDirectory(stock_code)
+        path.mkdir(parents = True, exist_ok = True)
+
+        with lockedDirectory(path):
+            index = self.readIndex(stock_code)
+            stored = set(index['date'].tolist())
+
+            new = {}
+            for d, snapshot in snapshots.items():
+                if toDayNumber(d) not in stored:
+                    stored.add(toDayNumber(d))
+                    new[d] = snapshot
+
+            if len(new) == 0:
+                return
+
+            # Intern participants once in the dimension table
+            participants = self.readParticipants(stock_code)
+            participant_codes = {tuple(row): code for code, row in enumerate(participants.itertuples(index = False))}
+            new_participants = []
+
+            offset = int((index['offset'] + index['count']).max()) if len(index) > 0 else 0
+            entries = []
+            facts = {column: [] for column in FACT_DTYPES}
+
+            for d, (shareholding_data, total_issue) in new.items():
+                rows = shareholding_data[SNAPSHOT_COLUMNS[:3]].fillna('').itertuples(index = False)
+                codes = np.empty(len(shareholding_data), dtype = FACT_DTYPES['codes'])
+                for i, row in enumerate(rows):
+                    row = tuple(row)
+                    if row not in participant_codes:
+                        participant_codes[row] = len(participant_codes)
+                        new_participants.append(row)
+                    codes[i] = participant_codes[row]
+
+                facts['codes'].append(codes)
+                facts['dates'].append(np.full(len(codes), toDayNumber(d), dtype = FACT_DTYPES['dates']))
+                facts['shares'].append(shareholding_data['participant_shares'].to_numpy(dtype = FACT_DTYPES['shares']))
+
+                entries.append((toDayNumber(d), int(total_issue), offset + sum(len(codes) for codes in facts['codes'][:-1]), len(codes)))
+
+            if len(new_participants) > 0:
+                participants = pd.concat([participants, pd.DataFrame(new_participants, columns = SNAPSHOT_COLUMNS[:3])], ignore_index = True)
+                with open(path / 'participants.json.tmp', 'w', encoding = 'utf-8') as participants_file:
+                    json.dump(participants.values.tolist(), participants_file)
+                os.replace(path / 'participants.json.tmp', path / 'participants.json')
+
+            # Append facts, then the index rows which make the snapshots visible to readers
+            for column, values in facts.items():
+                with open(path / (column + '.bin'), 'r+b' if (path / (column + '.bin')).exists() else 'wb') as fact_file:
+                    # Drop rows of any interrupted write that never made it to the index
+                    fact_file.truncate(offset * FACT_DTYPES[column].itemsize)
+                    fact_file.seek(0, os.SEEK_END)
+                    fact_file.write(np.concatenate(values).tobytes())
+
+            with open(path / 'index.bin', 'ab') as index_file:
+                index_file.write(np.array(entries, dtype = INDEX_DTYPE).tobytes())
+
+        # Summary metrics live in the database whichever store holds the snapshots
+        recordConcentrations(stock_code, new)
+
+def copySnapshots(source, target, stock_code, dates = None):
+
+    """
+    Copies the snapshots of a stock code between stores (e.g. SnapshotStore to ColumnarStore)
+
+    Returns
+    -------
+    int
+        Number of snapshots copied
+    """
+
+    dates = dates if dates != None else source.storedDates(stock_code)
+    dates = target.missingDates(stock_code, [toDate(d).strftime('%Y/%m/%d') for d in dates])
+
+    copied = 0
+    for start in range(0, len(dates), 100):
+        snapshots = source.load(stock_code, dates[start:start + 100])
+        target.putMany(stock_code, snapshots)
+        copied += len(snapshots)
+
+    return copied
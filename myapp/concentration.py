@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+from django.db.models import F
+
+from .models import ConcentrationMetric
+from .store import defaultStore, toDate
+
+CONCENTRATION_FIELDS = ['total_issue', 'participants', 'ccass_shares', 'outside_ccass_shares', 'outside_ccass_pct', 'top5_pct', 'top10_pct', 'hhi']
+
+CONCENTRATION_COLUMNS = ['stock_code', 'date'] + CONCENTRATION_FIELDS
+
+def concentrationMetrics(shareholding_data, total_issue):
+
+    """
+    Parameters
+    ----------
+    shareholding_data : DataFrame
+        Participant rows of a snapshot with participant_id and participant_shares columns
+    total_issue : int
+        Total number of issued shares
+
+    Returns
+    -------
+    dict
+        CONCENTRATION_FIELDS of the snapshot. top5_pct and top10_pct are the shares of the 5 and 10 largest participants,
+        hhi the sum of squared participant shares, all as fractions of the total issue (None when it is 0)
+    """
+
+    # A participant listed on several rows holds their total
+    shares = shareholding_data.groupby('participant_id', sort = False)['participant_shares'].sum().to_numpy(dtype = np.int64)
+    shares = -np.sort(-shares)
+
+    ccass_shares = int(shares.sum())
+    total_issue = int(total_issue)
+
+    metrics = {'total_issue': total_issue,
+               'participants': int((shares > 0).sum()),
+               'ccass_shares': ccass_shares,
+               'outside_ccass_shares': total_issue - ccass_shares,
+               'outside_ccass_pct': None,
+               'top5_pct': None,
+               'top10_pct': None,
+               'hhi': None
+               }
+
+    if total_issue > 0:
+        pct = shares / total_issue
+        metrics.update({'outside_ccass_pct': (total_issue - ccass_shares) / total_issue,
+                        'top5_pct': float(pct[:5].sum()),
+                        'top10_pct': float(pct[:10].sum()),
+                        'hhi': float(np.square(pct).sum())
+                        })
+
+    return metrics
+
+def recordConcentration(stock_code, d, shareholding_data, total_issue):
+
+    """Materializes the concentration metrics of a snapshot being stored, keeping existing ones"""
+
+    recordConcentrations(stock_code, {d: (shareholding_data, total_issue)})
+
+def recordConcentrations(stock_code, snapshots):
+
+    """Materializes the concentration metrics of several snapshots (dict of date to (shareholding_data, total_issue)) at once"""
+
+    ConcentrationMetric.objects.bulk_create([ConcentrationMetric(stock_code = stock_code,
+                                                                 date = toDate(d),
+                                                                 **concentrationMetrics(shareholding_data, total_issue)
+                                                                 )
+                                             for d, (shareholding_data, total_issue) in snapshots.items()],
+                                            batch_size = 1000,
+                                            ignore_conflicts = True)
+
+def backfillConcentration(stock_code, store = None, chunk_size = 100):
+
+    """
+    Computes the concentration metrics of the stored snapshots of a stock code that have none yet, e.g. snapshots
+    stored before metrics were materialized on ingest
+
+    Returns
+    -------
+    int
+        Number of dates added
+    """
+
+    store = store if store != None else defaultStore()
+
+    recorded = set(ConcentrationMetric.objects.filter(stock_code = stock_code).values_list('date', flat = True))
+    missing = [d for d in store.storedDates(stock_code) if d not in recorded]
+
+    for start in range(0, len(missing), chunk_size):
+        snapshots = store.load(stock_code, missing[start:start + chunk_size])
+
+        ConcentrationMetric.objects.bulk_create([ConcentrationMetric(stock_code = stock_code,
+                                                                     date = d,
+                                                                     **concentrationMetrics(shareholding_data, total_issue)
+                                                                     )
+                                                 for d, (shareholding_data, total_issue) in snapshots.items()],
+                                                batch_size = 1000,
+                                                ignore_conflicts = True)
+
+    return len(missing)
+
+def concentrationSeries(stock_code, start_date = None, end_date = None):
+
+    """
+    Returns
+    -------
+    DataFrame
+        CONCENTRATION_COLUMNS rows of the stock code within [start_date, end_date], in date order
+    """
+
+    metrics = ConcentrationMetric.objects.filter(stock_code = stock_code)
+
+    if start_date != None:
+        metrics = metrics.filter(date__gte = toDate(start_date))
+    if end_date != None:
+        metrics = metrics.filter(date__lte = toDate(end_date))
+
+    return pd.DataFrame.from_records(metrics.order_by('date').values_list(*CONCENTRATION_COLUMNS), columns = CONCENTRATION_COLUMNS)
+
+def latestConcentrationDate():
+
+    """Returns the most recent date with concentration metrics, None if there are none"""
+
+    return ConcentrationMetric.objects.order_by('-date').values_list('date', flat = True).first()
+
+def screenConcentration(d, sort = '-top10_pct', limit = 100, minimums = None, maximums = None):
+
+    """
+    Ranks every stock code with metrics as of date d from the summary table alone
+
+    Parameters
+    ----------
+    d : str
+        Shareholding date
+    sort : str
+        Field to rank by, prefixed with '-' for descending order
+    limit : int
+        Maximum number of stock codes returned
+    minimums, maximums : dict, optional
+        Map fields of CONCENTRATION_FIELDS to inclusive bounds, e.g. {'top10_pct': 0.6}
+
+    Returns
+    -------
+    list of dict
+        CONCENTRATION_COLUMNS of each matching stock code
+    """
+
+    metrics = ConcentrationMetric.objects.filter(date = toDate(d))
+
+    for bounds, lookup in [(minimums, '__gte'), (maximums, '__lte')]:
+        for field, value in (bounds or {}).items():
+            if field not in CONCENTRATION_FIELDS:
+                raise ValueError('Cannot filter on ' + field + ', expected one of ' + ', '.join(CONCENTRATION_FIELDS))
+            metrics = metrics.filter(**{field + lookup: value})
+
+    field = sort.lstrip('-')
+    if field not in CONCENTRATION_FIELDS + ['stock_code']:
+        raise ValueError('Cannot sort by ' + field + ', expected one of ' + ', '.join(CONCENTRATION_FIELDS + ['stock_code']))
+
+    # Stock codes without a figure (total issue of 0) rank last either way
+    order = F(field).desc(nulls_last = True) if sort.startswith('-') else F(field).asc(nulls_last = True)
+
+    return list(metrics.order_by(order, 'stock_code').values(*CONCENTRATION_COLUMNS)[:limit])
@@ -0,0 +1,692 @@
+import atexit
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+
+from .instrumentation import increment, span
+
+HKEX_URL = "https://www3.hkexnews.hk/sdw/search/searchsdw.aspx"
+
+logger = logging.getLogger(__name__)
+
+INPUT_TAG_RE = re.compile(r'<input\b[^>]*>', re.IGNORECASE)
+
+class FormFieldParser(HTMLParser):
+
+    """Collects name/value pairs of every input element of an ASP.NET page"""
+
+    def __init__(self):
+        super().__init__()
+        self.fields = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'input':
+            return
+        attrs = dict(attrs)
+        if attrs.get('name'):
+            self.fields[attrs['name']] = attrs.get('value') or ''
+
+def parseFormFields(page_source):
+
+    """Returns the input fields (including __VIEWSTATE and friends) of the search form in page_source"""
+
+    # Only input tags matter, parsing the participant table around them costs more than the request itself
+    parser = FormFieldParser()
+    parser.feed(''.join(INPUT_TAG_RE.findall(page_source)))
+    parser.close()
+
+    return parser.fields
+
+class HttpFetcher():
+
+    def __init__(self, url = HKEX_URL, timeout = 30, pool_size = 4):
+
+        """
+        Parameters
+        ----------
+        url : str
+            Address of the searchsdw.aspx page
+        timeout : float
+            Timeout in seconds of each HTTP request
+        pool_size : int
+            Maximum number of pooled keep-alive connections to the host
+        """
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.url = url
+        self.timeout = timeout
+
+        # Pooled keep-alive session, cookies are carried between requests
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size))
+        self.session.mount('https://', HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size))
+        self.session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64)'
+
+        self.form_fields = None
+
+    def loadForm(self):
+
+        """Opens the search page and keeps the ASP.NET form fields for the next post back"""
+
+        response = self.session.get(self.url, timeout = self.timeout)
+        response.raise_for_status()
+
+        self.form_fields = parseFormFields(response.text)
+
+    def postSearch(self, stock_code, d):
+
+        """Posts the search form back the same way the btnSearch javascript does"""
+
+        form_data = dict(self.form_fields)
+        form_data.update({'__EVENTTARGET': 'btnSearch',
+                          '__EVENTARGUMENT': '',
+                          'txtShareholdingDate': d,
+                          'txtStockCode': stock_code
+                          })
+
+        return self.session.post(self.url, data = form_data, timeout = self.timeout)
+
+    def fetchPage(self, stock_code, d):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        d : str
+            Shareholding date (YYYY/MM/DD)
+
+        Returns
+        -------
+        str
+            HTML source of the search result page
+        """
+
+        if self.form_fields == None:
+            with span('page_load', stock_code = stock_code):
+                self.loadForm()
+
+        with span('search', stock_code = stock_code, date = d):
+            response = self.postSearch(stock_code, d)
+
+            if response.status_code != 200:
+                # Viewstate may have expired, reload the form once before giving up
+                self.loadForm()
+                response = self.postSearch(stock_code, d)
+
+            response.raise_for_status()
+
+            # Carry the viewstate of this response into the next request
+            self.form_fields = parseFormFields(response.text)
+
+        increment('pages_fetched')
+
+        return response.text
+
+    def healthy(self):
+
+        """Keep-alive connections are re-opened by requests as needed, a stale viewstate is reloaded by fetchPage"""
+
+        return True
+
+    def close(self):
+        self.session.close()
+
+CHROME_DRIVER_PATH = None
+CHROME_DRIVER_LOCK = threading.Lock()
+
+def chromeDriverPath():
+
+    """Installs the Chrome driver once per process, ChromeDriverManager checks the driver cache (and the network) on every call"""
+
+    global CHROME_DRIVER_PATH
+
+    with CHROME_DRIVER_LOCK:
+        if CHROME_DRIVER_PATH == None:
+            from webdriver_manager.chrome import ChromeDriverManager
+            CHROME_DRIVER_PATH = ChromeDriverManager().install()
+
+        return CHROME_DRIVER_PATH
+
+class SeleniumFetcher():
+
+    def __init__(self, url = HKEX_URL):
+
+        """
+        Parameters
+        ----------
+        url : str
+            Address of the searchsdw.aspx page
+        """
+
+        from selenium import webdriver
+
+        # Initiate Web Instance
+        options = webdriver.ChromeOptions()
+        options.add_argument('headless')
+
+        # Install Chrome Driver
+        with span('connect', backend = 'selenium'):
+            self.driver = webdriver.Chrome(chromeDriverPath(), options = options)
+
+        # Open HKEX website
+        with span('page_load'):
+            self.driver.get(url)
+
+        self.stock_code = None
+
+    def setStockCode(self, stock_code):
+
+        """Sets the stock code to be utilized for the analysis"""
+
+        # Find HTML element tagged as txtStockCode and change value
+        stock_code_element = self.driver.find_element("name", "txtStockCode")
+        stock_code_element.clear()
+        stock_code_element.send_keys(stock_code)
+
+        self.stock_code = stock_code
+
+    def fetchPage(self, stock_code, d):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        d : str
+            Shareholding date (YYYY/MM/DD)
+
+        Returns
+        -------
+        str
+            HTML source of the search result page
+        """
+
+        from selenium.webdriver.common.by import By
+
+        if stock_code != self.stock_code:
+            self.setStockCode(stock_code)
+
+        # Change date input in HKEX website
+        date_element = self.driver.find_element(By.CSS_SELECTOR,
+                                                "input#txtShareholdingDate")
+        self.driver.execute_script("arguments[0].setAttribute('value','"+ d +"')", date_element)
+
+        del date_element
+
+        # Execute javascript to display data
+        with span('search', stock_code = stock_code, date = d):
+            self.driver.find_element("id", "btnSearch").click()
+            page_source = self.driver.page_source
+
+        increment('pages_fetched')
+
+        return page_source
+
+    def healthy(self):
+
+        """Checks that the browser still responds and shows the search form"""
+
+        try:
+            self.driver.find_element("name", "txtStockCode")
+        except Exception:
+            return False
+
+        return True
+
+    def close(self):
+        self.driver.quit()
+
+def makeFetcher(backend = 'http', url = HKEX_URL):
+
+    """Creates a fetch backend, 'http' posts the search form directly while 'selenium' drives headless Chrome"""
+
+    if backend == 'http':
+        with span('connect', backend = 'http'):
+            return HttpFetcher(url)
+    elif backend == 'selenium':
+        return SeleniumFetcher(url)
+    else:
+        raise ValueError('Unknown fetch backend: ' + str(backend))
+
+class RateLimiter():
+
+    def __init__(self, rate = None):
+
+        """
+        Parameters
+        ----------
+        rate : float, optional
+            Maximum number of requests started per second, None for no limit
+        """
+
+        self.interval = 1 / rate if rate else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+
+        """Blocks until the next request slot is available"""
+
+        if self.interval == 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+# Rate limiters by (host, requests per second)
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+def getRateLimiter(url, rate):
+
+    """
+    Returns the process-wide rate limiter of the host of url at the given rate, so that concurrent analyses asking for
+    the same rate share its budget. A caller asking for another rate (e.g. a batch worker given its share of the batch
+    rate) gets a limiter of its own rather than the one created first
+    """
+
+    key = (urlparse(url).netloc, rate)
+
+    with RATE_LIMITERS_LOCK:
+        if key not in RATE_LIMITERS:
+            RATE_LIMITERS[key] = RateLimiter(rate)
+        return RATE_LIMITERS[key]
+
+class FetcherPool():
+
+    def __init__(self, factory, max_size = 4, idle_timeout = None, checkout_timeout = 120):
+
+        """
+        Parameters
+        ----------
+        factory : callable
+            Creates a new fetcher (HttpFetcher or SeleniumFetcher)
+        max_size : int
+            Maximum number of fetchers alive at the same time
+        idle_timeout : float, optional
+            Seconds after which an idle fetcher is closed, None to keep idle fetchers open
+        checkout_timeout : float, optional
+            Seconds checkout waits for a fetcher while max_size of them are checked out, None to wait indefinitely
+        """
+
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+
+        # (fetcher, time of checkin) pairs, the most recently used fetcher is handed out first
+        self.idle = queue.LifoQueue()
+        self.size = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def create(self):
+
+        """Starts a new fetcher if the pool is below max_size, returns None otherwise"""
+
+        with self.lock:
+            if self.size >= self.max_size:
+                return None
+            self.size += 1
+
+        try:
+            fetcher = self.factory()
+        except Exception:
+            with self.lock:
+                self.size -= 1
+            raise
+
+        increment('sessions_created')
+
+        return fetcher
+
+    def isStale(self, last_used):
+        return self.idle_timeout != None and time.monotonic() - last_used > self.idle_timeout
+
+    def checkout(self, timeout = None):
+
+        """
+        Returns a healthy idle fetcher, creating one while below max_size and otherwise waiting for a checkin.
+        Idle fetchers that expired or fail their health check are closed on the way. Raises TimeoutError when no
+        fetcher became available within timeout seconds (defaults to checkout_timeout)
+        """
+
+        timeout = timeout if timeout != None else self.checkout_timeout
+        deadline = time.monotonic() + timeout if timeout != None else None
+
+        while True:
+            try:
+                fetcher, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                fetcher = self.create()
+                if fetcher != None:
+                    return fetcher
+
+                if deadline != None and time.monotonic() >= deadline:
+                    raise TimeoutError('No session became available within ' + str(timeout) + 's, all ' + str(self.max_size)
+                                       + ' sessions of the pool are checked out')
+
+                # Wait in short steps, a discarded fetcher frees a slot without any checkin
+                try:
+                    fetcher, last_used = self.idle.get(timeout = 1 if deadline == None else min(1, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    continue
+
+            if self.isStale(last_used) or not fetcher.healthy():
+                self.discard(fetcher)
+                continue
+
+            increment('sessions_reused')
+
+            return fetcher
+
+    def checkin(self, fetcher, error = None):
+
+        """
+        Returns a fetcher to the pool, after a fetch that raised error if any. Session state (viewstate, browser page)
+        may be broken by a failed fetch: HTTP sessions are closed, browsers are costly to launch and stay pooled for the
+        health check of the next checkout to judge. A page without results leaves the session intact
+        """
+
+        from .parser import NoResultsError
+
+        broken = error != None and not isinstance(error, NoResultsError) and isinstance(fetcher, HttpFetcher)
+
+        if broken or self.closed:
+            self.discard(fetcher)
+        else:
+            self.idle.put((fetcher, time.monotonic()))
+
+    def discard(self, fetcher):
+
+        """Closes a fetcher and frees its slot"""
+
+        with self.lock:
+            self.size -= 1
+
+        try:
+            fetcher.close()
+        except Exception:
+            pass
+
+    def warm(self, count):
+
+        """Starts fetchers on the search page until count of them are idle or the pool is full, so that the next checkouts do not wait for a connection"""
+
+        while self.idle.qsize() < count:
+            fetcher = self.create()
+            if fetcher == None:
+                break
+
+            # Selenium opens the search page on start, HTTP sessions load it on their first fetch
+            if isinstance(fetcher, HttpFetcher):
+                fetcher.loadForm()
+
+            self.checkin(fetcher)
+
+    def evictIdle(self):
+
+        """Closes the idle fetchers that have not been used for idle_timeout seconds, returns the number closed"""
+
+        keep = []
+        evicted = 0
+        while True:
+            try:
+                fetcher, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if self.isStale(last_used):
+                self.discard(fetcher)
+                evicted += 1
+            else:
+                keep.append((fetcher, last_used))
+
+        # Put the most recently used fetchers back on top
+        for fetcher, last_used in reversed(keep):
+            self.idle.put((fetcher, last_used))
+
+        increment('sessions_evicted', evicted)
+
+        return evicted
+
+    def close(self):
+
+        """Closes every idle fetcher, fetchers still checked out are closed on checkin"""
+
+        self.closed = True
+
+        while True:
+            try:
+                fetcher, _ = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(fetcher)
+
+# Process-wide pools by (process id, backend, url), so that consecutive analyses reuse warm sessions. Forked batch
+# workers must not share the sockets and browsers of their parent, the process id keeps them apart
+SHARED_POOLS = {}
+SHARED_POOLS_LOCK = threading.Lock()
+
+def sharedPool(backend = 'http', url = HKEX_URL, max_size = None):
+
+    """
+    Returns the process-wide FetcherPool of a backend and url, created on first use with the HKEX_SESSION_POOL_SIZE,
+    HKEX_SESSION_IDLE_TIMEOUT and HKEX_SESSION_CHECKOUT_TIMEOUT settings. A larger max_size grows the pool, it is never shrunk
+    """
+
+    from django.conf import settings
+
+    with SHARED_POOLS_LOCK:
+        key = (os.getpid(), backend, url)
+        pool = SHARED_POOLS.get(key)
+
+        if pool == None:
+            idle_timeout = getattr(settings, 'HKEX_SESSION_IDLE_TIMEOUT', 300)
+            pool = FetcherPool(lambda: makeFetcher(backend, url),
+                               getattr(settings, 'HKEX_SESSION_POOL_SIZE', 4),
+                               idle_timeout,
+                               getattr(settings, 'HKEX_SESSION_CHECKOUT_TIMEOUT', 120)
+                               )
+            SHARED_POOLS[key] = pool
+
+            # Idle browsers are closed even when no further analysis comes along to notice them
+            if idle_timeout != None:
+                threading.Thread(target = evictIdleSessions, args = (pool,), daemon = True).start()
+
+        if max_size != None and max_size > pool.max_size:
+            pool.max_size = max_size
+
+        return pool
+
+def evictIdleSessions(pool):
+    while not pool.closed:
+        time.sleep(max(pool.idle_timeout / 2, 1))
+        pool.evictIdle()
+
+@atexit.register
+def closeSharedPools():
+
+    """Quits the idle sessions of every shared pool, so that no Chrome process outlives the Django process"""
+
+    with SHARED_POOLS_LOCK:
+        pools = [pool for key, pool in SHARED_POOLS.items() if key[0] == os.getpid()]
+        SHARED_POOLS.clear()
+
+    for pool in pools:
+        pool.close()
+
+class FetchReport():
+
+    """Outcome of a concurrent fetch, so that a single bad date does not fail the whole run"""
+
+    def __init__(self):
+        self.fetched = []
+        self.retries = 0
+        self.failed = {}
+        # Failed dates HKEX answered without records, which no further attempt would change
+        self.no_results = set()
+        self.lock = threading.Lock()
+
+    def __str__(self):
+
+        report = str(len(self.fetched)) + ' dates fetched, ' + str(self.retries) + ' retries, ' + str(len(self.failed)) + ' failed'
+
+        for d, error in sorted(self.failed.items()):
+            report += '\n  ' + d + ': ' + error
+
+        return report
+
+def fetchWithRetries(stock_code, d, pool, report, retries = 2, backoff = 1.0, rate_limiter = None):
+
+    """
+    Fetches and parses a single date on a session of pool, retrying after any error other than a page without results,
+    which asking again would not change
+    """
+
+    from .parser import NoResultsError, parseResultPage
+
+    for attempt in range(retries + 1):
+        fetcher = pool.checkout()
+        try:
+            if rate_limiter != None:
+                rate_limiter.wait()
+            snapshot = parseResultPage(fetcher.fetchPage(stock_code, d))
+        except Exception as e:
+            pool.checkin(fetcher, error = e)
+            if attempt == retries or isinstance(e, NoResultsError):
+                raise
+            with report.lock:
+                report.retries += 1
+            increment('retries')
+            time.sleep(backoff * 2 ** attempt)
+        else:
+            pool.checkin(fetcher)
+            return snapshot
+
+def isTransportError(error):
+
+    """Whether error is a connection failure, timeout or HTTP error status, which another backend might get past"""
+
+    import requests
+
+    return isinstance(error, requests.RequestException)
+
+def reportFailure(report, stock_code, d, error):
+    from .parser import NoResultsError
+
+    report.failed[d] = type(error).__name__ + ': ' + str(error)
+    if isinstance(error, NoResultsError):
+        report.no_results.add(d)
+    increment('fetch_failures')
+    logger.warning('Could not fetch stock code %s as of %s - %s', stock_code, d, report.failed[d])
+
+def fetchSnapshots(stock_code, dates, pool, max_workers = 4, retries = 2, backoff = 1.0, rate_limiter = None, on_fetched = None):
+
+    """
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    dates : list of str
+        Shareholding dates (YYYY/MM/DD) to fetch
+    pool : FetcherPool
+        Pool of sessions shared by the worker threads
+    max_workers : int
+        Number of dates fetched in parallel
+    retries : int
+        Number of additional attempts for a date before reporting it as failed
+    backoff : float
+        Seconds to wait before the first retry, doubled on each further retry
+    rate_limiter : RateLimiter, optional
+        Limits the rate of requests sent to the host
+    on_fetched : callable, optional
+        Called from the calling thread as on_fetched(d, snapshot) once each date is parsed
+
+    Returns
+    -------
+    tuple
+        (snapshots, report) where snapshots maps each fetched date, in date order, to its (shareholding_data, total_issue)
+    """
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    report = FetchReport()
+
+    results = {}
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = {executor.submit(fetchWithRetries, stock_code, d, pool, report, retries, backoff, rate_limiter): d for d in dates}
+
+        for future in as_completed(futures):
+            d = futures[future]
+            try:
+                results[d] = future.result()
+            except Exception as e:
+                reportFailure(report, stock_code, d, e)
+                continue
+
+            report.fetched.append(d)
+            if on_fetched != None:
+                on_fetched(d, results[d])
+
+    # Put results back in date order
+    snapshots = {d: results[d] for d in dates if d in results}
+
+    return snapshots, report
+
+def iterFetchSnapshots(stock_code, dates, pool, report, max_workers = 4, retries = 2, backoff = 1.0, rate_limiter = None):
+
+    """
+    Fetches dates in parallel like fetchSnapshots, but yields (d, snapshot) in date order as soon as each date and
+    all dates before it are done. Only a window of 2 x max_workers dates is in flight or waiting for an earlier date,
+    so memory does not grow with the number of dates. Dates that could not be fetched are yielded with a snapshot
+    of None and listed in report.failed
+    """
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    dates = iter(dates)
+    window = deque()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+
+        def submitNext():
+            for d in dates:
+                window.append((d, executor.submit(fetchWithRetries, stock_code, d, pool, report, retries, backoff, rate_limiter)))
+                return
+
+        for _ in range(2 * max_workers):
+            submitNext()
+
+        try:
+            while len(window) > 0:
+                d, future = window.popleft()
+                submitNext()
+
+                try:
+                    snapshot = future.result()
+                except Exception as e:
+                    reportFailure(report, stock_code, d, e)
+                    snapshot = None
+                else:
+                    report.fetched.append(d)
+
+                yield d, snapshot
+
+        finally:
+            # Consumer stopped early, do not fetch what it will never read
+            for _, future in window:
+                future.cancel()
@@ -1,8 +1,31 @@
 #class HKEXDataPull(stock_code, year, month, day):
+import logging
+
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
+
+from .changes import CHG_SUMMARY_COLUMNS, computeChangeSummary, latestHoldings
+from .instrumentation import increment, span
+
+logger = logging.getLogger(__name__)
+
+def normalizeStockCode(stock_code):
+
+    """Pads numeric stock codes to the 5 digits expected by HKEX (e.g. 700 -> 00700)"""
+
+    stock_code = str(stock_code).strip()
+
+    return stock_code.zfill(5) if stock_code.isdigit() else stock_code
+
+def holdingFrame(d, shareholding_data, total_issue):
+
+    """Long-format rows (participant_id, participant_name, participant_pct_holding, date) of a single snapshot"""
+
+    return pd.DataFrame({'participant_id': shareholding_data['participant_id'].to_numpy(),
+                         'participant_name': shareholding_data['participant_name'].to_numpy(),
+                         # Re-calculate % Holding as WebPage data has less precision
+                         'participant_pct_holding': shareholding_data['participant_shares'].to_numpy(dtype = float) / total_issue,
+                         'date': d
+                         })
 
 class HKEXInput():
 
@@ -12,7 +35,7 @@ class HKEXInput():
         Parameters
         ----------
         stock_code : str
-            HK Stock Code
+            HK Stock Code, numeric codes are padded to 5 digits (see normalizeStockCode) so that every store sees one key
         start_date : str
             Start date of analysis
         end_date : str
@@ -21,7 +44,7 @@ class HKEXInput():
             Threshold used to identify transactions between parties
         """
         
-        self.stock_code = stock_code
+        self.stock_code = normalizeStockCode(stock_code)
         self.start_date = start_date
         self.end_date = end_date
 
@@ -29,91 +52,382 @@ class HKEXInput():
             self.chg_threshold = chg_threshold
         else:
             self.chg_threshold = None
-            print('Warning: HKEXInput object instanced with chg_threshold set as None.')
+            logger.warning('HKEXInput object instanced with chg_threshold set as None.')
 
 class HKEXConnection():
 
-    def __init__(self, user_input: HKEXInput):
+    def __init__(self, user_input: HKEXInput, store = None, backend = 'http', url = None, selenium_fallback = True,
+                 max_workers = 4, rate_limit = 4, retries = 2, pool = None, progress = None, use_cache = False):
         
         """
         Parameters
         ----------
         user_input : HKEXInput
             HKEXInput object containing details of analysis
+        store : SnapshotStore or ColumnarStore, optional
+            Persistent snapshot store consulted before going to the HKEX website, defaults to the HKEX_SNAPSHOT_STORE setting
+        backend : str
+            Fetch backend, 'http' posts the search form directly and 'selenium' drives headless Chrome
+        url : str, optional
+            Address of the searchsdw.aspx page, defaults to the HKEX website
+        selenium_fallback : bool
+            Switch to Selenium whenever the HTTP backend fails to retrieve a page
+        max_workers : int
+            Maximum number of dates fetched in parallel, each on its own session
+        rate_limit : float, optional
+            Maximum number of requests per second sent to the HKEX host, None for no limit
+        retries : int
+            Number of additional attempts for a date before reporting it as failed
+        pool : FetcherPool, optional
+            Pool the sessions of the backend are checked out from, defaults to the process-wide pool of the backend
+            and url (see sharedPool). Sessions are only checked out while a date is being fetched
+        progress : callable, optional
+            Called as progress(dates_done, dates_total) while snapshots are loaded
+        use_cache : bool
+            Reuse the holdings time series of an identical date range from the series cache (see resultcache), so that
+            only the threshold dependent summary is recomputed
         """
 
-        from selenium import webdriver
-        from webdriver_manager.chrome import ChromeDriverManager
-        
-        # Initiate Web Instance
-        print('Initiating connection to HKEX...')
-        options = webdriver.ChromeOptions()
-        options.add_argument('headless')
-        
-        # Install Chrome Driver
-        self.driver = webdriver.Chrome(ChromeDriverManager().install(), options = options)
-        
-        # Open HKEX website
-        self.driver.get("https://www3.hkexnews.hk/sdw/search/searchsdw.aspx")
-        
+        from .fetchers import HKEX_URL
+
+        if store == None:
+            from .store import defaultStore
+            store = defaultStore()
+
         self.user_input = user_input
+        self.store = store
+        self.backend = backend
+        self.url = url if url != None else HKEX_URL
+        self.selenium_fallback = selenium_fallback
+        self.max_workers = max_workers
+        self.rate_limit = rate_limit
+        self.retries = retries
+        self.current_analysis_date = None
+        self.fetch_report = None
+        self.date_plan = None
 
-    def setStockCode(self):
-        
-        """Sets the stock code to be utilized for the analysis"""
-        
-        # Find HTML element tagged as txtStockCode and change value
-        self.driver.find_element("name", "txtStockCode").send_keys(self.user_input.stock_code)
+        # Web instances are only checked out once a snapshot is missing from the store
+        self.fetcher = None
+        self.fetcher_pool = None
+        self.fallback_pool = None
+        self.fallback_failed = False
+        self.pool = pool
+        self.progress = progress
+        self.use_cache = use_cache
+
+    def sessionPool(self):
+
+        """Returns the pool sessions of the configured backend are checked out from"""
+
+        from .fetchers import sharedPool
+
+        if self.pool == None:
+            self.pool = sharedPool(self.backend, self.url, self.max_workers)
+
+        return self.pool
+
+    def connect(self, pool = None):
+
+        """Checks out a session to the HKEX website from pool (defaults to sessionPool()), unless already connected"""
+
+        if self.fetcher != None:
+            return
+
+        logger.info('Initiating connection to HKEX...')
+        self.fetcher_pool = pool if pool != None else self.sessionPool()
+        self.fetcher = self.fetcher_pool.checkout()
+
+    def close(self, error = None):
+
+        """Returns the HKEX session to its pool, which closes it instead when error broke it (see FetcherPool.checkin)"""
+
+        if self.fetcher != None:
+            self.fetcher_pool.checkin(self.fetcher, error = error)
+            self.fetcher = None
+            self.fetcher_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(error = exc_value)
 
     def setDate(self, current_analysis_date = None):
 
-        from selenium.webdriver.common.by import By
+        """Sets the shareholding date used by runAnalysis, defaulting to the end date of the analysis"""
 
         if current_analysis_date == None:
             self.current_analysis_date = self.user_input.end_date
-        
-        # Find HTML element containing the date of data collected and manipulate value attribute
-        date_element = self.driver.find_element(By.CSS_SELECTOR, "input#txtShareholdingDate")
-        self.driver.execute_script("arguments[0].setAttribute('value','"+ self.current_analysis_date +"')", date_element)
+        else:
+            self.current_analysis_date = current_analysis_date
+
+    def scrapeSnapshot(self, d):
+
+        """
+        Parameters
+        ----------
+        d : str
+            Shareholding date (YYYY/MM/DD)
+
+        Returns
+        -------
+        tuple
+            (shareholding_data, total_issue) as displayed on the HKEX website as of date d. The session is checked out
+            for this date only and handed back to its pool afterwards
+        """
+
+        from .fetchers import HttpFetcher, isTransportError, sharedPool
+        from .parser import NoResultsError, parseResultPage
+
+        self.connect(self.fallback_pool)
+
+        logger.info('Extracting data for stock code %s as of date %s', self.user_input.stock_code, d)
+
+        try:
+            snapshot = parseResultPage(self.fetcher.fetchPage(self.user_input.stock_code, d))
+
+        except Exception as e:
+            http = isinstance(self.fetcher, HttpFetcher)
+            self.close(error = e)
+
+            # The session answered, and no other backend would find records for this date either
+            if isinstance(e, NoResultsError):
+                raise
+
+            if not http:
+                self.dropFallback()
+
+            if not (http and self.canFallBack() and isTransportError(e)):
+                raise
+
+            # Fall back to driving headless Chrome for the rest of the analysis
+            logger.warning('HTTP fetch failed (%s), falling back to Selenium...', e)
+            increment('selenium_fallbacks')
+            self.fallback_pool = sharedPool('selenium', self.url)
+            self.connect(self.fallback_pool)
+
+            try:
+                snapshot = parseResultPage(self.fetcher.fetchPage(self.user_input.stock_code, d))
+            except Exception as fallback_error:
+                self.close(error = fallback_error)
+                if not isinstance(fallback_error, NoResultsError):
+                    self.dropFallback()
+                raise
+
+        # Nothing pins a session between dates, so connections that are never closed cannot exhaust the pool
+        self.close()
+
+        return snapshot
+
+    def canFallBack(self):
+
+        """Whether an HTTP failure may still be retried on Selenium, a connection gives up on it after one failed browser"""
+
+        return self.selenium_fallback and self.backend == 'http' and not self.fallback_failed
+
+    def dropFallback(self):
+
+        """Goes back to plain HTTP for the rest of the analysis after the fallback browser failed"""
+
+        self.fallback_pool = None
+        self.fallback_failed = True
+
+    def retryable(self, d):
+
+        """Whether a date the concurrent fetch failed on gets a last sequential attempt, which may fall back to Selenium"""
+
+        return self.canFallBack() and d not in self.fetch_report.no_results
+
+    def loadSnapshots(self, dates):
+
+        """
+        Parameters
+        ----------
+        dates : list of str
+            Shareholding dates (YYYY/MM/DD)
+
+        Returns
+        -------
+        dict
+            Maps each date to its (shareholding_data, total_issue), only going to the HKEX website for dates missing from the store.
+            Dates that could not be fetched are left out and listed in fetch_report.
+        """
+
+        from .fetchers import fetchSnapshots, getRateLimiter
+
+        with span('store_load', stock_code = self.user_input.stock_code, dates = len(dates)):
+            snapshots = self.store.load(self.user_input.stock_code, dates)
+        missing = [d for d in dates if d not in snapshots]
+
+        increment('store_hits', len(snapshots))
+        increment('store_misses', len(missing))
+
+        def reportProgress():
+            if self.progress != None:
+                self.progress(len(snapshots), len(dates))
+
+        reportProgress()
+
+        if len(missing) > 1 and self.max_workers > 1:
+
+            def persist(d, snapshot):
+                logger.info('Extracted data for stock code %s as of date %s', self.user_input.stock_code, d)
+                with span('store_put'):
+                    self.store.put(self.user_input.stock_code, d, *snapshot)
+                snapshots[d] = snapshot
+                reportProgress()
+
+            # Fetch missing dates in parallel, persisting each one as soon as it is parsed
+            fetched, self.fetch_report = fetchSnapshots(self.user_input.stock_code,
+                                                        missing,
+                                                        self.sessionPool(),
+                                                        max_workers = self.max_workers,
+                                                        retries = self.retries,
+                                                        rate_limiter = getRateLimiter(self.url, self.rate_limit),
+                                                        on_fetched = persist
+                                                        )
+            snapshots.update(fetched)
+
+            # Give failed dates a last sequential attempt, which may fall back to Selenium
+            for d in list(self.fetch_report.failed):
+                if self.retryable(d):
+                    try:
+                        snapshots[d] = self.scrapeSnapshot(d)
+                    except Exception:
+                        continue
+                    self.store.put(self.user_input.stock_code, d, *snapshots[d])
+                    self.fetch_report.fetched.append(d)
+                    del self.fetch_report.failed[d]
+                    reportProgress()
+
+            logger.log(logging.WARNING if len(self.fetch_report.failed) > 0 else logging.INFO, '%s', self.fetch_report)
+
+        else:
+            for d in missing:
+                snapshots[d] = self.scrapeSnapshot(d)
+                with span('store_put'):
+                    self.store.put(self.user_input.stock_code, d, *snapshots[d])
+                reportProgress()
+
+        return {d: snapshots[d] for d in dates if d in snapshots}
+
+    def iterSnapshots(self, dates = None, chunk_size = 20):
+
+        """
+        Yields (d, shareholding_data, total_issue) for each settlement date of the analysis, in date order, as soon as
+        it is read from the store or fetched. Fetched dates are persisted on the way. Only chunk_size stored snapshots
+        and the window of dates being fetched are held at a time, whatever the length of the range
+
+        Parameters
+        ----------
+        dates : list of str, optional
+            Shareholding dates (YYYY/MM/DD) in date order, defaults to analysisDates()
+        chunk_size : int
+            Number of stored snapshots read from the store at a time
+
+        Dates that could not be fetched are skipped and listed in fetch_report
+        """
+
+        from .fetchers import FetchReport, getRateLimiter, iterFetchSnapshots
+
+        stock_code = self.user_input.stock_code
+
+        dates = list(dates) if dates != None else self.analysisDates()
+        missing = set(self.store.missingDates(stock_code, dates))
+        stored_dates = [d for d in dates if d not in missing]
+
+        increment('store_hits', len(stored_dates))
+        increment('store_misses', len(missing))
+
+        self.fetch_report = FetchReport()
+        fetched = iterFetchSnapshots(stock_code,
+                                     [d for d in dates if d in missing],
+                                     self.sessionPool(),
+                                     self.fetch_report,
+                                     max_workers = self.max_workers,
+                                     retries = self.retries,
+                                     rate_limiter = getRateLimiter(self.url, self.rate_limit)
+                                     )
+
+        stored = {}
+        loaded = set()
+        stored_position = 0
+
+        try:
+            for i, d in enumerate(dates):
+                if d in missing:
+                    _, snapshot = next(fetched)
+
+                    # Give a failed date a last sequential attempt, which may fall back to Selenium
+                    if snapshot == None and self.retryable(d):
+                        try:
+                            snapshot = self.scrapeSnapshot(d)
+                        except Exception:
+                            pass
+                        else:
+                            self.fetch_report.fetched.append(d)
+                            del self.fetch_report.failed[d]
+
+                    if snapshot == None:
+                        continue
+
+                    logger.info('Extracted data for stock code %s as of date %s', stock_code, d)
+                    with span('store_put'):
+                        self.store.put(stock_code, d, *snapshot)
+
+                else:
+                    if d not in loaded:
+                        chunk = stored_dates[stored_position:stored_position + chunk_size]
+                        stored_position += len(chunk)
+                        loaded = set(chunk)
+                        with span('store_load', stock_code = stock_code, dates = len(chunk)):
+                            stored = self.store.load(stock_code, chunk)
+
+                    snapshot = stored.pop(d, None)
+                    if snapshot == None:
+                        continue
+
+                if self.progress != None:
+                    self.progress(i + 1, len(dates))
+
+                yield (d,) + tuple(snapshot)
+
+        finally:
+            fetched.close()
+
+    def iterChanges(self, chg_threshold = None):
+
+        """
+        Yields (d, changes) for each settlement date after the first one available, as soon as its snapshot is, where
+        changes holds the CHG_SUMMARY_COLUMNS rows of the participants whose % holding moved by at least chg_threshold
+        (defaults to the threshold of the input) since the previous snapshot, empty when none did. Only the previous
+        holding vector is kept between dates, so consumers can write or alert on changes in constant memory
+        """
+
+        chg_threshold = chg_threshold if chg_threshold != None else self.user_input.chg_threshold
+
+        previous = None
+        for d, shareholding_data, total_issue in self.iterSnapshots():
+            current = holdingFrame(d, shareholding_data, total_issue)
+
+            if previous is not None:
+                with span('diff', stock_code = self.user_input.stock_code, date = d):
+                    changes = computeChangeSummary(current, chg_threshold, previous = previous)
+
+                yield d, changes if changes is not None else pd.DataFrame(columns = CHG_SUMMARY_COLUMNS)
+
+            # A single date's rows are its holding vector
+            previous = current
 
     def runAnalysis(self):
         
         """Runs shareholding analysis as of end date"""
-        
-        from selenium.webdriver.common.by import By
-        
-        # Set stock code
-        self.setStockCode()
 
-        print('Extracting data for stock code '+ self.user_input.stock_code +' as of date '+ self.current_analysis_date)
+        if self.current_analysis_date == None:
+            self.setDate()
 
-        # Execute javascript to display data
-        self.driver.find_element("id", "btnSearch").click()
-        
-        # Retrieve data from HTML source
-        shareholding_data = pd.read_html(self.driver.page_source)[0]
-        
-        # Rename columns
-        shareholding_data.columns = ['participant_id',
-                                     'participant_name',
-                                     'participant_address',
-                                     'participant_shares',
-                                     'participant_pct_holding'
-                                     ]
-        
-        # Clean data from unnecessary taggings
-        shareholding_data['participant_id']          = shareholding_data['participant_id'].str.slice(start = 16)
-        shareholding_data['participant_name']        = shareholding_data['participant_name'].str.slice(start = 69)
-        shareholding_data['participant_address']     = shareholding_data['participant_address'].str.slice(start = 9)
-        shareholding_data['participant_shares']      = shareholding_data['participant_shares'].str.slice(start = 14)
-        shareholding_data['participant_shares']      = shareholding_data['participant_shares'].str.replace(',','').astype(float)
-        shareholding_data['participant_pct_holding'] = shareholding_data['participant_pct_holding'].str.slice(start = 57)
-        
-        # Find total issue for selected stock code
-        total_issue = float(self.driver.find_element(By.XPATH, "//div[contains(@class,'summary-value')]")
-                            .text
-                            .replace(',','')
-                            )
+        shareholding_data, total_issue = self.loadSnapshots([self.current_analysis_date])[self.current_analysis_date]
+        shareholding_data = shareholding_data.copy()
         
         # Re-calculate % Holding as WebPage data has less precision
         shareholding_data['participant_pct_holding'] = shareholding_data['participant_shares'] / total_issue
@@ -123,126 +437,171 @@ class HKEXConnection():
 
         self.shareholding_data = shareholding_data
 
+    def analysisDates(self):
+
+        """Returns the settlement dates (YYYY/MM/DD) between start and end date, skipping weekends and HKEX holidays"""
+
+        from .tradingcalendar import planDates
+
+        self.date_plan = planDates(self.user_input.start_date, self.user_input.end_date)
+        increment('holiday_fetches_saved', self.date_plan.fetches_saved)
+
+        return self.date_plan.dates
+
+    def dropDuplicateSnapshots(self, snapshots):
+
+        """Leaves out snapshots identical to the prior date's, which cannot contain a change"""
+
+        from .tradingcalendar import dropDuplicateSnapshots
+
+        snapshots, duplicates = dropDuplicateSnapshots(snapshots)
+        increment('duplicate_snapshots_skipped', len(duplicates))
+
+        if self.date_plan != None:
+            self.date_plan.duplicates_skipped += duplicates
+            logger.info('%s', self.date_plan)
+
+        return snapshots
+
+    def buildShareholdingData(self, snapshots):
+
+        """Collects snapshots into a single long-format DataFrame of participant_id, participant_name, participant_pct_holding and date"""
+
+        if len(snapshots) == 0:
+            raise RuntimeError('No shareholding data could be retrieved for stock code ' + self.user_input.stock_code)
+
+        with span('aggregate', stock_code = self.user_input.stock_code, dates = len(snapshots)):
+            # Collect per-date frames and concatenate them once
+            frames = [holdingFrame(d, temp_shareholding_data, total_issue) for d, (temp_shareholding_data, total_issue) in snapshots.items()]
+
+            return pd.concat(frames, ignore_index = True)
+
     def runChangeAnalysis(self):
         
         """Runs shareholding analysis between two dates and generates DataFrame containing summary of transactions above threshold"""
 
-        from pandas.tseries.offsets import BDay
-        from selenium.webdriver.common.by import By
-        
-        # Extract business days between start and end date
-        bdays = pd.date_range(self.user_input.start_date,
-                              self.user_input.end_date,
-                              freq=BDay()
-                              ).strftime('%Y/%m/%d').values
-
-        # Set stock code
-        self.setStockCode()
-        
-        # Initialize DataFrame for analysis
-        shareholding_data = pd.DataFrame(columns=['participant_id',
-                                                  'participant_name',
-                                                  'participant_address',
-                                                  'participant_shares',
-                                                  'participant_pct_holding',
-                                                  'date'
-                                                  ])
-        
-        # Iterate through all business days
-        for d in bdays:
-            print('Extracting data for stock code '+
-                  self.user_input.stock_code +
-                  ' as of date '+
-                  d
-                  )
-            
-            # Change date input in HKEX website
-            date_element = self.driver.find_element(By.CSS_SELECTOR,
-                                               "input#txtShareholdingDate")
-            
-            # Collect data from website
-            self.driver.execute_script("arguments[0].setAttribute('value','"+ d +"')", date_element)
-
-            del date_element
-
-            # Execute javascript to display data
-            self.driver.find_element("id", "btnSearch").click()
-            
-            # Read HTML source data
-            temp_shareholding_data = pd.read_html(self.driver.page_source)[0]
-
-            temp_shareholding_data.columns = ['participant_id',
-                                         'participant_name',
-                                         'participant_address',
-                                         'participant_shares',
-                                         'participant_pct_holding'
-                                         ]
-            
-            # Clean raw HTML data into structured DataFrame
-            temp_shareholding_data['participant_id']          = temp_shareholding_data['participant_id'].str.slice(start = 16)
-            temp_shareholding_data['participant_name']        = temp_shareholding_data['participant_name'].str.slice(start = 69)
-            temp_shareholding_data['participant_address']     = temp_shareholding_data['participant_address'].str.slice(start = 9)
-            temp_shareholding_data['participant_shares']      = temp_shareholding_data['participant_shares'].str.slice(start = 14)
-            temp_shareholding_data['participant_shares']      = temp_shareholding_data['participant_shares'].str.replace(',','').astype(float)
-            temp_shareholding_data['participant_pct_holding'] = temp_shareholding_data['participant_pct_holding'].str.slice(start = 57)
-            temp_shareholding_data['date']                    = d
-            
-            # Extract total issue
-            total_issue = float(self.driver.find_element(By.XPATH, "//div[contains(@class,'summary-value')]").text.replace(',',''))
-            
-            # Re-calculate % Holding as WebPage data has less precision
-            temp_shareholding_data['participant_pct_holding'] = temp_shareholding_data['participant_shares'] / total_issue
-            
-            # Concatenate data as of t to overall DataFrame
-            shareholding_data = pd.concat([shareholding_data, temp_shareholding_data], ignore_index = True)
-        
-        # Create time-series of shareholding data
-        shareholding_ts = shareholding_data.pivot(index   = ['participant_id', 'participant_name'],
-                                                  columns = 'date',
-                                                  values  = 'participant_pct_holding').T
+        from .resultcache import getSeries, putSeries
+
+        # Extract settlement dates between start and end date
+        bdays = self.analysisDates()
+
+        # Holdings of every date do not depend on the threshold, a cached range is only re-thresholded
+        shareholding_data = getSeries(self.user_input) if self.use_cache else None
+
+        if shareholding_data is None:
+            # Retrieve snapshots from the store, fetching only missing dates from the website
+            snapshots = self.loadSnapshots(bdays)
+
+            snapshots = self.dropDuplicateSnapshots(snapshots)
+
+            shareholding_data = self.buildShareholdingData(snapshots)
+
+            # Ranges missing dates that could not be fetched are not cached
+            if self.use_cache and (self.fetch_report == None or len(self.fetch_report.failed) == 0):
+                putSeries(self.user_input, shareholding_data)
+        else:
+            increment('series_cache_hits')
 
-        del shareholding_data
-        
         # Calculate difference in % holdings and create summary DataFrame
-        shareholding_ts = shareholding_ts.fillna(0)
+        with span('diff', stock_code = self.user_input.stock_code):
+            chg_summary = computeChangeSummary(shareholding_data, self.user_input.chg_threshold)
 
-        shareholding_ts.index = pd.to_datetime(shareholding_ts.index)
-        shareholding_ts = shareholding_ts.diff()
-        shareholding_ts = shareholding_ts.fillna(0)
+        del shareholding_data
 
-        shareholding_ts[(shareholding_ts < self.user_input.chg_threshold) & (shareholding_ts > -self.user_input.chg_threshold)] = 0
+        if chg_summary is None:
+            self.reportNoChanges()
+
+        self.chg_summary = chg_summary
+
+    def runIncrementalChangeAnalysis(self):
+
+        """
+        Runs the change analysis only over dates after the last one analysed for this stock code and threshold,
+        appending new transactions above threshold to the stored ones. chg_summary covers the whole date range.
+        """
 
-        shareholding_ts = shareholding_ts.loc[:, (shareholding_ts != 0).any(axis=0)]
-        shareholding_ts = shareholding_ts.loc[(shareholding_ts != 0).any(axis=1)]
+        import datetime
+        from .incremental import loadState, holdingVector, saveIncrement, loadChanges
+        from .store import toDate
+        from .tradingcalendar import defaultCalendar
 
-        if len(shareholding_ts.columns) == 0:
+        bdays = self.analysisDates()
+        if len(bdays) == 0:
+            raise RuntimeError('No settlement dates between ' + self.user_input.start_date + ' and ' + self.user_input.end_date)
 
-            print('No shareholders have shifted their % shareholding by more than or equal to +-' +
-                  str(self.user_input.chg_threshold * 100) +
-                  '% between ' +
-                  self.user_input.start_date +
-                  ' and ' +
-                  self.user_input.end_date + '.'
-                  )
+        state = loadState(self.user_input.stock_code, self.user_input.chg_threshold)
 
-            self.chg_summary = None
+        # Start a new time series when none is stored or the range starts before the stored one
+        if state != None and toDate(bdays[0]) < state.first_date:
+            state = None
 
+        if state == None:
+            new_dates = bdays
         else:
-            chg_summary = pd.DataFrame(columns = ['Participant ID',
-                                                  'Name of CCASS Participant',
-                                                  '% Change in total number of Issued Shares/ Warrants/ Units held',
-                                                  'Date of Transaction'
-                                                  ])
-
-            for d in shareholding_ts.index:
-                temp_data = shareholding_ts.loc[d, :].to_frame()
-                temp_data = temp_data[temp_data[d]!=0]
-                temp_data = temp_data.reset_index()
-                temp_data = temp_data.rename(columns = {'participant_id': 'Participant ID',
-                                                        'participant_name': 'Name of CCASS Participant',
-                                                        d: '% Change in total number of Issued Shares/ Warrants/ Units held'})
-                temp_data['Date of Transaction'] = d
-
-                chg_summary = pd.concat([chg_summary, temp_data], ignore_index = True)
-
-            self.chg_summary = chg_summary
+            # Continue from the day after the stored series even when the window starts later, so that the first new
+            # date is diffed against the holdings of the trading day before it and the series never has gaps
+            new_dates = defaultCalendar().tradingDays(state.last_date + datetime.timedelta(days = 1), bdays[-1])
+
+        if len(new_dates) > 0:
+            snapshots = self.loadSnapshots(new_dates)
+
+            # Only extend the time series up to the first date that could not be fetched
+            new_dates = new_dates[:next((i for i, d in enumerate(new_dates) if d not in snapshots), len(new_dates))]
+
+        if len(new_dates) > 0:
+            shareholding_data = self.buildShareholdingData(self.dropDuplicateSnapshots({d: snapshots[d] for d in new_dates}))
+
+            # Diff the new dates against the stored holding vector only
+            with span('diff', stock_code = self.user_input.stock_code):
+                chg_summary = computeChangeSummary(shareholding_data,
+                                                   self.user_input.chg_threshold,
+                                                   previous = holdingVector(state) if state != None else None
+                                                   )
+
+            state = saveIncrement(self.user_input.stock_code,
+                                  self.user_input.chg_threshold,
+                                  new_dates[0],
+                                  new_dates[-1],
+                                  latestHoldings(shareholding_data),
+                                  chg_summary,
+                                  state
+                                  )
+
+            del shareholding_data
+
+        if state == None:
+            raise RuntimeError('No shareholding data could be retrieved for stock code ' + self.user_input.stock_code)
+
+        chg_summary = loadChanges(state, bdays[0], bdays[-1])
+
+        if chg_summary is None:
+            self.reportNoChanges()
+
+        self.chg_summary = chg_summary
+
+    def runTransferMatching(self, tolerance = 0.1):
+
+        """
+        Pairs offsetting changes of chg_summary (run a change analysis first) into probable transfers between participants
+
+        Parameters
+        ----------
+        tolerance : float
+            Maximum size difference of the two legs of a transfer relative to the larger one
+        """
+
+        from .transfers import TRANSFER_COLUMNS, matchTransfers, summaryChanges
+
+        if self.chg_summary is None:
+            self.transfers = pd.DataFrame(columns = TRANSFER_COLUMNS)
+            return
+
+        self.transfers = matchTransfers(summaryChanges(self.chg_summary, self.user_input.stock_code), tolerance)
+
+    def reportNoChanges(self):
+
+        logger.info('No shareholders have shifted their %% shareholding by more than or equal to +-%s%% between %s and %s.',
+                    self.user_input.chg_threshold * 100,
+                    self.user_input.start_date,
+                    self.user_input.end_date
+                    )
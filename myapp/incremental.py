@@ -0,0 +1,97 @@
+import json
+
+import pandas as pd
+from django.db import transaction
+
+from .changes import CHG_SUMMARY_COLUMNS
+from .models import ChangeAnalysisState, ShareholdingChange
+from .store import toDate
+
+def loadState(stock_code, chg_threshold):
+
+    """Returns the ChangeAnalysisState of the stock code at the given threshold, None if it was never analysed incrementally"""
+
+    return ChangeAnalysisState.objects.filter(stock_code = stock_code, chg_threshold = chg_threshold).first()
+
+def holdingVector(state):
+
+    """Returns the holding vector stored on state as a DataFrame of participant_id, participant_name and participant_pct_holding"""
+
+    return pd.DataFrame(json.loads(state.holdings), columns = ['participant_id', 'participant_name', 'participant_pct_holding'])
+
+def saveIncrement(stock_code, chg_threshold, first_date, last_date, holdings, chg_summary, state = None):
+
+    """
+    Appends new threshold breaches and moves the stored holding vector forward to last_date
+
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    chg_threshold : float
+        Threshold of the change analysis
+    first_date : str
+        First date of the stored time series, only used when state is None
+    last_date : str
+        Last date covered by this increment
+    holdings : DataFrame
+        Holding vector as of last_date
+    chg_summary : DataFrame or None
+        New threshold breaches, all dated after the previous last date of state
+    state : ChangeAnalysisState, optional
+        State the increment extends, None to start a new time series (replacing any stored one)
+
+    Returns
+    -------
+    ChangeAnalysisState
+    """
+
+    holdings_json = json.dumps(holdings[['participant_id', 'participant_name', 'participant_pct_holding']].values.tolist())
+
+    with transaction.atomic():
+        if state == None:
+            ChangeAnalysisState.objects.filter(stock_code = stock_code, chg_threshold = chg_threshold).delete()
+            state = ChangeAnalysisState.objects.create(stock_code = stock_code,
+                                                       chg_threshold = chg_threshold,
+                                                       first_date = toDate(first_date),
+                                                       last_date = toDate(last_date),
+                                                       holdings = holdings_json
+                                                       )
+        else:
+            # Only extend the time series if no concurrent run already did
+            if not ChangeAnalysisState.objects.filter(id = state.id, last_date = state.last_date).update(last_date = toDate(last_date), holdings = holdings_json):
+                state.refresh_from_db()
+                return state
+
+            state.refresh_from_db()
+
+        if chg_summary is not None:
+            ShareholdingChange.objects.bulk_create([
+                ShareholdingChange(state = state,
+                                   participant_id = row[0],
+                                   participant_name = row[1],
+                                   pct_change = float(row[2]),
+                                   transaction_date = toDate(row[3])
+                                   )
+                for row in chg_summary[CHG_SUMMARY_COLUMNS].itertuples(index = False)
+            ])
+
+    return state
+
+def loadChanges(state, after_date, end_date):
+
+    """Returns the stored breaches of state dated after after_date and up to end_date in chg_summary layout, None if there are none"""
+
+    changes = list(ShareholdingChange.objects
+                   .filter(state = state, transaction_date__gt = toDate(after_date), transaction_date__lte = toDate(end_date))
+                   .order_by('transaction_date', 'participant_id')
+                   .values_list('participant_id', 'participant_name', 'pct_change', 'transaction_date')
+                   )
+
+    if len(changes) == 0:
+        return None
+
+    chg_summary = pd.DataFrame(changes, columns = CHG_SUMMARY_COLUMNS)
+    chg_summary['Date of Transaction'] = pd.to_datetime(chg_summary['Date of Transaction'])
+
+    return chg_summary
@@ -0,0 +1,147 @@
+"""Timing spans and counters of the scrape pipeline, logged and exported as Prometheus text"""
+
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_PREFIX = 'hkex_'
+
+COUNTER_HELP = {'pages_fetched': 'Result pages retrieved from HKEX',
+                'fetch_failures': 'Dates that could not be retrieved after all retries',
+                'retries': 'Fetch attempts repeated after an error',
+                'selenium_fallbacks': 'Switches from the HTTP backend to Selenium',
+                'sessions_created': 'HTTP sessions and browsers started by the session pools',
+                'sessions_reused': 'Idle sessions handed out again by the session pools',
+                'sessions_evicted': 'Idle sessions closed by the session pools after the idle timeout',
+                'rows_parsed': 'Participant rows parsed from result pages',
+                'parser_fallbacks': 'Result pages read with pd.read_html as their cells did not line up with the table rows',
+                'store_hits': 'Snapshots served from the snapshot store',
+                'store_misses': 'Snapshots missing from the snapshot store',
+                'holiday_fetches_saved': 'Weekday fetches skipped as HKEX holidays',
+                'series_cache_hits': 'Change analyses served from the holdings time series cache',
+                'summary_cache_hits': 'Analysis jobs answered from the result cache',
+                'duplicate_snapshots_skipped': 'Snapshots identical to the prior date left out of the diff'
+                }
+
+class Metrics():
+
+    """Thread-safe registry of counters and stage duration histograms of the current process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}
+
+    def increment(self, name, value = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            if stage not in self.spans:
+                self.spans[stage] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(SPAN_BUCKETS)}
+            span = self.spans[stage]
+            span['count'] += 1
+            span['sum'] += seconds
+            for i, bound in enumerate(SPAN_BUCKETS):
+                if seconds <= bound:
+                    span['buckets'][i] += 1
+
+    def export(self):
+
+        """Returns the full state of the registry, to be merged into the registry of another process"""
+
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'spans': {stage: dict(span, buckets = list(span['buckets'])) for stage, span in self.spans.items()}
+                    }
+
+    def merge(self, state):
+
+        """Adds the exported state of another registry (e.g. of a batch worker process) to this one"""
+
+        with self.lock:
+            for name, value in state['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for stage, other in state['spans'].items():
+                if stage not in self.spans:
+                    self.spans[stage] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(SPAN_BUCKETS)}
+                span = self.spans[stage]
+                span['count'] += other['count']
+                span['sum'] += other['sum']
+                span['buckets'] = [a + b for a, b in zip(span['buckets'], other['buckets'])]
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.spans = {}
+
+    def snapshot(self):
+
+        """Returns a copy of the counters and of the count and total seconds of each stage"""
+
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'spans': {stage: {'count': span['count'], 'sum': span['sum']} for stage, span in self.spans.items()}
+                    }
+
+    def prometheusText(self):
+
+        """Renders the registry in the Prometheus text exposition format"""
+
+        state = self.export()
+        counters = state['counters']
+        spans = state['spans']
+
+        lines = []
+
+        for name in sorted(counters):
+            metric = METRIC_PREFIX + name + '_total'
+            lines.append('# HELP ' + metric + ' ' + COUNTER_HELP.get(name, name.replace('_', ' ')))
+            lines.append('# TYPE ' + metric + ' counter')
+            lines.append(metric + ' ' + repr(counters[name]))
+
+        if len(spans) > 0:
+            metric = METRIC_PREFIX + 'stage_seconds'
+            lines.append('# HELP ' + metric + ' Duration of scrape pipeline stages')
+            lines.append('# TYPE ' + metric + ' histogram')
+            for stage in sorted(spans):
+                span = spans[stage]
+                for bound, count in zip(SPAN_BUCKETS, span['buckets']):
+                    lines.append(metric + '_bucket{stage="' + stage + '",le="' + repr(float(bound)) + '"} ' + str(count))
+                lines.append(metric + '_bucket{stage="' + stage + '",le="+Inf"} ' + str(span['count']))
+                lines.append(metric + '_sum{stage="' + stage + '"} ' + repr(span['sum']))
+                lines.append(metric + '_count{stage="' + stage + '"} ' + str(span['count']))
+
+        return '\n'.join(lines) + '\n'
+
+METRICS = Metrics()
+
+def increment(name, value = 1):
+
+    """Adds value to the process-wide counter name (see COUNTER_HELP)"""
+
+    METRICS.increment(name, value)
+
+@contextlib.contextmanager
+def span(stage, **context):
+
+    """
+    Times the enclosed block as a stage of the scrape pipeline (connect, page_load, search, parse, clean, store_load,
+    store_put, aggregate, diff), recording its duration in the process-wide histogram and logging it at DEBUG level
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe(stage, elapsed)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('%s took %.1f ms %s', stage, elapsed * 1000, ' '.join(k + '=' + str(v) for k, v in context.items()))
@@ -0,0 +1,225 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AnalysisJob, JobChange, JobHolding
+
+# Running jobs without a progress update for this long are considered abandoned by their worker
+STALE_AFTER = datetime.timedelta(minutes = 10)
+
+def submitJob(stock_code, start_date, end_date, chg_threshold):
+
+    """
+    Queues an analysis, reusing the pending or running job of an identical request. Requests answered by the result
+    cache get a job that is already done
+
+    Returns
+    -------
+    tuple
+        (job, created)
+    """
+
+    from .hkex import HKEXInput, normalizeStockCode
+    from .instrumentation import increment
+    from .resultcache import getSummary
+    from .store import toDate
+
+    # Spellings of the same request share a job, whatever the format of the dates
+    stock_code = normalizeStockCode(stock_code)
+    start_date = toDate(start_date).strftime('%Y/%m/%d')
+    end_date = toDate(end_date).strftime('%Y/%m/%d')
+
+    job = (AnalysisJob.objects
+           .filter(stock_code = stock_code,
+                   start_date = start_date,
+                   end_date = end_date,
+                   chg_threshold = chg_threshold
+                   )
+           .filter(Q(status = AnalysisJob.PENDING) |
+                   Q(status = AnalysisJob.RUNNING, updated_at__gte = timezone.now() - STALE_AFTER)
+                   )
+           .order_by('created_at')
+           .first()
+           )
+
+    if job != None:
+        return job, False
+
+    cached = getSummary(HKEXInput(stock_code, start_date, end_date, chg_threshold))
+
+    if cached != None:
+        increment('summary_cache_hits')
+        with transaction.atomic():
+            job = AnalysisJob.objects.create(stock_code = stock_code,
+                                             start_date = start_date,
+                                             end_date = end_date,
+                                             chg_threshold = chg_threshold,
+                                             status = AnalysisJob.DONE
+                                             )
+            saveResults(job, *cached)
+        return job, True
+
+    job = AnalysisJob.objects.create(stock_code = stock_code,
+                                     start_date = start_date,
+                                     end_date = end_date,
+                                     chg_threshold = chg_threshold
+                                     )
+
+    return job, True
+
+def claimJob():
+
+    """Marks the oldest pending job as running and returns it, None if the queue is empty"""
+
+    # Requeue jobs whose worker stopped sending progress
+    (AnalysisJob.objects
+     .filter(status = AnalysisJob.RUNNING, updated_at__lt = timezone.now() - STALE_AFTER)
+     .update(status = AnalysisJob.PENDING, updated_at = timezone.now())
+     )
+
+    while True:
+        job = AnalysisJob.objects.filter(status = AnalysisJob.PENDING).order_by('created_at').first()
+
+        if job == None:
+            return None
+
+        # Only one worker wins the update when several poll the queue
+        if AnalysisJob.objects.filter(id = job.id, status = AnalysisJob.PENDING).update(status = AnalysisJob.RUNNING, updated_at = timezone.now()):
+            job.refresh_from_db()
+            return job
+
+def runJob(job, **connection_options):
+
+    """
+    Runs the change analysis and the shareholding analysis as of end date of a claimed job, storing results on the job
+
+    Parameters
+    ----------
+    job : AnalysisJob
+        Job claimed by the worker
+    connection_options
+        HKEXConnection options (backend, url, max_workers, ...)
+    """
+
+    from .hkex import HKEXInput, HKEXConnection
+    from .instrumentation import increment
+    from .resultcache import getSummary, putSummary
+
+    def progress(dates_done, dates_total):
+        AnalysisJob.objects.filter(id = job.id).update(dates_fetched = dates_done,
+                                                       dates_total = dates_total,
+                                                       updated_at = timezone.now()
+                                                       )
+
+    hkex_input = HKEXInput(job.stock_code, job.start_date, job.end_date, job.chg_threshold)
+
+    # An identical analysis finished since the job was submitted
+    cached = getSummary(hkex_input)
+    if cached != None:
+        increment('summary_cache_hits')
+        job.status = AnalysisJob.DONE
+        with transaction.atomic():
+            saveResults(job, *cached)
+            job.save(update_fields = ['status', 'updated_at'])
+        return job
+
+    hkex_obj = HKEXConnection(hkex_input, progress = progress, use_cache = True, **connection_options)
+
+    try:
+        # End date snapshot is stored by runAnalysis and reused by the change analysis, which reports progress last
+        hkex_obj.setDate()
+        hkex_obj.runAnalysis()
+        hkex_obj.runChangeAnalysis()
+
+    except Exception as e:
+        job.status = AnalysisJob.FAILED
+        job.error = type(e).__name__ + ': ' + str(e)
+        job.save(update_fields = ['status', 'error', 'updated_at'])
+        return job
+
+    finally:
+        hkex_obj.close()
+
+    job.status = AnalysisJob.DONE
+
+    # Dates that could not be fetched are left out of the change analysis, and the incomplete results out of the cache
+    if hkex_obj.fetch_report != None and len(hkex_obj.fetch_report.failed) > 0:
+        job.error = 'Dates missing from the analysis: ' + ', '.join(sorted(hkex_obj.fetch_report.failed))
+    else:
+        putSummary(hkex_input, hkex_obj.shareholding_data, hkex_obj.chg_summary)
+
+    # Result rows and the done status become visible together
+    with transaction.atomic():
+        saveResults(job, hkex_obj.shareholding_data, hkex_obj.chg_summary)
+        job.save(update_fields = ['status', 'error', 'updated_at'])
+
+    return job
+
+def saveResults(job, shareholding_data, chg_summary):
+
+    """
+    Stores the results of a job as JobHolding and JobChange rows, replacing any stored earlier
+
+    Parameters
+    ----------
+    job : AnalysisJob
+        Job the results belong to
+    shareholding_data : DataFrame
+        Holdings as of end date (see HKEXConnection.runAnalysis), in the order they are listed
+    chg_summary : DataFrame or None
+        Threshold breaches in CHG_SUMMARY_COLUMNS layout, None when no change breached the threshold
+    """
+
+    import pandas as pd
+    from .changes import CHG_SUMMARY_COLUMNS
+
+    JobHolding.objects.filter(job = job).delete()
+    JobChange.objects.filter(job = job).delete()
+
+    rows = shareholding_data[['participant_id', 'participant_name', 'participant_address', 'participant_shares', 'participant_pct_holding']]
+    JobHolding.objects.bulk_create([JobHolding(job = job,
+                                               participant_id = participant_id,
+                                               participant_name = participant_name,
+                                               participant_address = participant_address if isinstance(participant_address, str) else '',
+                                               participant_shares = int(participant_shares),
+                                               participant_pct_holding = float(participant_pct_holding)
+                                               )
+                                    for participant_id, participant_name, participant_address, participant_shares, participant_pct_holding
+                                    in rows.itertuples(index = False)],
+                                   batch_size = 1000)
+
+    if chg_summary is not None:
+        JobChange.objects.bulk_create([JobChange(job = job,
+                                                 participant_id = participant_id,
+                                                 participant_name = participant_name,
+                                                 pct_change = float(pct_change),
+                                                 transaction_date = pd.Timestamp(transaction_date).date()
+                                                 )
+                                       for participant_id, participant_name, pct_change, transaction_date
+                                       in chg_summary[CHG_SUMMARY_COLUMNS].itertuples(index = False)],
+                                      batch_size = 1000)
+
+def loadResults(job):
+
+    """
+    Returns
+    -------
+    tuple
+        (shareholding_data, chg_summary) DataFrames of a completed job, chg_summary is None when no change breached the threshold
+    """
+
+    import pandas as pd
+    from .changes import CHG_SUMMARY_COLUMNS
+
+    fields = ['participant_id', 'participant_name', 'participant_address', 'participant_shares', 'participant_pct_holding']
+    shareholding_data = pd.DataFrame.from_records(list(job.holdings.order_by('id').values_list(*fields)), columns = fields)
+
+    chg_summary = None
+    changes = list(job.changes.order_by('id').values_list('participant_id', 'participant_name', 'pct_change', 'transaction_date'))
+    if len(changes) > 0:
+        chg_summary = pd.DataFrame.from_records(changes, columns = CHG_SUMMARY_COLUMNS)
+        chg_summary['Date of Transaction'] = pd.to_datetime(chg_summary['Date of Transaction'])
+
+    return shareholding_data, chg_summary
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.backfill import backfillStats, planBackfill, runBackfill
+from myapp.models import BackfillRun
+
+class Command(BaseCommand):
+
+    help = 'Loads the snapshots of many stock codes over a date range into the snapshot store, resumable after an interruption'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='*', help='HK Stock Codes to backfill')
+        parser.add_argument('--codes-file', help='File with one stock code per line')
+        parser.add_argument('--start', help='Start date (YYYY/MM/DD) of a new run')
+        parser.add_argument('--end', help='End date (YYYY/MM/DD) of a new run, defaults to the previous trading day')
+        parser.add_argument('--resume', type=int, help='Id of a stopped run to continue instead of planning a new one')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry the units that failed in earlier executions')
+        parser.add_argument('--status', action='store_true', help='List backfill runs and their units per status')
+        parser.add_argument('--commit-size', type=int, default=50, help='Snapshots fetched and committed per transaction')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent HKEX sessions')
+        parser.add_argument('--rate-limit', type=float, default=4, help='Maximum requests per second to HKEX')
+        parser.add_argument('--backend', default='http', choices=['http', 'selenium'])
+        parser.add_argument('--url', help='Address of searchsdw.aspx, e.g. a local hkex_standin server')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for run in BackfillRun.objects.order_by('id'):
+                self.stdout.write(str(run) + ' - ' + ', '.join(str(units) + ' ' + status for status, units in backfillStats(run).items()))
+            return
+
+        if options['resume'] != None:
+            run = BackfillRun.objects.filter(id=options['resume']).first()
+            if run == None:
+                raise CommandError('No backfill run ' + str(options['resume']))
+        else:
+            import datetime
+            from myapp.tradingcalendar import defaultCalendar
+
+            stock_codes = list(options['stock_codes'])
+            if options['codes_file']:
+                with open(options['codes_file']) as codes_file:
+                    stock_codes += [line.split('#')[0].strip() for line in codes_file if line.split('#')[0].strip()]
+
+            if len(stock_codes) == 0 or not options['start']:
+                raise CommandError('Stock codes and --start are required for a new run, or --resume the id of a stopped one')
+
+            end_date = options['end'] or defaultCalendar().previousTradingDay(datetime.date.today())
+
+            run = planBackfill(stock_codes, options['start'], end_date)
+            self.stdout.write('Planned ' + str(run) + ' with ' + str(run.units.count()) + ' units, resume it with --resume ' + str(run.id))
+
+        stats = runBackfill(run,
+                            backend=options['backend'],
+                            url=options['url'],
+                            max_workers=options['workers'],
+                            rate_limit=options['rate_limit'],
+                            commit_size=options['commit_size'],
+                            retry_failed=options['retry_failed'],
+                            progress=lambda tracker: self.stdout.write(str(tracker))
+                            )
+
+        self.stdout.write(str(run) + ' - ' + ', '.join(str(units) + ' ' + status for status, units in stats.items()))
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.batch import runBatchChangeAnalysis
+from myapp.hkex import normalizeStockCode
+
+class Command(BaseCommand):
+
+    help = 'Runs the shareholding change analysis for a list of stock codes and writes one consolidated change report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='*', help='HK Stock Codes to analyse')
+        parser.add_argument('--codes-file', help='File with one stock code per line, e.g. the HSI/HSCEI constituents')
+        parser.add_argument('--start', help='Start date (YYYY/MM/DD), defaults to --days trading days before --end')
+        parser.add_argument('--end', help='End date (YYYY/MM/DD), defaults to the previous trading day')
+        parser.add_argument('--days', type=int, default=20, help='Length of the window in trading days when --start is omitted')
+        parser.add_argument('--threshold', type=float, required=True, help='Change threshold, e.g. 0.01 for 1%%')
+        parser.add_argument('--output', required=True, help='Path of the consolidated change report (CSV)')
+        parser.add_argument('--transfers-output', help='Path of the probable transfers paired from offsetting changes (CSV)')
+        parser.add_argument('--processes', type=int, default=4, help='Stock codes analysed in parallel')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent HKEX sessions per process')
+        parser.add_argument('--rate-limit', type=float, default=4, help='Maximum requests per second to HKEX across all processes')
+        parser.add_argument('--incremental', action='store_true', help='Only fetch and diff dates after the last run of each stock code (rolling windows)')
+        parser.add_argument('--backend', default='http', choices=['http', 'selenium'])
+        parser.add_argument('--url', help='Address of searchsdw.aspx, e.g. a local hkex_standin server')
+
+    def handle(self, *args, **options):
+        import datetime
+        from myapp.tradingcalendar import defaultCalendar
+
+        stock_codes = list(options['stock_codes'])
+        if options['codes_file']:
+            with open(options['codes_file']) as codes_file:
+                stock_codes += [line.split('#')[0].strip() for line in codes_file if line.split('#')[0].strip()]
+
+        if len(stock_codes) == 0:
+            raise CommandError('No stock codes given')
+
+        calendar = defaultCalendar()
+
+        end_date = options['end'] or calendar.previousTradingDay(datetime.date.today())
+
+        start_date = options['start']
+        if not start_date:
+            start_date = end_date
+            for _ in range(options['days']):
+                start_date = calendar.previousTradingDay(start_date)
+
+        self.stdout.write('Analysing ' + str(len(stock_codes)) + ' stock codes between ' + start_date + ' and ' + end_date)
+
+        result = runBatchChangeAnalysis(stock_codes,
+                                        start_date,
+                                        end_date,
+                                        options['threshold'],
+                                        processes=options['processes'],
+                                        backend=options['backend'],
+                                        url=options['url'],
+                                        max_workers=options['workers'],
+                                        rate_limit=options['rate_limit'],
+                                        incremental=options['incremental'],
+                                        output=options['output'],
+                                        transfers_output=options['transfers_output'],
+                                        progress=lambda done, total, stock_code: self.stdout.write('[%d/%d] %s' % (done, total, stock_code))
+                                        )
+
+        self.stdout.write(str(result))
+        self.stdout.write('Change report written to ' + options['output'])
+        if options['transfers_output']:
+            self.stdout.write('Probable transfers written to ' + options['transfers_output'])
+
+        if len(result.failed) == len({normalizeStockCode(stock_code) for stock_code in stock_codes}):
+            raise CommandError('Change analysis failed for every stock code')
@@ -0,0 +1,88 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.benchmarks import benchmarkChangeAnalysis, benchmarkFetch, benchmarkImports, benchmarkParser, benchmarkViews, compareResults
+
+SUITES = ['parser', 'fetch', 'analysis', 'views', 'imports']
+
+class Command(BaseCommand):
+
+    help = 'Runs offline performance benchmarks against recorded (or synthetic) HKEX result pages and the local stand-in'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help='Benchmarks to run (' + ', '.join(SUITES) + '), defaults to all')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetitions per measurement, the best one is kept')
+        parser.add_argument('--sizes', default='20,250,1000', help='Window lengths in trading days of the change analysis benchmark')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds the stand-in waits before each answer, to emulate HKEX round trips')
+        parser.add_argument('--output', help='Path of the JSON results, to compare against later runs')
+        parser.add_argument('--baseline', help='JSON results of an earlier run, timings are printed as ratios against it')
+
+    def handle(self, *args, **options):
+        import datetime
+        import platform
+        import django
+        import numpy as np
+        import pandas as pd
+
+        suites = options['suites'] or SUITES
+        for suite in suites:
+            if suite not in SUITES:
+                raise CommandError('Unknown benchmark suite: ' + suite)
+
+        results = {'run': {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                           'python': platform.python_version(),
+                           'django': django.get_version(),
+                           'pandas': pd.__version__,
+                           'numpy': np.__version__,
+                           'machine': platform.machine()
+                           }}
+
+        if 'parser' in suites:
+            results['parser'] = benchmarkParser(repeat=options['repeat'])
+            self.stdout.write('Parser: read_html %.2f ms/page, dedicated %.2f ms/page (%.1fx faster) on %d %s pages' % (results['parser']['read_html_s'] * 1000,
+                                                                                                                 results['parser']['dedicated_s'] * 1000,
+                                                                                                                 results['parser']['speedup'],
+                                                                                                                 results['parser']['pages'],
+                                                                                                                 results['parser']['source']
+                                                                                                                 ))
+
+        if 'fetch' in suites:
+            results['fetch'] = benchmarkFetch(latency=options['latency'])
+            self.stdout.write('Fetch + parse: median %.2f ms/date, p95 %.2f ms/date' % (results['fetch']['fetch_parse']['median_s'] * 1000,
+                                                                                       results['fetch']['fetch_parse']['p95_s'] * 1000
+                                                                                       ))
+
+        if 'analysis' in suites:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+            results['analysis'] = benchmarkChangeAnalysis(sizes, latency=options['latency'])
+            for size, result in results['analysis'].items():
+                self.stdout.write('Change analysis over %s dates: cold %.2f s, warm %.3f s, peak %.1f MB' % (size,
+                                                                                                             result['cold_s'],
+                                                                                                             result['warm_s'],
+                                                                                                             result['peak_bytes'] / 2 ** 20
+                                                                                                             ))
+
+        if 'views' in suites:
+            results['views'] = benchmarkViews(repeat=options['repeat'])
+            for view, result in results['views'].items():
+                if isinstance(result, dict):
+                    self.stdout.write('View %s: %.1f ms, %d bytes' % (view, result['best_s'] * 1000, result['bytes']))
+
+        if 'imports' in suites:
+            results['imports'] = benchmarkImports()
+            for module, result in results['imports'].items():
+                self.stdout.write('Import %s: %.1f ms after django.setup()' % (module, result['import_s'] * 1000))
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            for name, before, after, ratio in compareResults(baseline, results):
+                self.stdout.write('%-45s %10.4f s -> %10.4f s  x%.2f%s' % (name, before, after, ratio, '  SLOWER' if ratio > 1.2 else ''))
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(results, output_file, indent=2)
+            self.stdout.write('Results written to ' + options['output'])
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
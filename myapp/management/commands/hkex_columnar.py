@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from myapp.columnar import ColumnarStore, copySnapshots
+from myapp.hkex import normalizeStockCode
+from myapp.store import SnapshotStore
+
+class Command(BaseCommand):
+
+    help = 'Copies shareholding snapshots from the database into the compact columnar store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='*', help='HK Stock Codes to copy, defaults to every stored stock code')
+        parser.add_argument('--root', help='Directory of the columnar store, defaults to HKEX_COLUMNAR_STORE_DIR')
+
+    def handle(self, *args, **options):
+        source = SnapshotStore()
+        target = ColumnarStore(options['root'])
+
+        stock_codes = [normalizeStockCode(stock_code) for stock_code in options['stock_codes']]
+        if len(stock_codes) == 0:
+            stock_codes = source.storedStockCodes()
+
+        for stock_code in stock_codes:
+            copied = copySnapshots(source, target, stock_code)
+            self.stdout.write(stock_code + ': ' + str(copied) + ' snapshots copied')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from myapp.concentration import backfillConcentration
+from myapp.hkex import normalizeStockCode
+from myapp.store import defaultStore
+
+class Command(BaseCommand):
+
+    help = 'Computes concentration metrics of stored snapshots that have none yet (snapshots stored from now on get them on ingest)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='*', help='HK Stock Codes to backfill, defaults to every stored stock code')
+
+    def handle(self, *args, **options):
+        store = defaultStore()
+
+        stock_codes = [normalizeStockCode(stock_code) for stock_code in options['stock_codes']]
+        if len(stock_codes) == 0:
+            stock_codes = store.storedStockCodes()
+
+        for stock_code in stock_codes:
+            added = backfillConcentration(stock_code, store)
+            self.stdout.write(stock_code + ': ' + str(added) + ' dates added')
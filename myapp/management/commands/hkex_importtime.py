@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.benchmarks import IMPORT_TARGETS, importTimes
+
+class Command(BaseCommand):
+
+    help = 'Reports the cold start import time of the web front end, the worker and the analytics modules (python -X importtime)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', help='Modules to import after django.setup(), defaults to ' + ', '.join(IMPORT_TARGETS))
+        parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per module, the fastest one is kept')
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest packages listed per module')
+        parser.add_argument('--budget', type=float, help='Fail when importing any of the modules takes longer than this many milliseconds')
+
+    def handle(self, *args, **options):
+        over_budget = []
+
+        for module in options['modules'] or IMPORT_TARGETS:
+            try:
+                result = importTimes(module, options['repeat'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write('%s: %.1f ms after django.setup() (%.1f ms)%s' % (module,
+                                                                               result['import_s'] * 1000,
+                                                                               result['setup_s'] * 1000,
+                                                                               ', peak RSS %.0f MB' % (result['peak_rss_bytes'] / 2 ** 20) if result['peak_rss_bytes'] else ''
+                                                                               ))
+            for package, seconds in list(result['packages'].items())[:options['top']]:
+                self.stdout.write('  %-30s %8.1f ms' % (package, seconds * 1000))
+
+            if options['budget'] != None and result['import_s'] * 1000 > options['budget']:
+                over_budget.append(module)
+
+        if len(over_budget) > 0:
+            raise CommandError('Import time over the %.0f ms budget: %s' % (options['budget'], ', '.join(over_budget)))
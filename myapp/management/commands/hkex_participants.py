@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from myapp.hkex import normalizeStockCode
+from myapp.participants import indexStock
+from myapp.store import defaultStore
+
+class Command(BaseCommand):
+
+    help = 'Folds newly stored snapshots into the cross-stock participant index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='*', help='HK Stock Codes to index, defaults to every stored stock code')
+
+    def handle(self, *args, **options):
+        store = defaultStore()
+
+        stock_codes = [normalizeStockCode(stock_code) for stock_code in options['stock_codes']]
+        if len(stock_codes) == 0:
+            stock_codes = store.storedStockCodes()
+
+        for stock_code in stock_codes:
+            added = indexStock(stock_code, store)
+            self.stdout.write(stock_code + ': ' + str(added) + ' moves indexed')
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.fetchers import HKEX_URL, HttpFetcher
+from myapp.hkex import normalizeStockCode
+from myapp.standin import FIXTURES_DIR, isSynthetic
+
+class Command(BaseCommand):
+
+    help = 'Records HKEX result pages as served by searchsdw.aspx, for the stand-in, the parser tests and the parser benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_codes', nargs='+', help='HK Stock Codes to record')
+        parser.add_argument('--dates', required=True, help='Comma separated shareholding dates (YYYY/MM/DD)')
+        parser.add_argument('--output', default=str(FIXTURES_DIR), help='Directory the pages are written to as <stock_code>/<YYYYMMDD>.html')
+        parser.add_argument('--url', default=HKEX_URL, help='Address of searchsdw.aspx')
+
+    def handle(self, *args, **options):
+        from pathlib import Path
+
+        output = Path(options['output'])
+        dates = [d.strip() for d in options['dates'].split(',') if d.strip()]
+
+        fetcher = HttpFetcher(options['url'])
+        try:
+            for stock_code in [normalizeStockCode(stock_code) for stock_code in options['stock_codes']]:
+                for d in dates:
+                    page_source = fetcher.fetchPage(stock_code, d)
+
+                    if isSynthetic(page_source):
+                        raise CommandError(options['url'] + ' serves synthetic pages, record from HKEX itself')
+
+                    # Holidays and unknown stock codes return the search form without a shareholding table
+                    if 'table-mobile-list' not in page_source:
+                        self.stderr.write(stock_code + ' as of ' + d + ': no shareholding table, not recorded')
+                        continue
+
+                    path = output / stock_code / (d.replace('/','') + '.html')
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.write_text(page_source, encoding='utf-8')
+                    self.stdout.write('Recorded ' + str(path))
+        finally:
+            fetcher.close()
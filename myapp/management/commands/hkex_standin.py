@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from myapp.standin import FIXTURES_DIR, HKEXStandIn, HKEXStandInServer
+
+class Command(BaseCommand):
+
+    help = 'Serves recorded (or synthetic) HKEX result pages from a local stand-in of searchsdw.aspx for offline runs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--fixtures', default=str(FIXTURES_DIR), help='Directory of pages recorded with hkex_record_pages, laid out as <stock_code>/<YYYYMMDD>.html')
+        parser.add_argument('--no-synthesize', action='store_true', help='Only serve recorded pages, dates without one return an empty result')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before answering each request')
+
+    def handle(self, *args, **options):
+        standin = HKEXStandIn(options['fixtures'], synthesize=not options['no_synthesize'], latency=options['latency'])
+        server = HKEXStandInServer(standin, options['host'], options['port'])
+
+        self.stdout.write('Serving HKEX stand-in at ' + server.url + ' (point HKEXConnection url to it)')
+
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server.server_close()
@@ -0,0 +1,43 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from myapp.hkex import HKEXInput, HKEXConnection, normalizeStockCode
+
+class Command(BaseCommand):
+
+    help = 'Streams the changes of a stock code above a threshold as CSV, each date written as soon as its snapshot is fetched'
+
+    def add_arguments(self, parser):
+        parser.add_argument('stock_code', help='HK Stock Code')
+        parser.add_argument('--start', required=True, help='Start date (YYYY/MM/DD)')
+        parser.add_argument('--end', required=True, help='End date (YYYY/MM/DD)')
+        parser.add_argument('--threshold', type=float, required=True, help='Change threshold, e.g. 0.01 for 1%%')
+        parser.add_argument('--output', help='Path of the CSV file, defaults to standard output')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent HKEX sessions')
+        parser.add_argument('--backend', default='http', choices=['http', 'selenium'])
+        parser.add_argument('--url', help='Address of searchsdw.aspx, e.g. a local hkex_standin server')
+
+    def handle(self, *args, **options):
+        hkex_obj = HKEXConnection(HKEXInput(normalizeStockCode(options['stock_code']), options['start'], options['end'], options['threshold']),
+                                  backend=options['backend'],
+                                  url=options['url'],
+                                  max_workers=options['workers']
+                                  )
+
+        output_file = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        header = True
+
+        try:
+            for d, changes in hkex_obj.iterChanges():
+                if len(changes) > 0 or header:
+                    changes.to_csv(output_file, index=False, header=header)
+                    output_file.flush()
+                    header = False
+        finally:
+            hkex_obj.close()
+            if output_file is not sys.stdout:
+                output_file.close()
+
+        if len(hkex_obj.fetch_report.failed) > 0:
+            self.stderr.write(str(hkex_obj.fetch_report))
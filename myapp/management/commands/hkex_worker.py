@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.instrumentation import METRICS
+from myapp.jobs import claimJob, runJob
+
+class Command(BaseCommand):
+
+    help = 'Runs analyses submitted from the web front end, using the database as the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2, help='Seconds to wait between polls of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent HKEX sessions per job')
+        parser.add_argument('--backend', default='http', choices=['http', 'selenium'])
+        parser.add_argument('--url', help='Address of searchsdw.aspx, e.g. a local hkex_standin server')
+        parser.add_argument('--warm-sessions', type=int, default=0, help='Sessions opened on the search page at startup, so that the first job does not wait for them')
+        parser.add_argument('--metrics-file', help='File rewritten with Prometheus metrics after each job, e.g. for the node exporter textfile collector')
+
+    def handle(self, *args, **options):
+        connection_options = {'backend': options['backend'], 'url': options['url'], 'max_workers': options['workers']}
+
+        if options['warm_sessions'] > 0:
+            from myapp.fetchers import HKEX_URL, sharedPool
+            pool = sharedPool(options['backend'], options['url'] or HKEX_URL, options['workers'])
+            pool.warm(options['warm_sessions'])
+            self.stdout.write(str(pool.idle.qsize()) + ' ' + options['backend'] + ' sessions ready')
+
+        self.stdout.write('Waiting for analysis jobs...')
+
+        while True:
+            job = claimJob()
+
+            if job == None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write('Running ' + str(job))
+            job = runJob(job, **connection_options)
+            self.stdout.write('Finished ' + str(job) + (' - ' + job.error if job.error else ''))
+
+            if options['metrics_file']:
+                import os
+                with open(options['metrics_file'] + '.tmp', 'w') as metrics_file:
+                    metrics_file.write(METRICS.prometheusText())
+                os.replace(options['metrics_file'] + '.tmp', options['metrics_file'])
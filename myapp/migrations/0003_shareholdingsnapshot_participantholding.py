@@ -0,0 +1,45 @@
+# Generated by Django 4.1.1 on 2026-10-17 13:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('myapp', '0002_delete_snippet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantHolding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=20)),
+                ('participant_name', models.CharField(max_length=255)),
+                ('participant_address', models.TextField(blank=True)),
+                ('participant_shares', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShareholdingSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('shareholding_date', models.DateField()),
+                ('total_issue', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='shareholdingsnapshot',
+            constraint=models.UniqueConstraint(fields=('stock_code', 'shareholding_date'), name='unique_stock_code_shareholding_date'),
+        ),
+        migrations.AddField(
+            model_name='participantholding',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to='myapp.shareholdingsnapshot'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.1 on 2026-10-17 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_shareholdingsnapshot_participantholding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('start_date', models.CharField(max_length=10)),
+                ('end_date', models.CharField(max_length=10)),
+                ('chg_threshold', models.FloatField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('dates_fetched', models.IntegerField(default=0)),
+                ('dates_total', models.IntegerField(default=0)),
+                ('shareholding_data', models.TextField(blank=True)),
+                ('chg_summary', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='analysisjob',
+            index=models.Index(fields=['status', 'created_at'], name='myapp_analy_status_f2126a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisjob',
+            index=models.Index(fields=['stock_code', 'start_date', 'end_date', 'chg_threshold'], name='myapp_analy_stock_c_36b818_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.1 on 2026-10-17 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_analysisjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeAnalysisState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('chg_threshold', models.FloatField()),
+                ('first_date', models.DateField()),
+                ('last_date', models.DateField()),
+                ('holdings', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ShareholdingChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=20)),
+                ('participant_name', models.CharField(max_length=255)),
+                ('pct_change', models.FloatField()),
+                ('transaction_date', models.DateField()),
+                ('state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='myapp.changeanalysisstate')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='changeanalysisstate',
+            constraint=models.UniqueConstraint(fields=('stock_code', 'chg_threshold'), name='unique_stock_code_chg_threshold'),
+        ),
+        migrations.AddIndex(
+            model_name='shareholdingchange',
+            index=models.Index(fields=['state', 'transaction_date'], name='myapp_share_state_i_6030b1_idx'),
+        ),
+    ]
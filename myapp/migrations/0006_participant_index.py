@@ -0,0 +1,43 @@
+# Generated by Django 4.1.1 on 2026-10-17 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_incremental_change_analysis'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantIndexState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10, unique=True)),
+                ('last_date', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ParticipantMove',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=20)),
+                ('participant_name', models.CharField(max_length=255)),
+                ('stock_code', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('shares', models.BigIntegerField()),
+                ('pct_holding', models.FloatField()),
+                ('pct_change', models.FloatField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='participantmove',
+            index=models.Index(fields=['participant_id', 'date'], name='myapp_parti_partici_c1af95_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participantmove',
+            index=models.Index(fields=['stock_code', 'date'], name='myapp_parti_stock_c_98da55_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.1 on 2026-10-17 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_participant_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConcentrationMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('total_issue', models.BigIntegerField()),
+                ('participants', models.IntegerField()),
+                ('ccass_shares', models.BigIntegerField()),
+                ('outside_ccass_shares', models.BigIntegerField()),
+                ('outside_ccass_pct', models.FloatField(null=True)),
+                ('top5_pct', models.FloatField(null=True)),
+                ('top10_pct', models.FloatField(null=True)),
+                ('hhi', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='concentrationmetric',
+            index=models.Index(fields=['date', 'stock_code'], name='myapp_conce_date_96a8ef_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='concentrationmetric',
+            constraint=models.UniqueConstraint(fields=('stock_code', 'date'), name='unique_concentration_stock_code_date'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.1 on 2026-10-17 14:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_concentration_metric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackfillRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('stopped', 'Stopped'), ('done', 'Done')], default='stopped', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BackfillUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='units', to='myapp.backfillrun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='backfillunit',
+            index=models.Index(fields=['run', 'status'], name='myapp_backf_run_id_fe5665_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='backfillunit',
+            constraint=models.UniqueConstraint(fields=('run', 'stock_code', 'date'), name='unique_backfill_run_stock_code_date'),
+        ),
+    ]
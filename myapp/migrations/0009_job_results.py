@@ -0,0 +1,115 @@
+# Generated by Django 4.1.1 on 2026-10-17 14:43
+
+import datetime
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+HOLDING_FIELDS = ['participant_id', 'participant_name', 'participant_address', 'participant_shares', 'participant_pct_holding']
+CHANGE_FIELDS = ['participant_id', 'participant_name', 'pct_change', 'transaction_date']
+
+# Columns of the chg_summary blobs, in CHANGE_FIELDS order
+CHG_SUMMARY_COLUMNS = ['Participant ID',
+                       'Name of CCASS Participant',
+                       '% Change in total number of Issued Shares/ Warrants/ Units held',
+                       'Date of Transaction'
+                       ]
+
+
+def moveResults(apps, schema_editor):
+
+    """Moves the results stored on jobs as to_json(orient='split') blobs into JobHolding and JobChange rows"""
+
+    AnalysisJob = apps.get_model('myapp', 'AnalysisJob')
+    JobHolding = apps.get_model('myapp', 'JobHolding')
+    JobChange = apps.get_model('myapp', 'JobChange')
+
+    for job in AnalysisJob.objects.exclude(shareholding_data='').iterator():
+        shareholding_data = json.loads(job.shareholding_data)
+        columns = [shareholding_data['columns'].index(field) for field in HOLDING_FIELDS]
+        JobHolding.objects.bulk_create([JobHolding(job=job, **{field: row[column] for field, column in zip(HOLDING_FIELDS, columns)})
+                                        for row in shareholding_data['data']],
+                                       batch_size=1000)
+
+        if job.chg_summary != '':
+            chg_summary = json.loads(job.chg_summary)
+            columns = [chg_summary['columns'].index(column) for column in CHG_SUMMARY_COLUMNS]
+            JobChange.objects.bulk_create([JobChange(job=job,
+                                                     participant_id=row[columns[0]],
+                                                     participant_name=row[columns[1]],
+                                                     pct_change=row[columns[2]],
+                                                     transaction_date=datetime.date.fromisoformat(row[columns[3]][:10]))
+                                           for row in chg_summary['data']],
+                                          batch_size=1000)
+
+
+def restoreResults(apps, schema_editor):
+
+    """Serializes JobHolding and JobChange rows back into the blobs of their jobs"""
+
+    AnalysisJob = apps.get_model('myapp', 'AnalysisJob')
+
+    for job in AnalysisJob.objects.filter(holdings__isnull=False).distinct().iterator():
+        job.shareholding_data = json.dumps({'columns': HOLDING_FIELDS,
+                                            'data': list(map(list, job.holdings.order_by('id').values_list(*HOLDING_FIELDS)))})
+
+        changes = [list(row[:3]) + [row[3].isoformat() + 'T00:00:00.000'] for row in job.changes.order_by('id').values_list(*CHANGE_FIELDS)]
+        job.chg_summary = json.dumps({'columns': CHG_SUMMARY_COLUMNS, 'data': changes}) if len(changes) > 0 else ''
+
+        job.save(update_fields=['shareholding_data', 'chg_summary'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_backfill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobHolding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=20)),
+                ('participant_name', models.CharField(max_length=255)),
+                ('participant_address', models.TextField(blank=True)),
+                ('participant_shares', models.BigIntegerField()),
+                ('participant_pct_holding', models.FloatField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holdings', to='myapp.analysisjob')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='JobChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('participant_id', models.CharField(max_length=20)),
+                ('participant_name', models.CharField(max_length=255)),
+                ('pct_change', models.FloatField()),
+                ('transaction_date', models.DateField()),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='myapp.analysisjob')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='jobholding',
+            index=models.Index(fields=['job', 'participant_id'], name='myapp_jobho_job_id_1e1860_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jobchange',
+            index=models.Index(fields=['job', 'participant_id'], name='myapp_jobch_job_id_2c14f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='jobchange',
+            index=models.Index(fields=['job', 'transaction_date'], name='myapp_jobch_job_id_35d109_idx'),
+        ),
+        migrations.RunPython(moveResults, restoreResults),
+        migrations.RemoveField(
+            model_name='analysisjob',
+            name='chg_summary',
+        ),
+        migrations.RemoveField(
+            model_name='analysisjob',
+            name='shareholding_data',
+        ),
+    ]
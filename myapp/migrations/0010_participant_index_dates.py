@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-17 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_job_results'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantIndexDate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_code', models.CharField(max_length=10)),
+                ('date', models.DateField()),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='ParticipantIndexState',
+        ),
+        migrations.AddConstraint(
+            model_name='participantindexdate',
+            constraint=models.UniqueConstraint(fields=('stock_code', 'date'), name='unique_participant_index_stock_code_date'),
+        ),
+    ]
@@ -1,3 +1,255 @@
 from django.db import models
 
-# Create your models here.
+
+class ShareholdingSnapshot(models.Model):
+
+    """CCASS shareholding snapshot of a stock code as of a shareholding date"""
+
+    stock_code = models.CharField(max_length=10)
+    shareholding_date = models.DateField()
+    total_issue = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock_code', 'shareholding_date'], name='unique_stock_code_shareholding_date'),
+        ]
+
+    def __str__(self):
+        return self.stock_code + ' as of ' + self.shareholding_date.strftime('%Y/%m/%d')
+
+
+class ParticipantHolding(models.Model):
+
+    """Shareholding of a single CCASS participant within a snapshot"""
+
+    snapshot = models.ForeignKey(ShareholdingSnapshot, on_delete=models.CASCADE, related_name='holdings')
+    participant_id = models.CharField(max_length=20)
+    participant_name = models.CharField(max_length=255)
+    participant_address = models.TextField(blank=True)
+    participant_shares = models.BigIntegerField()
+
+
+class AnalysisJob(models.Model):
+
+    """Shareholding and change analysis submitted from the web front end and run by a background worker"""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    stock_code = models.CharField(max_length=10)
+    start_date = models.CharField(max_length=10)
+    end_date = models.CharField(max_length=10)
+    chg_threshold = models.FloatField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    dates_fetched = models.IntegerField(default=0)
+    dates_total = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['stock_code', 'start_date', 'end_date', 'chg_threshold']),
+        ]
+
+    def __str__(self):
+        return 'Job ' + str(self.id) + ' - ' + self.stock_code + ' ' + self.start_date + ' to ' + self.end_date + ' (' + self.status + ')'
+
+
+class JobHolding(models.Model):
+
+    """Holding of a CCASS participant as of the end date of a completed analysis job, rows keep the job's % holding order"""
+
+    job = models.ForeignKey(AnalysisJob, on_delete=models.CASCADE, related_name='holdings')
+    participant_id = models.CharField(max_length=20)
+    participant_name = models.CharField(max_length=255)
+    participant_address = models.TextField(blank=True)
+    participant_shares = models.BigIntegerField()
+    participant_pct_holding = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'participant_id']),
+        ]
+
+
+class JobChange(models.Model):
+
+    """Change in % holding of a participant above the threshold of a completed analysis job"""
+
+    job = models.ForeignKey(AnalysisJob, on_delete=models.CASCADE, related_name='changes')
+    participant_id = models.CharField(max_length=20)
+    participant_name = models.CharField(max_length=255)
+    pct_change = models.FloatField()
+    transaction_date = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['job', 'participant_id']),
+            models.Index(fields=['job', 'transaction_date']),
+        ]
+
+
+class ChangeAnalysisState(models.Model):
+
+    """Progress of the incremental change analysis of a stock code at a given threshold"""
+
+    stock_code = models.CharField(max_length=10)
+    chg_threshold = models.FloatField()
+    first_date = models.DateField()
+    last_date = models.DateField()
+    # JSON list of [participant_id, participant_name, participant_pct_holding] as of last_date
+    holdings = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock_code', 'chg_threshold'], name='unique_stock_code_chg_threshold'),
+        ]
+
+    def __str__(self):
+        return self.stock_code + ' at +-' + str(self.chg_threshold) + ' up to ' + self.last_date.strftime('%Y/%m/%d')
+
+
+class ShareholdingChange(models.Model):
+
+    """Change in % holding of a participant above the threshold of an incremental change analysis"""
+
+    state = models.ForeignKey(ChangeAnalysisState, on_delete=models.CASCADE, related_name='changes')
+    participant_id = models.CharField(max_length=20)
+    participant_name = models.CharField(max_length=255)
+    pct_change = models.FloatField()
+    transaction_date = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'transaction_date']),
+        ]
+
+
+class ParticipantIndexDate(models.Model):
+
+    """Stored snapshot of a stock code folded into the cross-stock participant index"""
+
+    stock_code = models.CharField(max_length=10)
+    date = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock_code', 'date'], name='unique_participant_index_stock_code_date'),
+        ]
+
+    def __str__(self):
+        return self.stock_code + ' indexed as of ' + self.date.strftime('%Y/%m/%d')
+
+
+class ParticipantMove(models.Model):
+
+    """Change in the holding of a CCASS participant in a stock code since the previous stored snapshot"""
+
+    participant_id = models.CharField(max_length=20)
+    participant_name = models.CharField(max_length=255)
+    stock_code = models.CharField(max_length=10)
+    date = models.DateField()
+    shares = models.BigIntegerField()
+    pct_holding = models.FloatField()
+    pct_change = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['participant_id', 'date']),
+            models.Index(fields=['stock_code', 'date']),
+        ]
+
+
+class ConcentrationMetric(models.Model):
+
+    """CCASS concentration of a stock code as of a stored shareholding date, % figures are fractions of the total issue"""
+
+    stock_code = models.CharField(max_length=10)
+    date = models.DateField()
+    total_issue = models.BigIntegerField()
+    participants = models.IntegerField()
+    ccass_shares = models.BigIntegerField()
+    outside_ccass_shares = models.BigIntegerField()
+    outside_ccass_pct = models.FloatField(null=True)
+    top5_pct = models.FloatField(null=True)
+    top10_pct = models.FloatField(null=True)
+    # Herfindahl-Hirschman index of the participants' holdings, 1 when a single participant holds the whole issue
+    hhi = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock_code', 'date'], name='unique_concentration_stock_code_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'stock_code']),
+        ]
+
+    def __str__(self):
+        return self.stock_code + ' concentration as of ' + self.date.strftime('%Y/%m/%d')
+
+
+class BackfillRun(models.Model):
+
+    """Bulk load of the snapshots of many stock codes over a date range, resumable from its pending units"""
+
+    RUNNING = 'running'
+    STOPPED = 'stopped'
+    DONE = 'done'
+
+    STATUS_CHOICES = [
+        (RUNNING, 'Running'),
+        (STOPPED, 'Stopped'),
+        (DONE, 'Done'),
+    ]
+
+    start_date = models.DateField()
+    end_date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STOPPED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return 'Backfill ' + str(self.id) + ' - ' + self.start_date.strftime('%Y/%m/%d') + ' to ' + self.end_date.strftime('%Y/%m/%d') + ' (' + self.status + ')'
+
+
+class BackfillUnit(models.Model):
+
+    """Snapshot of a stock code as of a date to be loaded by a backfill run"""
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    run = models.ForeignKey(BackfillRun, on_delete=models.CASCADE, related_name='units')
+    stock_code = models.CharField(max_length=10)
+    date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'stock_code', 'date'], name='unique_backfill_run_stock_code_date'),
+        ]
+        indexes = [
+            models.Index(fields=['run', 'status']),
+        ]
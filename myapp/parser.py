@@ -0,0 +1,145 @@
+import html
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import increment, span
+
+SUMMARY_VALUE_RE = re.compile(r'<div[^>]*class="[^"]*summary-value[^"]*"[^>]*>\s*([^<]*?)\s*</div>', re.S)
+CELL_VALUE_RE = re.compile(r'<div[^>]*class="mobile-list-body[^"]*"[^>]*>(.*?)</div>', re.S)
+HEADING_RE = re.compile(r'^[^:]*:\s*')
+LINE_BREAK_RE = re.compile(r'<br\s*/?>', re.I)
+TAG_RE = re.compile(r'<[^>]*>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Cells per row of the shareholding table: ID, name, address, shareholding and % of total issue
+CELLS_PER_ROW = 5
+
+class NoResultsError(ValueError):
+
+    """The search page came back without shareholding data: a holiday, or a suspended, delisted or unknown stock code"""
+
+ResultPage = namedtuple('ResultPage', ['participant_id',
+                                       'participant_name',
+                                       'participant_address',
+                                       'participant_shares',
+                                       'total_issue'
+                                       ])
+
+def parseTotalIssue(page_source):
+
+    """Extracts the total number of issued shares from the first summary-value element of a result page"""
+
+    match = SUMMARY_VALUE_RE.search(page_source)
+
+    if match == None:
+        # The search form without a summary means the query was answered and there is nothing to show
+        if 'txtStockCode' in page_source:
+            raise NoResultsError('No shareholding records in HKEX result page')
+        raise ValueError('Total issue (summary-value) not found in HKEX result page')
+
+    return int(match.group(1).replace(',',''))
+
+def cellText(value):
+
+    """Text of a cell value as read_html reads it: line breaks as spaces, other tags dropped, entities unescaped and whitespace collapsed"""
+
+    if '<' in value:
+        value = TAG_RE.sub('', LINE_BREAK_RE.sub(' ', value))
+
+    return WHITESPACE_RE.sub(' ', html.unescape(value)).strip()
+
+def parseResultArrays(page_source):
+
+    """
+    Parameters
+    ----------
+    page_source : str
+        HTML source of an HKEX CCASS shareholding search result page
+
+    Returns
+    -------
+    ResultPage
+        participant_id, participant_name and participant_address object arrays, participant_shares int64 array and
+        total_issue, read from the cell values of the shareholding table only. Tables whose cells do not line up with
+        their rows are read by parseResultPageReadHtml instead
+    """
+
+    total_issue = parseTotalIssue(page_source)
+
+    # Only scan the body of the shareholding table
+    table_start = page_source.find('table-mobile-list')
+    body_start = page_source.find('<tbody', table_start) if table_start != -1 else -1
+    body_end = page_source.find('</tbody>', body_start) if body_start != -1 else -1
+
+    if body_end == -1:
+        values = []
+    else:
+        values = CELL_VALUE_RE.findall(page_source, body_start, body_end)
+
+        # Markup the cell scan does not understand (nested elements, missing cells) is left to the generic HTML parser
+        if len(values) != page_source.count('<tr', body_start, body_end) * CELLS_PER_ROW:
+            increment('parser_fallbacks')
+            shareholding_data, total_issue = parseResultPageReadHtml(page_source)
+            return ResultPage(*[shareholding_data[column].to_numpy() for column in ResultPage._fields[:4]], total_issue)
+
+    participant_id = np.array([cellText(value) for value in values[0::CELLS_PER_ROW]], dtype = object)
+    participant_name = np.array([cellText(value) for value in values[1::CELLS_PER_ROW]], dtype = object)
+    participant_address = np.array([cellText(value) for value in values[2::CELLS_PER_ROW]], dtype = object)
+    participant_shares = np.array([int(cellText(value).replace(',','')) for value in values[3::CELLS_PER_ROW]], dtype = np.int64)
+
+    return ResultPage(participant_id, participant_name, participant_address, participant_shares, total_issue)
+
+def parseResultPage(page_source):
+
+    """
+    Parameters
+    ----------
+    page_source : str
+        HTML source of an HKEX CCASS shareholding search result page
+
+    Returns
+    -------
+    tuple
+        (shareholding_data, total_issue) with participant_id, participant_name, participant_address and participant_shares columns
+    """
+
+    with span('parse'):
+        page = parseResultArrays(page_source)
+
+    with span('clean'):
+        shareholding_data = pd.DataFrame({'participant_id': page.participant_id,
+                                          'participant_name': page.participant_name,
+                                          'participant_address': page.participant_address,
+                                          'participant_shares': page.participant_shares
+                                          })
+
+    increment('rows_parsed', len(shareholding_data))
+
+    return shareholding_data, page.total_issue
+
+def parseResultPageReadHtml(page_source):
+
+    """Generic pd.read_html parse of a result page, the reference for the parser benchmark and the fallback of parseResultArrays"""
+
+    from io import StringIO
+
+    # Read HTML source data
+    shareholding_data = pd.read_html(StringIO(page_source))[0]
+
+    shareholding_data.columns = ['participant_id',
+                                 'participant_name',
+                                 'participant_address',
+                                 'participant_shares',
+                                 'participant_pct_holding'
+                                 ]
+
+    # Clean raw HTML data into structured DataFrame, each cell starts with its mobile-list-heading label
+    for column in ['participant_id', 'participant_name', 'participant_address', 'participant_shares']:
+        shareholding_data[column] = shareholding_data[column].astype(str).str.replace(HEADING_RE, '', regex = True)
+    shareholding_data['participant_shares']      = shareholding_data['participant_shares'].str.replace(',','').astype('int64')
+    shareholding_data = shareholding_data.drop(columns = 'participant_pct_holding')
+
+    return shareholding_data, parseTotalIssue(page_source)
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Min, Q, Sum
+
+from .changes import buildHoldingMatrix
+from .models import ParticipantIndexDate, ParticipantMove
+from .store import defaultStore, toDate
+
+MOVE_COLUMNS = ['participant_id', 'participant_name', 'stock_code', 'date', 'shares', 'pct_holding', 'pct_change']
+
+def snapshotMoves(stock_code, snapshots, previous = None):
+
+    """
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    snapshots : dict
+        Maps dates, in date order, to (shareholding_data, total_issue)
+    previous : tuple, optional
+        (shareholding_data, total_issue) of the stored snapshot preceding the first date. Without it the first
+        date is only the baseline of the following ones
+
+    Returns
+    -------
+    DataFrame
+        MOVE_COLUMNS rows of every participant whose shares differ from the preceding snapshot, participants
+        leaving CCASS appear with 0 shares
+    """
+
+    frames = []
+    for d, (shareholding_data, total_issue) in ([('', previous)] if previous != None else []) + list(snapshots.items()):
+        frames.append(pd.DataFrame({'participant_id': shareholding_data['participant_id'].to_numpy(),
+                                    'participant_name': shareholding_data['participant_name'].to_numpy(),
+                                    'participant_shares': shareholding_data['participant_shares'].to_numpy(dtype = float),
+                                    'participant_pct_holding': shareholding_data['participant_shares'].to_numpy(dtype = float) / total_issue,
+                                    'date': d if d == '' else toDate(d).strftime('%Y/%m/%d')
+                                    }))
+
+    if len(frames) < 2:
+        return pd.DataFrame(columns = MOVE_COLUMNS)
+
+    shareholding_data = pd.concat(frames, ignore_index = True)
+
+    dates, participant_ids, participant_names, shares = buildHoldingMatrix(shareholding_data, 'participant_shares')
+    _, _, _, pct = buildHoldingMatrix(shareholding_data, 'participant_pct_holding')
+
+    # Participants whose shares changed between consecutive snapshots, the first snapshot is the baseline
+    moved = np.zeros(shares.shape, dtype = bool)
+    moved[1:] = shares[1:] != shares[:-1]
+    date_idx, participant_idx = np.nonzero(moved)
+
+    return pd.DataFrame({'participant_id': participant_ids[participant_idx],
+                         'participant_name': participant_names[participant_idx],
+                         'stock_code': stock_code,
+                         'date': [toDate(d) for d in dates[date_idx]],
+                         'shares': shares[date_idx, participant_idx].astype(np.int64),
+                         'pct_holding': pct[date_idx, participant_idx],
+                         'pct_change': pct[date_idx, participant_idx] - pct[date_idx - 1, participant_idx]
+                         }, columns = MOVE_COLUMNS)
+
+def indexStock(stock_code, store = None, chunk_size = 100):
+
+    """
+    Folds the stored snapshots of a stock code that are not indexed yet into the participant index. A snapshot stored
+    before indexed ones (e.g. by a backfill) changes the predecessor of the dates after it, so the moves from the
+    first unindexed date on are rebuilt
+
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    store : SnapshotStore or ColumnarStore, optional
+        Store the snapshots are read from, defaults to defaultStore()
+    chunk_size : int
+        Number of snapshots loaded and diffed at a time
+
+    Returns
+    -------
+    int
+        Number of moves added to the index, rebuilt ones included
+    """
+
+    store = store if store != None else defaultStore()
+
+    stored_dates = store.storedDates(stock_code)
+    indexed_dates = set(ParticipantIndexDate.objects.filter(stock_code = stock_code).values_list('date', flat = True))
+
+    first_new = next((d for d in stored_dates if d not in indexed_dates), None)
+    if first_new == None:
+        return 0
+
+    new_dates = [d for d in stored_dates if d >= first_new]
+    earlier_dates = [d for d in stored_dates if d < first_new]
+
+    # Diff the first new snapshot against the stored one preceding it
+    previous = store.get(stock_code, earlier_dates[-1]) if len(earlier_dates) > 0 else None
+
+    added = 0
+    for start in range(0, len(new_dates), chunk_size):
+        chunk = new_dates[start:start + chunk_size]
+        snapshots = store.load(stock_code, chunk)
+        snapshots = {d: snapshots[d] for d in chunk if d in snapshots}
+
+        moves = snapshotMoves(stock_code, snapshots, previous)
+
+        try:
+            with transaction.atomic():
+                if start == 0:
+                    ParticipantMove.objects.filter(stock_code = stock_code, date__gte = first_new).delete()
+                    ParticipantIndexDate.objects.filter(stock_code = stock_code, date__gte = first_new).delete()
+
+                ParticipantIndexDate.objects.bulk_create([ParticipantIndexDate(stock_code = stock_code, date = d) for d in chunk], batch_size = 1000)
+                ParticipantMove.objects.bulk_create([ParticipantMove(**row._asdict()) for row in moves.itertuples(index = False)], batch_size = 1000)
+        except IntegrityError:
+            # Indexed concurrently by another process
+            return added
+
+        previous = snapshots[chunk[-1]]
+        added += len(moves)
+
+    return added
+
+def indexAll(store = None):
+
+    """Brings the participant index up to date with every stored stock code, returns a dict of moves added per stock code"""
+
+    store = store if store != None else defaultStore()
+
+    return {stock_code: indexStock(stock_code, store) for stock_code in store.storedStockCodes()}
+
+def participantMoves(participant_id, start_date = None, end_date = None, min_change = 0, stock_code = None):
+
+    """
+    Returns
+    -------
+    DataFrame
+        MOVE_COLUMNS rows of the participant within [start_date, end_date] of at least min_change in absolute % holding,
+        ordered by date and stock code
+    """
+
+    moves = ParticipantMove.objects.filter(participant_id = participant_id)
+
+    if start_date != None:
+        moves = moves.filter(date__gte = toDate(start_date))
+    if end_date != None:
+        moves = moves.filter(date__lte = toDate(end_date))
+    if stock_code != None:
+        moves = moves.filter(stock_code = stock_code)
+    if min_change > 0:
+        moves = moves.filter(Q(pct_change__gte = min_change) | Q(pct_change__lte = -min_change))
+
+    return pd.DataFrame.from_records(moves.order_by('date', 'stock_code').values_list(*MOVE_COLUMNS), columns = MOVE_COLUMNS)
+
+def participantStocks(participant_id, start_date = None, end_date = None, min_change = 0):
+
+    """
+    Answers "which stocks did this participant move by at least min_change" from the index alone
+
+    Returns
+    -------
+    list of dict
+        Per stock code: net_change (sum of % holding changes within the range), largest_move (largest single change
+        in absolute terms), moves (number of changes of at least min_change), first_date and last_date of those moves.
+        Only stock codes whose net change or largest move reach min_change, ordered by absolute net change
+    """
+
+    moves = ParticipantMove.objects.filter(participant_id = participant_id)
+
+    if start_date != None:
+        moves = moves.filter(date__gte = toDate(start_date))
+    if end_date != None:
+        moves = moves.filter(date__lte = toDate(end_date))
+
+    breach = Q(pct_change__gte = min_change) | Q(pct_change__lte = -min_change)
+
+    stocks = []
+    for row in (moves.values('stock_code')
+                .annotate(net_change = Sum('pct_change'),
+                          max_change = Max('pct_change'),
+                          min_change = Min('pct_change'),
+                          moves = Count('id', filter = breach),
+                          first_date = Min('date', filter = breach),
+                          last_date = Max('date', filter = breach)
+                          )
+                ):
+        largest_move = row['max_change'] if abs(row['max_change']) >= abs(row['min_change']) else row['min_change']
+        if abs(row['net_change']) < min_change and abs(largest_move) < min_change:
+            continue
+
+        stocks.append({'stock_code': row['stock_code'],
+                       'net_change': row['net_change'],
+                       'largest_move': largest_move,
+                       'moves': row['moves'],
+                       'first_date': row['first_date'],
+                       'last_date': row['last_date']
+                       })
+
+    return sorted(stocks, key = lambda stock: -abs(stock['net_change']))
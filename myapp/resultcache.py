@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Cache aliases of the threshold independent time series and of the threshold dependent job results
+SERIES_CACHE = 'hkex_series'
+SUMMARY_CACHE = 'hkex_summaries'
+
+def resultCache(alias):
+
+    """Returns the cache of alias, the default cache when CACHES does not configure it"""
+
+    return caches[alias if alias in getattr(settings, 'CACHES', {}) else 'default']
+
+def inputKey(prefix, hkex_input, with_threshold = False):
+
+    """
+    Cache key of the normalized fields of an HKEXInput, so that e.g. 700, 2022/06/30 and 00700, 2022-06-30 share
+    an entry. The threshold is only part of the key when with_threshold is set
+    """
+
+    from .hkex import normalizeStockCode
+    from .store import toDate
+
+    key = ':'.join([prefix,
+                    normalizeStockCode(hkex_input.stock_code),
+                    toDate(hkex_input.start_date).isoformat(),
+                    toDate(hkex_input.end_date).isoformat()
+                    ])
+
+    if with_threshold:
+        key += ':' + repr(float(hkex_input.chg_threshold))
+
+    return key
+
+def isCacheable(hkex_input):
+
+    """Only ranges whose end date is final (see store.isFinal) are cached"""
+
+    from .store import isFinal
+
+    return isFinal(hkex_input.end_date)
+
+def getSeries(hkex_input):
+
+    """Returns the cached long-format shareholding_data of all dates of the range (see buildShareholdingData), None on a miss"""
+
+    return resultCache(SERIES_CACHE).get(inputKey('hkex-series', hkex_input))
+
+def putSeries(hkex_input, shareholding_data):
+    if isCacheable(hkex_input):
+        resultCache(SERIES_CACHE).set(inputKey('hkex-series', hkex_input), shareholding_data, None)
+
+def getSummary(hkex_input):
+
+    """
+    Returns
+    -------
+    tuple or None
+        Cached (shareholding_data, chg_summary) DataFrames of an analysis job, as passed to jobs.saveResults
+    """
+
+    return resultCache(SUMMARY_CACHE).get(inputKey('hkex-results', hkex_input, with_threshold = True))
+
+def putSummary(hkex_input, shareholding_data, chg_summary):
+    if isCacheable(hkex_input):
+        resultCache(SUMMARY_CACHE).set(inputKey('hkex-results', hkex_input, with_threshold = True), (shareholding_data, chg_summary), None)
@@ -0,0 +1,170 @@
+import pandas as pd
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+from .models import JobChange, JobHolding
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Field names of the API for each stored result table, in column order
+TABLE_FIELDS = {'holdings': ['participant_id', 'participant_name', 'participant_address', 'participant_shares', 'participant_pct_holding'],
+                'changes': ['participant_id', 'participant_name', 'pct_change', 'transaction_date']
+                }
+
+def resultTable(job, table):
+
+    """
+    Returns
+    -------
+    QuerySet
+        The 'holdings' or 'changes' rows of a completed job as dicts of TABLE_FIELDS, in stored order
+    """
+
+    if table not in TABLE_FIELDS:
+        raise ValueError('Unknown table ' + table + ', expected one of ' + ', '.join(TABLE_FIELDS))
+
+    model = JobHolding if table == 'holdings' else JobChange
+
+    return model.objects.filter(job = job).order_by('id').values(*TABLE_FIELDS[table])
+
+def rowFields(rows):
+
+    """TABLE_FIELDS of the table rows were selected from"""
+
+    return TABLE_FIELDS['holdings' if rows.model is JobHolding else 'changes']
+
+def queryTable(rows, participant_id = None, date_from = None, date_to = None, min_change = None, sort = None):
+
+    """
+    Parameters
+    ----------
+    rows : QuerySet
+        Rows returned by resultTable
+    participant_id : str, optional
+        Only rows of this participant
+    date_from, date_to : str, optional
+        Only changes dated within [date_from, date_to]
+    min_change : float, optional
+        Only changes of at least this absolute size (0.01 for 1%)
+    sort : str, optional
+        Field to sort by, prefixed with '-' for descending order. Rows keep their stored order by default, and within
+        equal values of the sort field
+
+    Returns
+    -------
+    QuerySet
+        Matching rows, filtered and sorted by the database
+    """
+
+    from .store import toDate
+
+    fields = rowFields(rows)
+
+    if participant_id:
+        rows = rows.filter(participant_id = participant_id.strip().upper())
+
+    if (date_from or date_to or min_change != None) and 'transaction_date' not in fields:
+        raise ValueError('date_from, date_to and min_change only apply to changes')
+
+    if date_from:
+        rows = rows.filter(transaction_date__gte = toDate(date_from))
+    if date_to:
+        rows = rows.filter(transaction_date__lte = toDate(date_to))
+    if min_change != None:
+        min_change = abs(float(min_change))
+        rows = rows.filter(Q(pct_change__gte = min_change) | Q(pct_change__lte = -min_change))
+
+    if sort:
+        field = sort.lstrip('-')
+        if field not in fields:
+            raise ValueError('Cannot sort by ' + field + ', expected one of ' + ', '.join(fields))
+        rows = rows.order_by(sort, 'id')
+
+    return rows
+
+def paginateRows(rows, page = 1, page_size = PAGE_SIZE):
+
+    """
+    Returns the Django Page of rows for a 1-based page number, out of range numbers give the nearest page. Only the
+    count and the rows of the page are queried
+    """
+
+    page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+
+    return Paginator(rows, page_size).get_page(page)
+
+def frameRecords(frame):
+
+    """JSON-serialisable list of row dicts, dates as YYYY-MM-DD"""
+
+    records = frame.astype(object).where(frame.notna(), None).to_dict(orient = 'records')
+
+    for record in records:
+        if 'transaction_date' in record and record['transaction_date'] != None:
+            record['transaction_date'] = record['transaction_date'].isoformat()
+
+    return records
+
+def rowRecords(rows):
+
+    """JSON-serialisable list of row dicts, dates as YYYY-MM-DD"""
+
+    records = [dict(row) for row in rows]
+
+    for record in records:
+        if 'transaction_date' in record and record['transaction_date'] != None:
+            record['transaction_date'] = record['transaction_date'].isoformat()
+
+    return records
+
+def iterCsv(rows, chunk_size = 1000):
+
+    """Yields rows as CSV text a chunk of rows at a time, streaming them from the database so the whole table is never held in memory"""
+
+    import csv
+    from io import StringIO
+
+    fields = rowFields(rows)
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator = '\n')
+
+    writer.writerow(fields)
+    for i, row in enumerate(rows.values_list(*fields).iterator(chunk_size = chunk_size)):
+        writer.writerow(row)
+
+        if (i + 1) % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def iterParquet(rows, chunk_size = 10000):
+
+    """Yields rows as a Parquet file one row group at a time, streaming them from the database, requires pyarrow"""
+
+    from io import BytesIO
+    from itertools import islice
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = rowFields(rows)
+    iterator = rows.values_list(*fields).iterator(chunk_size = chunk_size)
+
+    chunk = pd.DataFrame.from_records(list(islice(iterator, chunk_size)), columns = fields)
+    schema = pa.Schema.from_pandas(chunk, preserve_index = False)
+    sink = BytesIO()
+
+    with pq.ParquetWriter(sink, schema) as writer:
+        while len(chunk) > 0:
+            writer.write_table(pa.Table.from_pandas(chunk, schema = schema, preserve_index = False))
+
+            # Hand over the bytes of each finished row group
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+
+            chunk = pd.DataFrame.from_records(list(islice(iterator, chunk_size)), columns = fields)
+
+    yield sink.getvalue()
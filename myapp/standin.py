@@ -0,0 +1,322 @@
+"""
+Local stand-in for the HKEX CCASS search page (searchsdw.aspx), used to exercise the fetchers offline. It serves pages
+recorded from HKEX with hkex_record_pages where there are any, and synthetic pages generated in the layout of
+searchsdw.aspx otherwise. Synthetic pages carry SYNTHETIC_MARKER and are no substitute for recorded ones when
+validating the parser
+"""
+
+import html
+import re
+import secrets
+import threading
+from pathlib import Path
+from urllib.parse import parse_qs
+
+import numpy as np
+
+# Result pages recorded from HKEX (see hkex_record_pages), laid out as <stock_code>/<YYYYMMDD>.html
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures' / 'hkex_pages'
+
+SYNTHETIC_MARKER = '<!-- Synthetic result page generated by myapp.standin, not recorded from HKEX -->'
+
+SEARCH_PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>CCASS Shareholding Search</title>
+</head>
+<body>
+<form method="post" action="./searchsdw.aspx" id="form1">
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<div class="aspNetHidden">
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="3B6E1A2B" />
+</div>
+<input type="hidden" name="today" id="today" value="{today}" />
+<input type="hidden" name="sortBy" id="sortBy" value="shareholding" />
+<input type="hidden" name="sortDirection" id="sortDirection" value="desc" />
+<input type="hidden" name="alertMsg" id="alertMsg" value="" />
+<div class="search-input">
+<input type="text" name="txtShareholdingDate" id="txtShareholdingDate" value="{shareholding_date}" />
+<input type="text" name="txtStockCode" id="txtStockCode" value="{stock_code}" />
+<input type="text" name="txtStockName" id="txtStockName" value="{stock_name}" />
+<input type="text" name="txtParticipantID" id="txtParticipantID" value="" />
+<input type="text" name="txtParticipantName" id="txtParticipantName" value="" />
+<input type="hidden" name="txtSelPartID" id="txtSelPartID" value="" />
+<a id="btnSearch" href="javascript:__doPostBack('btnSearch','')" class="btn-blue">Search</a>
+</div>
+{results}
+</form>
+</body>
+</html>
+'''
+
+RESULTS = SYNTHETIC_MARKER + '''
+<div class="ccass-search-summary-table">
+<div class="ccass-search-datarow ccass-search-total">
+<div class="header">Total number of Issued Shares/Warrants/Units (last updated figure)</div>
+<div class="summary-value">{total_issue:,}</div>
+</div>
+</div>
+<div class="search-details-table-container table-mobile-list-container">
+<table class="table table-scroll table-sort table-mobile-list " style="width: 100%;">
+<thead>
+<tr>
+<th data-column="participant_id">Participant ID</th>
+<th data-column="participant_name">Name of CCASS Participant (* for Consenting Investor Participants )</th>
+<th data-column="address">Address</th>
+<th data-column="shareholding">Shareholding</th>
+<th data-column="shareholding_percent">% of the total number of Issued Shares/ Warrants/ Units</th>
+</tr>
+</thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+</div>'''
+
+ROW = '''<tr>
+<td class="col-participant-id">
+<div class="mobile-list-heading">Participant ID:</div>
+<div class="mobile-list-body">{participant_id}</div>
+</td>
+<td class="col-participant-name">
+<div class="mobile-list-heading">Name of CCASS Participant (* for Consenting Investor Participants ):</div>
+<div class="mobile-list-body">{participant_name}</div>
+</td>
+<td class="col-address">
+<div class="mobile-list-heading">Address:</div>
+<div class="mobile-list-body">{participant_address}</div>
+</td>
+<td class="col-shareholding text-right">
+<div class="mobile-list-heading">Shareholding:</div>
+<div class="mobile-list-body">{participant_shares:,}</div>
+</td>
+<td class="col-shareholding-percent text-right">
+<div class="mobile-list-heading">% of the total number of Issued Shares/ Warrants/ Units:</div>
+<div class="mobile-list-body">{participant_pct_holding:.2%}</div>
+</td>
+</tr>'''
+
+VIEWSTATE_RE = re.compile(r'(name="__VIEWSTATE" id="__VIEWSTATE" value=")[^"]*(")')
+
+def syntheticSnapshot(stock_code, d, participants = 250):
+
+    """
+    Parameters
+    ----------
+    stock_code : str
+        HK Stock Code
+    d : str
+        Shareholding date (YYYY/MM/DD)
+    participants : int
+        Number of CCASS participants holding the stock
+
+    Returns
+    -------
+    tuple
+        Deterministic (participant rows, total issue) for the stock code as of date d
+    """
+
+    # Participant base holdings only depend on the stock code
+    base_rng = np.random.default_rng(int(stock_code))
+    total_issue = int(base_rng.integers(10**8, 10**10))
+    base_shares = base_rng.pareto(1.2, participants) + 0.01
+    base_shares = (base_shares / base_shares.sum() * total_issue * 0.8).astype(np.int64)
+
+    # A handful of transfers between participants on each date
+    date_rng = np.random.default_rng(int(stock_code) * 100000000 + int(d.replace('/','')))
+    shares = base_shares.copy()
+    for _ in range(date_rng.integers(0, 6)):
+        seller, buyer = date_rng.choice(participants, 2, replace = False)
+        amount = int(shares[seller] * date_rng.uniform(0.05, 0.5))
+        shares[seller] -= amount
+        shares[buyer] += amount
+
+    rows = []
+    for i in range(participants):
+        rows.append({'participant_id': 'C%05d' % (i + 1) if i % 7 else 'B%05d' % (i + 1),
+                     'participant_name': 'CCASS PARTICIPANT %d & CO. LIMITED' % (i + 1),
+                     'participant_address': '%d/F, %d QUEEN\'S ROAD CENTRAL, HONG KONG' % (i % 40 + 1, i + 1),
+                     'participant_shares': int(shares[i]),
+                     'participant_pct_holding': shares[i] / total_issue
+                     })
+
+    rows.sort(key = lambda row: row['participant_shares'], reverse = True)
+
+    return rows, total_issue
+
+def renderSearchPage(viewstate, stock_code = '', d = '', rows = None, total_issue = None):
+
+    """Renders the search page in the layout of searchsdw.aspx, including results when rows are given"""
+
+    results = ''
+    if rows != None:
+        results = RESULTS.format(total_issue = total_issue,
+                                 rows = '\n'.join(ROW.format(**{k: html.escape(v) if isinstance(v, str) else v for k, v in row.items()})
+                                                  for row in rows)
+                                 )
+
+    return SEARCH_PAGE.format(viewstate = viewstate,
+                              today = d.replace('/',''),
+                              shareholding_date = d,
+                              stock_code = html.escape(stock_code),
+                              stock_name = '',
+                              results = results
+                              )
+
+def syntheticPage(stock_code, d, participants = 250):
+
+    """Returns a synthetic result page of the stock code as of date d (see syntheticSnapshot), marked with SYNTHETIC_MARKER"""
+
+    rows, total_issue = syntheticSnapshot(stock_code, d, participants)
+
+    return renderSearchPage(secrets.token_urlsafe(48), stock_code, d, rows, total_issue)
+
+def isSynthetic(page_source):
+    return SYNTHETIC_MARKER in page_source
+
+class HKEXStandIn():
+
+    def __init__(self, fixtures_dir = FIXTURES_DIR, synthesize = True, participants = 250, latency = 0):
+
+        """
+        Parameters
+        ----------
+        fixtures_dir : str or Path
+            Directory of result pages recorded from HKEX, laid out as <stock_code>/<YYYYMMDD>.html
+        synthesize : bool
+            Serve a deterministic synthetic page for dates without a recorded page
+        participants : int
+            Number of participants of synthetic pages
+        latency : float
+            Seconds to wait before answering each request, to emulate the round trip to HKEX
+        """
+
+        self.fixtures_dir = Path(fixtures_dir)
+        self.synthesize = synthesize
+        self.participants = participants
+        self.latency = latency
+        self.viewstates = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def issueViewstate(self):
+        viewstate = secrets.token_urlsafe(48)
+        with self.lock:
+            self.viewstates.add(viewstate)
+        return viewstate
+
+    def searchPage(self):
+
+        """Response to a GET of searchsdw.aspx"""
+
+        return 200, renderSearchPage(self.issueViewstate())
+
+    def postBack(self, body):
+
+        """Response to a POST of the search form"""
+
+        form = {k: v[0] for k, v in parse_qs(body, keep_blank_values = True).items()}
+
+        # ASP.NET rejects post backs that do not carry a viewstate it issued
+        with self.lock:
+            self.requests += 1
+            if form.get('__VIEWSTATE') not in self.viewstates:
+                return 500, 'Invalid viewstate'
+
+        if form.get('__EVENTTARGET') != 'btnSearch':
+            return 200, renderSearchPage(self.issueViewstate())
+
+        stock_code = form.get('txtStockCode', '')
+        d = form.get('txtShareholdingDate', '')
+
+        recorded_page = self.fixtures_dir / stock_code / (d.replace('/','') + '.html')
+        if recorded_page.exists():
+            page = recorded_page.read_text(encoding = 'utf-8')
+            return 200, VIEWSTATE_RE.sub(lambda m: m.group(1) + self.issueViewstate() + m.group(2), page)
+
+        if not self.synthesize or not stock_code.isdigit():
+            return 200, renderSearchPage(self.issueViewstate(), stock_code, d)
+
+        rows, total_issue = syntheticSnapshot(stock_code, d, self.participants)
+
+        return 200, renderSearchPage(self.issueViewstate(), stock_code, d, rows, total_issue)
+
+class HKEXStandInServer():
+
+    def __init__(self, standin = None, host = '127.0.0.1', port = 0):
+
+        """
+        Parameters
+        ----------
+        standin : HKEXStandIn, optional
+            Stand-in answering the requests, defaults to recorded pages with synthetic fallback
+        host : str
+            Interface to listen on
+        port : int
+            Port to listen on, 0 picks a free port
+        """
+
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        self.standin = standin if standin != None else HKEXStandIn()
+        standin = self.standin
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self, status, page):
+                import time
+
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                body = page.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond(*standin.searchPage())
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                self.respond(*standin.postBack(body))
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/sdw/search/searchsdw.aspx' % (host, port)
+
+    def start(self):
+
+        """Serves requests from a background thread"""
+
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,247 @@
+import datetime
+
+import pandas as pd
+from django.db import IntegrityError, transaction
+
+from .models import ShareholdingSnapshot, ParticipantHolding
+
+SNAPSHOT_COLUMNS = ['participant_id',
+                    'participant_name',
+                    'participant_address',
+                    'participant_shares'
+                    ]
+
+def toDate(d):
+
+    """Converts an HKEX date string (YYYY/MM/DD) or date-like object to datetime.date"""
+
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    if isinstance(d, datetime.date):
+        return d
+    return pd.Timestamp(d).date()
+
+def isFinal(d):
+
+    """Snapshots of dates before today never change and are safe to persist and cache, the current day's may still be revised"""
+
+    return toDate(d) < datetime.date.today()
+
+def defaultStore():
+
+    """Returns the snapshot store selected by the HKEX_SNAPSHOT_STORE setting ('database' or 'columnar')"""
+
+    from django.conf import settings
+
+    if getattr(settings, 'HKEX_SNAPSHOT_STORE', 'database') == 'columnar':
+        from .columnar import ColumnarStore
+        return ColumnarStore()
+
+    return SnapshotStore()
+
+class SnapshotStore():
+
+    """Persistent store of CCASS shareholding snapshots keyed by stock code and shareholding date"""
+
+    def get(self, stock_code, d):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        d : str
+            Shareholding date
+
+        Returns
+        -------
+        tuple or None
+            (shareholding_data, total_issue) if the snapshot is stored, None otherwise
+        """
+
+        return self.load(stock_code, [d]).get(d)
+
+    def load(self, stock_code, dates):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        dates : list of str
+            Shareholding dates to load
+
+        Returns
+        -------
+        dict
+            Maps each stored date (as passed in) to a (shareholding_data, total_issue) tuple
+        """
+
+        requested = {toDate(d): d for d in dates}
+
+        snapshots = {}
+        totals = {}
+        for snapshot_id, shareholding_date, total_issue in (ShareholdingSnapshot.objects
+                                                            .filter(stock_code=stock_code, shareholding_date__in=list(requested))
+                                                            .values_list('id', 'shareholding_date', 'total_issue')
+                                                            ):
+            snapshots[snapshot_id] = shareholding_date
+            totals[snapshot_id] = total_issue
+
+        if len(snapshots) == 0:
+            return {}
+
+        # Retrieve all holdings of the requested snapshots in a single query, preserving page order
+        holdings = pd.DataFrame.from_records(ParticipantHolding.objects
+                                             .filter(snapshot_id__in=list(snapshots))
+                                             .order_by('id')
+                                             .values_list('snapshot_id', *SNAPSHOT_COLUMNS),
+                                             columns=['snapshot_id'] + SNAPSHOT_COLUMNS
+                                             )
+        holdings['participant_shares'] = holdings['participant_shares'].astype('int64')
+
+        result = {}
+        for snapshot_id, snapshot_holdings in holdings.groupby('snapshot_id', sort=False):
+            shareholding_data = snapshot_holdings[SNAPSHOT_COLUMNS].reset_index(drop=True)
+            result[requested[snapshots[snapshot_id]]] = (shareholding_data, totals[snapshot_id])
+
+        # Snapshots with no participants at all still count as stored
+        for snapshot_id, shareholding_date in snapshots.items():
+            if requested[shareholding_date] not in result:
+                result[requested[shareholding_date]] = (pd.DataFrame(columns=SNAPSHOT_COLUMNS), totals[snapshot_id])
+
+        return result
+
+    def storedStockCodes(self):
+
+        """Returns the stock codes with at least one stored snapshot, sorted"""
+
+        return list(ShareholdingSnapshot.objects.order_by('stock_code').values_list('stock_code', flat=True).distinct())
+
+    def storedDates(self, stock_code):
+
+        """Returns the dates (datetime.date) of all stored snapshots of the stock code, sorted"""
+
+        return list(ShareholdingSnapshot.objects
+                    .filter(stock_code=stock_code)
+                    .order_by('shareholding_date')
+                    .values_list('shareholding_date', flat=True)
+                    )
+
+    def missingDates(self, stock_code, dates):
+
+        """Returns the subset of dates for which no snapshot is stored, in the order given"""
+
+        stored = set(ShareholdingSnapshot.objects
+                     .filter(stock_code=stock_code, shareholding_date__in=[toDate(d) for d in dates])
+                     .values_list('shareholding_date', flat=True)
+                     )
+
+        return [d for d in dates if toDate(d) not in stored]
+
+    def put(self, stock_code, d, shareholding_data, total_issue):
+
+        """
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        d : str
+            Shareholding date
+        shareholding_data : DataFrame
+            Cleaned participant rows containing at least SNAPSHOT_COLUMNS
+        total_issue : int
+            Total number of issued shares as of date d
+        """
+
+        from .concentration import recordConcentration
+
+        if not isFinal(d):
+            return
+
+        if ShareholdingSnapshot.objects.filter(stock_code=stock_code, shareholding_date=toDate(d)).exists():
+            return
+
+        # Start the transaction with a write so that concurrent writers wait for the lock rather than fail
+        try:
+            with transaction.atomic():
+                snapshot = ShareholdingSnapshot.objects.create(stock_code=stock_code,
+                                                               shareholding_date=toDate(d),
+                                                               total_issue=int(total_issue)
+                                                               )
+
+                ParticipantHolding.objects.bulk_create([
+                    ParticipantHolding(snapshot=snapshot,
+                                       participant_id=row.participant_id,
+                                       participant_name=row.participant_name,
+                                       participant_address=row.participant_address if isinstance(row.participant_address, str) else '',
+                                       participant_shares=int(row.participant_shares)
+                                       )
+                    for row in shareholding_data[SNAPSHOT_COLUMNS].itertuples(index=False)
+                ])
+
+                # Summary metrics are materialized along with the snapshot
+                recordConcentration(stock_code, d, shareholding_data, total_issue)
+
+        except IntegrityError:
+            # Stored concurrently by another process
+            return
+
+    def putMany(self, stock_code, snapshots):
+
+        """
+        Stores several snapshots of a stock code in a single transaction, for bulk loads where a commit per snapshot
+        would dominate the run time. Dates already stored or not final are skipped
+
+        Parameters
+        ----------
+        stock_code : str
+            HK Stock Code
+        snapshots : dict
+            Maps shareholding dates to (shareholding_data, total_issue)
+        """
+
+        from .concentration import recordConcentrations
+
+        final = {toDate(d): d for d in snapshots if isFinal(d)}
+
+        try:
+            with transaction.atomic():
+                stored = set(ShareholdingSnapshot.objects
+                             .filter(stock_code=stock_code, shareholding_date__in=list(final))
+                             .values_list('shareholding_date', flat=True)
+                             )
+                new = {shareholding_date: d for shareholding_date, d in final.items() if shareholding_date not in stored}
+
+                if len(new) == 0:
+                    return
+
+                ShareholdingSnapshot.objects.bulk_create([ShareholdingSnapshot(stock_code=stock_code,
+                                                                               shareholding_date=shareholding_date,
+                                                                               total_issue=int(snapshots[d][1])
+                                                                               )
+                                                          for shareholding_date, d in new.items()])
+
+                # Not every database returns the primary keys of bulk inserts
+                snapshot_ids = dict(ShareholdingSnapshot.objects
+                                    .filter(stock_code=stock_code, shareholding_date__in=list(new))
+                                    .values_list('shareholding_date', 'id')
+                                    )
+
+                ParticipantHolding.objects.bulk_create([
+                    ParticipantHolding(snapshot_id=snapshot_ids[shareholding_date],
+                                       participant_id=row.participant_id,
+                                       participant_name=row.participant_name,
+                                       participant_address=row.participant_address if isinstance(row.participant_address, str) else '',
+                                       participant_shares=int(row.participant_shares)
+                                       )
+                    for shareholding_date, d in new.items()
+                    for row in snapshots[d][0][SNAPSHOT_COLUMNS].itertuples(index=False)
+                ], batch_size=5000)
+
+                recordConcentrations(stock_code, {d: snapshots[d] for d in new.values()})
+
+        except IntegrityError:
+            # Some were stored concurrently by another process, store the others one by one
+            for d in final.values():
+                self.put(stock_code, d, *snapshots[d])
@@ -1,3 +1,1288 @@
-from django.test import TestCase
+import tempfile
+import threading
+import time
+from pathlib import Path
 
-# Create your tests here.
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from .standin import HKEXStandIn, HKEXStandInServer, isSynthetic, syntheticPage, syntheticSnapshot
+
+class HttpFetcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.fixtures_dir = tempfile.TemporaryDirectory()
+        self.server = HKEXStandInServer(HKEXStandIn(self.fixtures_dir.name)).start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.fixtures_dir.cleanup()
+
+    def test_fetch_page(self):
+        from .fetchers import HttpFetcher
+        from .parser import parseResultPage
+
+        fetcher = HttpFetcher(self.server.url)
+        try:
+            shareholding_data, total_issue = parseResultPage(fetcher.fetchPage('00001', '2022/09/16'))
+        finally:
+            fetcher.close()
+
+        rows, expected_total_issue = syntheticSnapshot('00001', '2022/09/16')
+        self.assertEqual(total_issue, expected_total_issue)
+        self.assertEqual(shareholding_data.to_dict('records'), [{k: row[k] for k in shareholding_data.columns} for row in rows])
+
+    def test_stale_viewstate_is_reloaded(self):
+        from .fetchers import HttpFetcher
+
+        fetcher = HttpFetcher(self.server.url)
+        try:
+            fetcher.fetchPage('00001', '2022/09/16')
+            fetcher.form_fields['__VIEWSTATE'] = 'expired'
+            self.assertIn('table-mobile-list', fetcher.fetchPage('00001', '2022/09/19'))
+        finally:
+            fetcher.close()
+
+    def test_recorded_page_is_served(self):
+        from .fetchers import HttpFetcher
+
+        # A page with the marker removed stands for one recorded from HKEX
+        page = syntheticPage('00005', '2022/09/16').replace('Synthetic', 'Recorded')
+        (Path(self.fixtures_dir.name) / '00005').mkdir()
+        (Path(self.fixtures_dir.name) / '00005' / '20220916.html').write_text(page, encoding = 'utf-8')
+
+        fetcher = HttpFetcher(self.server.url)
+        try:
+            self.assertFalse(isSynthetic(fetcher.fetchPage('00005', '2022/09/16')))
+            self.assertTrue(isSynthetic(fetcher.fetchPage('00005', '2022/09/19')))
+
+            # The viewstate of the recorded page is replaced by one the stand-in accepts
+            fetcher.fetchPage('00005', '2022/09/20')
+        finally:
+            fetcher.close()
+
+class RateLimiterTests(SimpleTestCase):
+
+    def test_limiter_per_host_and_rate(self):
+        from .fetchers import getRateLimiter
+
+        limiter = getRateLimiter('http://127.0.0.1:1/sdw/search/searchsdw.aspx', 8)
+
+        self.assertIs(getRateLimiter('http://127.0.0.1:1/other.aspx', 8), limiter)
+        self.assertIsNot(getRateLimiter('http://127.0.0.1:1/sdw/search/searchsdw.aspx', 2), limiter)
+        self.assertEqual(getRateLimiter('http://127.0.0.1:1/sdw/search/searchsdw.aspx', 2).interval, 0.5)
+        self.assertIsNot(getRateLimiter('http://127.0.0.2:1/sdw/search/searchsdw.aspx', 8), limiter)
+
+    def test_wait_spaces_requests(self):
+        import time
+        from .fetchers import RateLimiter
+
+        limiter = RateLimiter(20)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.wait()
+
+        self.assertGreaterEqual(time.monotonic() - start, 4 / 20 - 0.01)
+
+class FakeFetcher():
+
+    def __init__(self):
+        self.closed = False
+        self.is_healthy = True
+
+    def fetchPage(self, stock_code, d):
+        return syntheticPage(stock_code, d, participants = 20)
+
+    def healthy(self):
+        return self.is_healthy
+
+    def close(self):
+        self.closed = True
+
+class FetcherPoolTests(TestCase):
+
+    def test_reuses_checked_in_fetchers(self):
+        from .fetchers import FetcherPool
+
+        pool = FetcherPool(FakeFetcher, max_size = 2)
+        fetcher = pool.checkout()
+        pool.checkin(fetcher)
+
+        self.assertIs(pool.checkout(), fetcher)
+        self.assertEqual(pool.size, 1)
+
+    def test_discards_stale_and_unhealthy_fetchers(self):
+        from .fetchers import FetcherPool
+
+        pool = FetcherPool(FakeFetcher, max_size = 1, idle_timeout = 0)
+        stale = pool.checkout()
+        pool.checkin(stale)
+        time.sleep(0.01)
+
+        fresh = pool.checkout()
+        self.assertIsNot(fresh, stale)
+        self.assertTrue(stale.closed)
+
+        pool.idle_timeout = None
+        fresh.is_healthy = False
+        pool.checkin(fresh)
+
+        self.assertIsNot(pool.checkout(), fresh)
+        self.assertTrue(fresh.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_failed_fetches_decide_what_is_kept(self):
+        from .fetchers import FetcherPool, HttpFetcher
+        from .parser import NoResultsError
+
+        http_pool = FetcherPool(lambda: HttpFetcher('http://127.0.0.1:1/'), max_size = 1)
+        session = http_pool.checkout()
+        http_pool.checkin(session, error = NoResultsError('No shareholding records'))
+        self.assertIs(http_pool.checkout(), session)
+
+        # A failed post back may leave a broken viewstate behind
+        http_pool.checkin(session, error = ValueError('Unexpected page'))
+        self.assertEqual((http_pool.size, http_pool.idle.qsize()), (0, 0))
+
+        # Browsers stay until their health check fails
+        browser_pool = FetcherPool(FakeFetcher, max_size = 1)
+        browser = browser_pool.checkout()
+        browser_pool.checkin(browser, error = RuntimeError('Timed out'))
+        self.assertIs(browser_pool.checkout(), browser)
+        self.assertFalse(browser.closed)
+
+    def test_checkout_waits_for_checkin(self):
+        from .fetchers import FetcherPool
+
+        pool = FetcherPool(FakeFetcher, max_size = 1, checkout_timeout = 5)
+        fetcher = pool.checkout()
+
+        timer = threading.Timer(0.2, pool.checkin, args = (fetcher,))
+        timer.start()
+        self.addCleanup(timer.cancel)
+
+        self.assertIs(pool.checkout(), fetcher)
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        from .fetchers import FetcherPool
+
+        pool = FetcherPool(FakeFetcher, max_size = 1, checkout_timeout = 0.2)
+        pool.checkout()
+
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            pool.checkout()
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_unclosed_connections_do_not_exhaust_the_pool(self):
+        from .fetchers import FetcherPool, HttpFetcher
+        from .hkex import HKEXInput, HKEXConnection
+        from .store import SnapshotStore
+
+        with HKEXStandInServer() as server:
+            pool = FetcherPool(lambda: HttpFetcher(server.url), max_size = 4, checkout_timeout = 5)
+
+            # More analyses than sessions, none of them closed
+            for stock_code in ['00001', '00002', '00003', '00005', '00700']:
+                hkex_obj = HKEXConnection(HKEXInput(stock_code, '2022/09/16', '2022/09/16'), store = SnapshotStore(), url = server.url,
+                                          pool = pool, rate_limit = None, selenium_fallback = False)
+                hkex_obj.runAnalysis()
+                self.assertGreater(len(hkex_obj.shareholding_data), 0)
+
+        self.assertEqual(pool.idle.qsize(), pool.size)
+        pool.close()
+
+    def test_connection_is_a_context_manager(self):
+        from .fetchers import FetcherPool
+        from .hkex import HKEXInput, HKEXConnection
+
+        pool = FetcherPool(FakeFetcher, max_size = 1)
+
+        with HKEXConnection(HKEXInput('00700', '2022/09/16', '2022/09/16'), pool = pool) as hkex_obj:
+            hkex_obj.connect()
+            self.assertEqual(pool.idle.qsize(), 0)
+
+        self.assertIsNone(hkex_obj.fetcher)
+        self.assertEqual(pool.idle.qsize(), 1)
+
+class ChangeSummaryTests(SimpleTestCase):
+
+    def frame(self, rows):
+        import pandas as pd
+        return pd.DataFrame(rows, columns = ['participant_id', 'participant_name', 'participant_pct_holding', 'date'])
+
+    def test_changes_between_consecutive_dates(self):
+        from .changes import CHG_SUMMARY_COLUMNS, computeChangeSummary
+
+        shareholding_data = self.frame([('C1', 'A', 0.30, '2022/09/15'), ('C2', 'B', 0.10, '2022/09/15'),
+                                        ('C1', 'A', 0.25, '2022/09/16'), ('C2', 'B', 0.10, '2022/09/16'), ('C3', 'C', 0.05, '2022/09/16'),
+                                        ('C1', 'A', 0.25, '2022/09/19'), ('C3', 'C', 0.15, '2022/09/19')
+                                        ])
+
+        chg_summary = computeChangeSummary(shareholding_data, 0.04)
+
+        self.assertEqual([(row[0], round(row[2], 10), row[3].strftime('%Y/%m/%d')) for row in chg_summary[CHG_SUMMARY_COLUMNS].itertuples(index = False)],
+                         [('C1', -0.05, '2022/09/16'), ('C3', 0.05, '2022/09/16'), ('C2', -0.1, '2022/09/19'), ('C3', 0.1, '2022/09/19')])
+        self.assertIsNone(computeChangeSummary(shareholding_data, 0.2))
+
+    def test_previous_holding_vector_is_the_baseline(self):
+        from .changes import computeChangeSummary
+
+        previous = self.frame([('C1', 'A', 0.10, '')])[['participant_id', 'participant_name', 'participant_pct_holding']]
+        chg_summary = computeChangeSummary(self.frame([('C1', 'A', 0.30, '2022/09/16')]), 0.1, previous = previous)
+
+        self.assertEqual(len(chg_summary), 1)
+        self.assertAlmostEqual(chg_summary.iloc[0, 2], 0.2)
+
+    def test_repeated_participant_rows_are_summed(self):
+        import numpy as np
+        import pandas as pd
+        from .changes import buildHoldingMatrix
+        from .concentration import concentrationMetrics
+
+        snapshot = pd.DataFrame({'participant_id': ['C1', 'C2', 'C1'], 'participant_name': ['A', 'B', 'A'], 'participant_shares': [300, 200, 100]})
+
+        _, participant_ids, _, matrix = buildHoldingMatrix(snapshot.assign(date = '2022/09/16'), 'participant_shares')
+
+        self.assertEqual(list(participant_ids), ['C1', 'C2'])
+        self.assertEqual(matrix.tolist(), [[400, 200]])
+        self.assertAlmostEqual(np.square(matrix / 1000).sum(), concentrationMetrics(snapshot, 1000)['hhi'])
+
+def syntheticFrame(stock_code, d):
+
+    """(shareholding_data, total_issue) of the synthetic snapshot, as parsed from a result page"""
+
+    import pandas as pd
+    from .store import SNAPSHOT_COLUMNS
+
+    rows, total_issue = syntheticSnapshot(stock_code, d)
+
+    return pd.DataFrame(rows, columns = SNAPSHOT_COLUMNS), total_issue
+
+class ParserTests(SimpleTestCase):
+
+    def assertParsersAgree(self, page_source):
+        import pandas as pd
+        from .parser import parseResultPage, parseResultPageReadHtml
+
+        expected, expected_total_issue = parseResultPageReadHtml(page_source)
+        parsed, total_issue = parseResultPage(page_source)
+
+        self.assertGreater(len(parsed), 0)
+        pd.testing.assert_frame_equal(parsed, expected, check_dtype = False)
+        self.assertEqual(total_issue, expected_total_issue)
+
+    def test_matches_read_html_on_recorded_pages(self):
+        from .benchmarks import recordedPages
+
+        pages = recordedPages()
+        if len(pages) == 0:
+            self.skipTest('No pages recorded under myapp/fixtures/hkex_pages, see hkex_record_pages')
+
+        for name, page_source in pages.items():
+            with self.subTest(page = name):
+                self.assertParsersAgree(page_source)
+
+    def test_matches_read_html_on_markup_variants(self):
+        page_source = syntheticPage('00700', '2022/09/16', participants = 20)
+
+        variants = {'synthetic': page_source,
+                    'attributes': page_source.replace('<div class="mobile-list-body">', '<div data-label="" class="mobile-list-body col-value" >\n  '),
+                    'line breaks': page_source.replace(', HONG KONG</div>', ',<br/>HONG  KONG\n</div>'),
+                    'inline markup': page_source.replace('CCASS PARTICIPANT', '<span class="name">CCASS</span> PARTICIPANT'),
+                    }
+
+        for name, variant in variants.items():
+            with self.subTest(variant = name):
+                self.assertParsersAgree(variant)
+
+    def test_falls_back_to_read_html_on_missing_cells(self):
+        import re
+
+        page_source = syntheticPage('00700', '2022/09/16', participants = 20)
+        page_source = re.sub(r'<div class="mobile-list-body">[0-9.]+%</div>', '', page_source, count = 1)
+
+        with mock.patch('myapp.parser.increment') as increment:
+            self.assertParsersAgree(page_source)
+
+        increment.assert_any_call('parser_fallbacks')
+
+    def test_search_page_without_results(self):
+        from .parser import NoResultsError, parseResultPage
+        from .standin import renderSearchPage
+
+        with self.assertRaises(NoResultsError):
+            parseResultPage(renderSearchPage('viewstate', 'BOGUS', '2022/06/01'))
+
+        # Anything else is an unexpected page, not an answer
+        with self.assertRaises(ValueError) as raised:
+            parseResultPage('<html><body>Service Unavailable</body></html>')
+        self.assertNotIsInstance(raised.exception, NoResultsError)
+
+class TransferMatchingTests(SimpleTestCase):
+
+    def changes(self, rows):
+        import pandas as pd
+
+        return pd.DataFrame(rows, columns = ['stock_code', 'date', 'participant_id', 'participant_name', 'change'])
+
+    def pairs(self, transfers):
+        return sorted(zip(transfers['stock_code'], transfers['seller_id'], transfers['buyer_id']))
+
+    def test_matches_nearest_opposite_changes_per_stock_and_date(self):
+        from .transfers import TRANSFER_COLUMNS, matchTransfers
+
+        transfers = matchTransfers(self.changes([('00700', '2022/09/16', 'S1', 'SELLER 1', -0.10),
+                                                 ('00700', '2022/09/16', 'S2', 'SELLER 2', -0.05),
+                                                 ('00700', '2022/09/16', 'B1', 'BUYER 1', 0.049),
+                                                 ('00700', '2022/09/16', 'B2', 'BUYER 2', 0.101),
+                                                 ('00005', '2022/09/16', 'S3', 'SELLER 3', -0.02),
+                                                 ('00005', '2022/09/16', 'B3', 'BUYER 3', 0.02)
+                                                 ]))
+
+        self.assertEqual(list(transfers.columns), TRANSFER_COLUMNS)
+        self.assertEqual(self.pairs(transfers), [('00005', 'S3', 'B3'), ('00700', 'S1', 'B2'), ('00700', 'S2', 'B1')])
+        self.assertEqual(transfers.loc[transfers['seller_id'] == 'S3', 'confidence'].item(), 1)
+
+    def test_only_matches_within_tolerance(self):
+        from .transfers import matchTransfers
+
+        changes = self.changes([('00700', '2022/09/16', 'S1', 'SELLER 1', -0.10), ('00700', '2022/09/16', 'B1', 'BUYER 1', 0.085)])
+
+        self.assertEqual(len(matchTransfers(changes, tolerance = 0.1)), 0)
+        self.assertEqual(self.pairs(matchTransfers(changes, tolerance = 0.2)), [('00700', 'S1', 'B1')])
+
+    def test_legs_of_different_stock_codes_or_dates_are_not_matched(self):
+        from .transfers import matchTransfers
+
+        transfers = matchTransfers(self.changes([('00700', '2022/09/16', 'S1', 'SELLER 1', -0.10),
+                                                 ('00005', '2022/09/16', 'B1', 'BUYER 1', 0.10),
+                                                 ('00700', '2022/09/15', 'B2', 'BUYER 2', 0.10)
+                                                 ]))
+
+        self.assertEqual(len(transfers), 0)
+
+    def test_close_runner_up_lowers_confidence(self):
+        from .transfers import matchTransfers
+
+        transfers = matchTransfers(self.changes([('00700', '2022/09/16', 'S1', 'SELLER 1', -0.100),
+                                                 ('00700', '2022/09/16', 'B1', 'BUYER 1', 0.099),
+                                                 ('00700', '2022/09/16', 'B2', 'BUYER 2', 0.1015)
+                                                 ]))
+
+        self.assertEqual(self.pairs(transfers), [('00700', 'S1', 'B1')])
+        # Size similarity 0.99, weighted by the runner-up's distance 0.0015 against 0.001 for the match
+        self.assertAlmostEqual(transfers['confidence'].item(), 0.99 * 0.0015 / 0.0025)
+
+    def test_no_changes(self):
+        from .transfers import TRANSFER_COLUMNS, matchTransfers
+
+        self.assertEqual(list(matchTransfers(self.changes([])).columns), TRANSFER_COLUMNS)
+        self.assertEqual(len(matchTransfers(self.changes([('00700', '2022/09/16', 'S1', 'SELLER 1', 0.0)]))), 0)
+
+    def test_summary_changes_of_batch_report(self):
+        import pandas as pd
+        from .changes import CHG_SUMMARY_COLUMNS
+        from .transfers import matchTransfers, summaryChanges
+
+        chg_summary = pd.DataFrame([('00700', 'S1', 'SELLER 1', -0.03, pd.Timestamp('2022-09-16')),
+                                    ('00700', 'B1', 'BUYER 1', 0.03, pd.Timestamp('2022-09-16'))
+                                    ], columns = ['Stock Code'] + CHG_SUMMARY_COLUMNS)
+
+        self.assertEqual(self.pairs(matchTransfers(summaryChanges(chg_summary))), [('00700', 'S1', 'B1')])
+
+class TradingCalendarTests(SimpleTestCase):
+
+    def test_bundled_holidays_file(self):
+        import pandas as pd
+        from .tradingcalendar import TradingCalendar
+
+        calendar = TradingCalendar()
+
+        self.assertGreater(len(calendar.holidays), 0)
+        self.assertTrue(calendar.holidays.is_unique and calendar.holidays.is_monotonic_increasing)
+        self.assertTrue((calendar.holidays.weekday < 5).all())
+        self.assertEqual(calendar.holiday_names[pd.Timestamp('2022-06-03')], 'Tuen Ng Festival')
+        self.assertEqual(calendar.covered_until, pd.Timestamp(year = calendar.holidays[-1].year, month = 12, day = 31))
+
+    def test_skips_weekends_and_holidays(self):
+        from .tradingcalendar import TradingCalendar
+
+        calendar = TradingCalendar()
+
+        # Tuen Ng Festival on Friday 2022/06/03, then a weekend
+        self.assertEqual(calendar.tradingDays('2022/06/01', '2022/06/07'), ['2022/06/01', '2022/06/02', '2022/06/06', '2022/06/07'])
+        self.assertFalse(calendar.isTradingDay('2022/06/03'))
+        self.assertFalse(calendar.isTradingDay('2022/06/04'))
+        self.assertTrue(calendar.isTradingDay('2022/06/06'))
+        self.assertEqual(calendar.previousTradingDay('2022/06/06'), '2022/06/02')
+        self.assertEqual(calendar.previousTradingDay('2022/06/03'), '2022/06/02')
+        self.assertEqual(calendar.previousTradingDay('2022/06/02'), '2022/06/01')
+
+    def test_plan_starting_on_a_holiday(self):
+        from .tradingcalendar import planDates
+
+        plan = planDates('2022/06/03', '2022/06/08')
+
+        self.assertEqual(plan.dates, ['2022/06/06', '2022/06/07', '2022/06/08'])
+        self.assertEqual(plan.holidays_skipped, ['2022/06/03'])
+        self.assertEqual(plan.fetches_saved, 1)
+        self.assertFalse(plan.uncovered)
+
+    def test_plan_beyond_the_calendar(self):
+        from .tradingcalendar import TradingCalendar, planDates
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'holidays.csv'
+            path.write_text('# Test calendar\ndate,holiday\n2022/06/03,Tuen Ng Festival\n')
+            calendar = TradingCalendar(path)
+
+        plan = planDates('2022/12/29', '2023/01/03', calendar)
+
+        # 2023/01/02 is a holiday HKEX had not published in this calendar
+        self.assertEqual(plan.dates, ['2022/12/29', '2022/12/30', '2023/01/02', '2023/01/03'])
+        self.assertEqual(plan.fetches_saved, 0)
+        self.assertTrue(plan.uncovered)
+
+    def test_drop_duplicate_snapshots(self):
+        import pandas as pd
+        from .tradingcalendar import dropDuplicateSnapshots
+
+        def snapshot(shares, total_issue = 1000):
+            return pd.DataFrame({'participant_id': ['C00001', 'C00002'], 'participant_shares': shares}), total_issue
+
+        snapshots = {'2022/06/01': snapshot([100, 200]),
+                     '2022/06/02': snapshot([100, 200]),
+                     '2022/06/06': snapshot([100, 200], total_issue = 2000),
+                     '2022/06/07': snapshot([150, 150]),
+                     '2022/06/08': snapshot([150, 150]),
+                     '2022/06/09': snapshot([100, 200])
+                     }
+
+        unique, duplicates = dropDuplicateSnapshots(snapshots)
+
+        # Only consecutive identical snapshots collapse, a return to an earlier state is a change
+        self.assertEqual(list(unique), ['2022/06/01', '2022/06/06', '2022/06/07', '2022/06/09'])
+        self.assertEqual(duplicates, ['2022/06/02', '2022/06/08'])
+
+class SnapshotStoreTests(TestCase):
+
+    DATES = ['2022/09/14', '2022/09/15', '2022/09/16']
+
+    def assertStored(self, store, stock_code, dates):
+        import pandas as pd
+
+        snapshots = store.load(stock_code, dates)
+        self.assertEqual(list(snapshots), dates)
+        for d in dates:
+            shareholding_data, total_issue = syntheticFrame(stock_code, d)
+            pd.testing.assert_frame_equal(snapshots[d][0], shareholding_data, check_dtype = False)
+            self.assertEqual(snapshots[d][1], total_issue)
+
+    def test_put_many(self):
+        from .models import ConcentrationMetric, ShareholdingSnapshot
+        from .store import SnapshotStore
+
+        store = SnapshotStore()
+        store.put('00001', self.DATES[0], *syntheticFrame('00001', self.DATES[0]))
+        store.putMany('00001', {d: syntheticFrame('00001', d) for d in self.DATES + ['2099/01/01']})
+
+        self.assertStored(store, '00001', self.DATES)
+        self.assertEqual(ShareholdingSnapshot.objects.filter(stock_code = '00001').count(), 3)
+        self.assertEqual(ConcentrationMetric.objects.filter(stock_code = '00001').count(), 3)
+        self.assertEqual(store.missingDates('00001', self.DATES + ['2022/09/19']), ['2022/09/19'])
+
+    def test_put_many_falls_back_on_concurrent_insert(self):
+        from .models import ShareholdingSnapshot
+        from .store import SnapshotStore
+
+        store = SnapshotStore()
+        bulk_create = ShareholdingSnapshot.objects.bulk_create
+
+        # Another process stores one of the dates between the check for stored dates and the insert
+        def concurrentBulkCreate(snapshots, *args, **kwargs):
+            ShareholdingSnapshot.objects.create(stock_code = '00001', shareholding_date = snapshots[1].shareholding_date, total_issue = 1)
+            return bulk_create(snapshots, *args, **kwargs)
+
+        with mock.patch.object(ShareholdingSnapshot.objects, 'bulk_create', concurrentBulkCreate):
+            store.putMany('00001', {d: syntheticFrame('00001', d) for d in self.DATES})
+
+        self.assertStored(store, '00001', self.DATES)
+        self.assertEqual(ShareholdingSnapshot.objects.filter(stock_code = '00001').count(), 3)
+
+    def test_put_is_idempotent(self):
+        from .models import ParticipantHolding
+        from .store import SnapshotStore
+
+        store = SnapshotStore()
+        for _ in range(2):
+            store.put('00001', self.DATES[0], *syntheticFrame('00001', self.DATES[0]))
+
+        self.assertStored(store, '00001', self.DATES[:1])
+        self.assertEqual(ParticipantHolding.objects.count(), len(syntheticFrame('00001', self.DATES[0])[0]))
+
+class ColumnarStoreTests(TestCase):
+
+    DATES = SnapshotStoreTests.DATES
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+
+    def test_put_many_matches_put(self):
+        import pandas as pd
+        from .columnar import ColumnarStore
+        from .models import ConcentrationMetric
+
+        batched = ColumnarStore(self.root / 'batched')
+        batched.put('00001', self.DATES[0], *syntheticFrame('00001', self.DATES[0]))
+        batched.putMany('00001', {d: syntheticFrame('00001', d) for d in self.DATES + ['2099/01/01']})
+
+        single = ColumnarStore(self.root / 'single')
+        for d in self.DATES:
+            single.put('00001', d, *syntheticFrame('00001', d))
+
+        for store in [batched, single]:
+            snapshots = store.load('00001', self.DATES)
+            self.assertEqual(list(snapshots), self.DATES)
+            for d in self.DATES:
+                shareholding_data, total_issue = syntheticFrame('00001', d)
+                pd.testing.assert_frame_equal(snapshots[d][0], shareholding_data, check_dtype = False)
+                self.assertEqual(snapshots[d][1], total_issue)
+
+        self.assertEqual((self.root / 'batched' / '00001' / 'participants.json').read_text(),
+                         (self.root / 'single' / '00001' / 'participants.json').read_text())
+        self.assertEqual(ConcentrationMetric.objects.filter(stock_code = '00001').count(), 3)
+
+    def test_put_many_writes_participants_once(self):
+        import os
+        from .columnar import ColumnarStore
+
+        store = ColumnarStore(self.root)
+        with mock.patch.object(os, 'replace', wraps = os.replace) as replace:
+            store.putMany('00001', {d: syntheticFrame('00001', d) for d in self.DATES})
+
+        self.assertEqual(replace.call_count, 1)
+
+    def test_directory_locks_are_per_path(self):
+        from .columnar import directoryLock
+
+        self.assertIs(directoryLock(self.root / '00001'), directoryLock(self.root / '00001'))
+        self.assertIsNot(directoryLock(self.root / '00001'), directoryLock(self.root / '00002'))
+
+class ParticipantIndexTests(TestCase):
+
+    def moves(self):
+        from .models import ParticipantMove
+
+        return list(ParticipantMove.objects.order_by('date', 'participant_id').values_list('participant_id', 'date', 'shares', 'pct_change'))
+
+    def test_backfilled_dates_are_indexed(self):
+        from .models import ParticipantIndexDate, ParticipantMove
+        from .participants import indexStock
+        from .store import SnapshotStore
+
+        store = SnapshotStore()
+        for d in ['2022/09/13', '2022/09/16']:
+            store.put('00700', d, *syntheticFrame('00700', d))
+        self.assertGreater(indexStock('00700', store), 0)
+
+        # A backfill stores dates before and between the indexed ones
+        for d in ['2022/09/12', '2022/09/14', '2022/09/15']:
+            store.put('00700', d, *syntheticFrame('00700', d))
+        indexStock('00700', store, chunk_size = 2)
+        incremental = self.moves()
+
+        self.assertEqual(indexStock('00700', store), 0)
+        self.assertEqual(ParticipantIndexDate.objects.filter(stock_code = '00700').count(), 5)
+
+        # Same index as folding all five dates at once
+        ParticipantMove.objects.all().delete()
+        ParticipantIndexDate.objects.all().delete()
+        indexStock('00700', store)
+
+        self.assertEqual(incremental, self.moves())
+        self.assertEqual(sorted({move[1].strftime('%Y/%m/%d') for move in incremental}), ['2022/09/13', '2022/09/14', '2022/09/15', '2022/09/16'])
+
+class ConcentrationTests(TestCase):
+
+    def setUp(self):
+        from .models import ConcentrationMetric
+        from .store import toDate
+
+        def metric(stock_code, d, top10_pct, hhi, total_issue = 1000):
+            ccass_shares = int(total_issue * 0.9)
+            ConcentrationMetric.objects.create(stock_code = stock_code, date = toDate(d), total_issue = total_issue, participants = 20,
+                                               ccass_shares = ccass_shares, outside_ccass_shares = total_issue - ccass_shares,
+                                               outside_ccass_pct = 0.1 if total_issue > 0 else None,
+                                               top5_pct = top10_pct / 2 if top10_pct != None else None,
+                                               top10_pct = top10_pct, hhi = hhi)
+
+        metric('00001', '2022/09/16', 0.5, 0.05)
+        metric('00001', '2022/09/14', 0.3, 0.02)
+        metric('00001', '2022/09/15', 0.4, 0.03)
+        metric('00005', '2022/09/16', 0.8, 0.2)
+        metric('00700', '2022/09/16', 0.65, 0.08)
+        metric('08888', '2022/09/16', None, None, total_issue = 0)
+
+    def test_screen_filters_and_ranks(self):
+        from .concentration import screenConcentration
+
+        def codes(*args, **kwargs):
+            return [stock['stock_code'] for stock in screenConcentration('2022/09/16', *args, **kwargs)]
+
+        # Stock codes without figures rank last in both directions
+        self.assertEqual(codes(), ['00005', '00700', '00001', '08888'])
+        self.assertEqual(codes('top10_pct'), ['00001', '00700', '00005', '08888'])
+        self.assertEqual(codes('stock_code', limit = 2), ['00001', '00005'])
+
+        self.assertEqual(codes(minimums = {'top10_pct': 0.65}), ['00005', '00700'])
+        self.assertEqual(codes(minimums = {'top10_pct': 0.5}, maximums = {'hhi': 0.1}), ['00700', '00001'])
+        self.assertEqual(screenConcentration('2022/09/15')[0]['top10_pct'], 0.4)
+
+        with self.assertRaises(ValueError):
+            screenConcentration('2022/09/16', sort = '-participant_name')
+        with self.assertRaises(ValueError):
+            screenConcentration('2022/09/16', minimums = {'participant_name': 'A'})
+
+    def test_series_in_date_order(self):
+        from .concentration import concentrationSeries
+
+        series = concentrationSeries('00001')
+        self.assertEqual(list(series['date'].map(lambda d: d.strftime('%Y/%m/%d'))), ['2022/09/14', '2022/09/15', '2022/09/16'])
+        self.assertEqual(list(series['top10_pct']), [0.3, 0.4, 0.5])
+
+        series = concentrationSeries('00001', start_date = '2022/09/15', end_date = '2022/09/15')
+        self.assertEqual(list(series['top10_pct']), [0.4])
+        self.assertEqual(len(concentrationSeries('00002')), 0)
+
+    def test_screen_view(self):
+        response = self.client.get('/concentration/', {'min_top10_pct': '0.6'})
+        content = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content['date'].replace('-', '/'), '2022/09/16')
+        self.assertEqual([stock['stock_code'] for stock in content['stocks']], ['00005', '00700'])
+
+        response = self.client.get('/concentration/', {'date': '2022/09/16', 'sort': 'hhi', 'limit': '1'})
+        self.assertEqual([stock['stock_code'] for stock in response.json()['stocks']], ['00001'])
+
+        for params in [{'sort': '-participant_name'}, {'limit': 'all'}, {'min_hhi': 'high'}, {'date': '2022/13/45'}]:
+            with self.subTest(params = params):
+                response = self.client.get('/concentration/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_stock_series_view(self):
+        response = self.client.get('/concentration/1/', {'start_date': '2022/09/15'})
+        content = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content['stock_code'], '00001')
+        self.assertEqual([row['top10_pct'] for row in content['series']], [0.4, 0.5])
+        self.assertNotIn('stock_code', content['series'][0])
+
+        response = self.client.get('/concentration/1/', {'end_date': 'yesterday-ish'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+class HKEXConnectionTests(TestCase):
+
+    def test_stock_code_is_normalized(self):
+        from .hkex import HKEXInput, HKEXConnection
+        from .models import ShareholdingSnapshot
+        from .store import SnapshotStore
+
+        with HKEXStandInServer() as server:
+            hkex_obj = HKEXConnection(HKEXInput(' 700', '2022/09/16', '2022/09/16'), store = SnapshotStore(), url = server.url,
+                                      rate_limit = None, selenium_fallback = False)
+            hkex_obj.runAnalysis()
+
+        self.assertEqual(hkex_obj.user_input.stock_code, '00700')
+        self.assertEqual(list(ShareholdingSnapshot.objects.values_list('stock_code', flat = True)), ['00700'])
+
+    def test_no_results_page_is_not_retried(self):
+        from .hkex import HKEXInput, HKEXConnection
+        from .parser import NoResultsError
+
+        with HKEXStandInServer() as server, mock.patch('myapp.fetchers.SeleniumFetcher') as selenium_fetcher:
+            hkex_obj = HKEXConnection(HKEXInput('BOGUS', '2022/06/01', '2022/06/01'), url = server.url, rate_limit = None)
+
+            with self.assertRaises(NoResultsError):
+                hkex_obj.scrapeSnapshot('2022/06/01')
+
+        self.assertEqual(server.standin.requests, 1)
+        selenium_fetcher.assert_not_called()
+
+    def test_transport_errors_fall_back_to_one_browser(self):
+        from .fetchers import closeSharedPools
+        from .hkex import HKEXInput, HKEXConnection
+
+        class FakeBrowser():
+            def fetchPage(self, stock_code, d):
+                return syntheticPage(stock_code, d, participants = 20)
+            def healthy(self):
+                return True
+            def close(self):
+                pass
+
+        self.addCleanup(closeSharedPools)
+
+        # Nothing listens on port 1, so every HTTP fetch fails to connect
+        with mock.patch('myapp.fetchers.SeleniumFetcher', side_effect = lambda url: FakeBrowser()) as selenium_fetcher:
+            hkex_obj = HKEXConnection(HKEXInput('00700', '2022/09/15', '2022/09/16'), url = 'http://127.0.0.1:1/', rate_limit = None)
+
+            for d in ['2022/09/15', '2022/09/16']:
+                shareholding_data, total_issue = hkex_obj.scrapeSnapshot(d)
+                self.assertEqual(len(shareholding_data), 20)
+
+        selenium_fetcher.assert_called_once()
+
+    def test_failed_dates_without_results_are_not_retried(self):
+        from .hkex import HKEXInput, HKEXConnection
+
+        dates = ['2022/06/01', '2022/06/02', '2022/06/03']
+
+        with HKEXStandInServer() as server, mock.patch('myapp.fetchers.SeleniumFetcher') as selenium_fetcher:
+            hkex_obj = HKEXConnection(HKEXInput('BOGUS', dates[0], dates[-1]), url = server.url, rate_limit = None, max_workers = 3)
+            snapshots = hkex_obj.loadSnapshots(dates)
+
+        self.assertEqual(snapshots, {})
+        self.assertEqual(hkex_obj.fetch_report.no_results, set(dates))
+        self.assertEqual(server.standin.requests, len(dates))
+        selenium_fetcher.assert_not_called()
+
+    def test_one_fallback_browser_per_connection(self):
+        from .fetchers import closeSharedPools
+        from .hkex import HKEXInput, HKEXConnection
+
+        class BrokenBrowser():
+            fetches = 0
+            def fetchPage(self, stock_code, d):
+                BrokenBrowser.fetches += 1
+                raise RuntimeError('Chrome crashed')
+            def healthy(self):
+                return False
+            def close(self):
+                pass
+
+        self.addCleanup(closeSharedPools)
+
+        dates = ['2022/09/14', '2022/09/15', '2022/09/16']
+
+        with mock.patch('myapp.fetchers.SeleniumFetcher', side_effect = lambda url: BrokenBrowser()) as selenium_fetcher:
+            hkex_obj = HKEXConnection(HKEXInput('00700', dates[0], dates[-1]), url = 'http://127.0.0.1:1/', rate_limit = None,
+                                      max_workers = 3, retries = 0)
+            snapshots = hkex_obj.loadSnapshots(dates)
+
+        self.assertEqual(snapshots, {})
+        self.assertEqual(sorted(hkex_obj.fetch_report.failed), dates)
+        selenium_fetcher.assert_called_once()
+        self.assertEqual(BrokenBrowser.fetches, 1)
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        from .instrumentation import METRICS
+
+        METRICS.reset()
+        self.addCleanup(METRICS.reset)
+
+    def test_analysis_counters_are_exported(self):
+        from .fetchers import FetcherPool
+        from .hkex import HKEXInput, HKEXConnection
+        from .instrumentation import METRICS
+        from .store import SnapshotStore
+
+        # Tuen Ng Festival on 2022/06/03 leaves four settlement dates
+        hkex_obj = HKEXConnection(HKEXInput('00700', '2022/06/01', '2022/06/07', 0.001), store = SnapshotStore(),
+                                  pool = FetcherPool(FakeFetcher, max_size = 2), max_workers = 2, rate_limit = None,
+                                  selenium_fallback = False)
+        hkex_obj.runChangeAnalysis()
+
+        counters = METRICS.snapshot()['counters']
+        self.assertEqual(counters['store_misses'], 4)
+        self.assertEqual(counters['rows_parsed'], 4 * 20)
+        self.assertEqual(counters['holiday_fetches_saved'], 1)
+        self.assertLessEqual(counters['sessions_created'], 2)
+
+        response = self.client.get('/metrics')
+        lines = response.content.decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# HELP hkex_store_misses_total Snapshots missing from the snapshot store', lines)
+        self.assertIn('# TYPE hkex_store_misses_total counter', lines)
+        self.assertIn('hkex_store_misses_total 4', lines)
+        self.assertIn('hkex_rows_parsed_total 80', lines)
+        self.assertIn('# TYPE hkex_stage_seconds histogram', lines)
+        self.assertIn('hkex_stage_seconds_bucket{stage="parse",le="+Inf"} 4', lines)
+        self.assertIn('hkex_stage_seconds_count{stage="parse"} 4', lines)
+
+        # A second run is served from the store
+        HKEXConnection(HKEXInput('00700', '2022/06/01', '2022/06/07', 0.001), store = SnapshotStore(),
+                       pool = FetcherPool(FakeFetcher), rate_limit = None).runChangeAnalysis()
+
+        self.assertIn('hkex_store_hits_total 4', self.client.get('/metrics').content.decode().splitlines())
+
+class IterChangesTests(TestCase):
+
+    START_DATE = '2022/06/01'
+    END_DATE = '2022/06/30'
+
+    def connection(self, pool = None):
+        from .fetchers import FetcherPool
+        from .hkex import HKEXInput, HKEXConnection
+        from .store import SnapshotStore
+
+        return HKEXConnection(HKEXInput('00700', self.START_DATE, self.END_DATE, 0.001), store = SnapshotStore(),
+                              pool = pool if pool != None else FetcherPool(FakeFetcher, max_size = 2), max_workers = 2,
+                              rate_limit = None, retries = 0)
+
+    def test_streamed_changes_match_change_analysis(self):
+        import pandas as pd
+
+        hkex_obj = self.connection()
+        dates = hkex_obj.analysisDates()
+        streamed = list(hkex_obj.iterChanges())
+
+        self.assertEqual([d for d, _ in streamed], dates[1:])
+
+        full = self.connection()
+        full.runChangeAnalysis()
+
+        columns = ['Date of Transaction', 'Participant ID']
+        changes = pd.concat([changes for _, changes in streamed]).sort_values(columns).reset_index(drop = True)
+        self.assertGreater(len(changes), 0)
+        pd.testing.assert_frame_equal(changes, full.chg_summary.sort_values(columns).reset_index(drop = True), check_dtype = False)
+
+    def test_stored_dates_straddle_chunks(self):
+        import pandas as pd
+        from .store import SnapshotStore
+
+        hkex_obj = self.connection()
+        dates = hkex_obj.analysisDates()
+
+        # Every other date is stored, the rest is fetched between chunks of stored ones
+        hkex_obj.loadSnapshots(dates[::2])
+        streamed = list(hkex_obj.iterSnapshots(chunk_size = 3))
+
+        self.assertEqual([d for d, _, _ in streamed], dates)
+        self.assertEqual(sorted(hkex_obj.fetch_report.fetched), dates[1::2])
+
+        stored = SnapshotStore().load('00700', dates)
+        for d, shareholding_data, total_issue in streamed:
+            with self.subTest(date = d):
+                self.assertEqual(total_issue, stored[d][1])
+                pd.testing.assert_frame_equal(shareholding_data.reset_index(drop = True), stored[d][0].reset_index(drop = True), check_dtype = False)
+
+    def test_failing_date_is_skipped(self):
+        from .fetchers import FetcherPool
+
+        class FailingFetcher(FakeFetcher):
+            def fetchPage(self, stock_code, d):
+                if d == '2022/06/08':
+                    raise ValueError('Unexpected page')
+                return super().fetchPage(stock_code, d)
+
+        hkex_obj = self.connection(FetcherPool(FailingFetcher, max_size = 2))
+        dates = hkex_obj.analysisDates()
+        streamed = dict(hkex_obj.iterChanges())
+
+        self.assertEqual(list(streamed), [d for d in dates[1:] if d != '2022/06/08'])
+        self.assertEqual(list(hkex_obj.fetch_report.failed), ['2022/06/08'])
+
+    def test_fetch_yields_in_date_order(self):
+        from .fetchers import FetchReport, FetcherPool, iterFetchSnapshots
+
+        class SlowFetcher(FakeFetcher):
+            def fetchPage(self, stock_code, d):
+                # Earlier dates finish last
+                time.sleep(0.05 if d == '2022/06/01' else 0)
+                if d == '2022/06/06':
+                    raise ValueError('Unexpected page')
+                return super().fetchPage(stock_code, d)
+
+        dates = ['2022/06/01', '2022/06/02', '2022/06/06', '2022/06/07']
+        report = FetchReport()
+        fetched = list(iterFetchSnapshots('00700', dates, FetcherPool(SlowFetcher, max_size = 4), report, max_workers = 4, retries = 0))
+
+        self.assertEqual([d for d, _ in fetched], dates)
+        self.assertEqual([snapshot == None for _, snapshot in fetched], [False, False, True, False])
+        self.assertEqual(list(report.failed), ['2022/06/06'])
+
+    def test_closing_the_stream_returns_sessions(self):
+        from .fetchers import FetcherPool
+
+        pool = FetcherPool(FakeFetcher, max_size = 2)
+        hkex_obj = self.connection(pool)
+        dates = hkex_obj.analysisDates()
+
+        changes = hkex_obj.iterChanges()
+        next(changes)
+        changes.close()
+
+        # Fetches in flight are finished and checked in, the ones not started are cancelled
+        self.assertEqual(pool.idle.qsize(), pool.size)
+        self.assertLess(len(hkex_obj.fetch_report.fetched), len(dates))
+
+class BatchTests(TestCase):
+
+    def test_batch_change_analysis(self):
+        from .batch import runBatchChangeAnalysis
+        from .hkex import HKEXInput, HKEXConnection
+
+        with HKEXStandInServer() as server:
+            result = runBatchChangeAnalysis(['1', '00700', 'BOGUS'], '2022/09/12', '2022/09/19', 0.001, processes = 1,
+                                            url = server.url, rate_limit = None, selenium_fallback = False, retries = 0)
+
+            hkex_obj = HKEXConnection(HKEXInput('00700', '2022/09/12', '2022/09/19', 0.001), url = server.url, rate_limit = None)
+            hkex_obj.runChangeAnalysis()
+
+        self.assertEqual(list(result.failed), ['BOGUS'])
+        self.assertTrue(set(result.chg_summary['Stock Code']) <= {'00001', '00700'})
+        self.assertGreater(len(hkex_obj.chg_summary), 0)
+        self.assertEqual(len(result.chg_summary[result.chg_summary['Stock Code'] == '00700']), len(hkex_obj.chg_summary))
+
+class BackfillTests(TestCase):
+
+    def test_resumes_after_interruption(self):
+        from .backfill import backfillStats, planBackfill, runBackfill
+        from .fetchers import fetchWithRetries
+        from .models import BackfillRun, BackfillUnit, ParticipantIndexDate
+        from .store import SnapshotStore
+
+        store = SnapshotStore()
+        run = planBackfill(['1', '700', '5'], '2022/09/12', '2022/09/16', store)
+        units = run.units.count()
+        self.assertGreater(units, 6)
+
+        def interrupt(tracker):
+            raise KeyboardInterrupt
+
+        with HKEXStandInServer() as server:
+            options = {'store': store, 'url': server.url, 'max_workers': 3, 'rate_limit': None, 'retries': 0, 'commit_size': 4}
+
+            with self.assertRaises(KeyboardInterrupt):
+                runBackfill(run, progress = interrupt, **options)
+
+            run.refresh_from_db()
+            committed = set(run.units.filter(status = BackfillUnit.DONE).values_list('stock_code', 'date'))
+            self.assertEqual(run.status, BackfillRun.STOPPED)
+            self.assertEqual(backfillStats(run), {BackfillUnit.PENDING: units - 4, BackfillUnit.DONE: 4, BackfillUnit.FAILED: 0})
+
+            fetches = []
+            def countingFetch(stock_code, d, *args):
+                fetches.append((stock_code, d))
+                return fetchWithRetries(stock_code, d, *args)
+
+            with mock.patch('myapp.fetchers.fetchWithRetries', countingFetch):
+                stats = runBackfill(run, **options)
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, BackfillRun.DONE)
+        self.assertEqual(stats, {BackfillUnit.PENDING: 0, BackfillUnit.DONE: units, BackfillUnit.FAILED: 0})
+
+        # Committed units are not fetched again, and the first 2 x max_workers fetches span stock codes
+        self.assertEqual(len(fetches), units - 4)
+        self.assertGreater(len({stock_code for stock_code, _ in fetches[:6]}), 1)
+        self.assertFalse({(stock_code, d.strftime('%Y/%m/%d')) for stock_code, d in committed} & set(fetches))
+
+        for stock_code in ['00001', '00700', '00005']:
+            self.assertEqual(store.missingDates(stock_code, [d.strftime('%Y/%m/%d') for d in run.units.filter(stock_code = stock_code).values_list('date', flat = True)]), [])
+            self.assertEqual(ParticipantIndexDate.objects.filter(stock_code = stock_code).count(), run.units.filter(stock_code = stock_code).count())
+
+class AnalysisJobTests(TestCase):
+
+    def setUp(self):
+        from .resultcache import SERIES_CACHE, SUMMARY_CACHE, resultCache
+
+        resultCache(SERIES_CACHE).clear()
+        resultCache(SUMMARY_CACHE).clear()
+
+    def test_identical_requests_share_a_job(self):
+        from .jobs import submitJob
+
+        job, created = submitJob('700', '2022/09/12', '2022/09/19', 0.01)
+        same_job, same_created = submitJob('00700', '2022-09-12', '2022/9/19', 0.01)
+        other_job, other_created = submitJob('00700', '2022/09/12', '2022/09/19', 0.02)
+
+        self.assertTrue(created)
+        self.assertEqual((job.start_date, job.end_date), ('2022/09/12', '2022/09/19'))
+        self.assertEqual((same_job.id, same_created), (job.id, False))
+        self.assertTrue(other_created)
+        self.assertNotEqual(other_job.id, job.id)
+
+    def test_stale_running_job_is_requeued(self):
+        from django.utils import timezone
+        from .jobs import STALE_AFTER, claimJob, submitJob
+        from .models import AnalysisJob
+
+        job, _ = submitJob('00700', '2022/09/12', '2022/09/19', 0.01)
+        self.assertEqual(claimJob().id, job.id)
+        self.assertIsNone(claimJob())
+
+        # The worker running it stopped sending progress
+        AnalysisJob.objects.filter(id = job.id).update(updated_at = timezone.now() - STALE_AFTER - STALE_AFTER)
+
+        resubmitted, created = submitJob('00700', '2022/09/12', '2022/09/19', 0.01)
+        self.assertTrue(created)
+        self.assertNotEqual(resubmitted.id, job.id)
+
+        claimed = claimJob()
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, AnalysisJob.RUNNING)
+
+    def test_run_job_stores_full_precision_results(self):
+        import pandas as pd
+        from .hkex import HKEXInput, HKEXConnection
+        from .jobs import claimJob, loadResults, runJob, submitJob
+        from .models import AnalysisJob
+
+        submitJob('00700', '2022/09/12', '2022/09/19', 0.001)
+
+        with HKEXStandInServer() as server:
+            job = runJob(claimJob(), url = server.url, rate_limit = None)
+
+            hkex_obj = HKEXConnection(HKEXInput('00700', '2022/09/12', '2022/09/19', 0.001), url = server.url, rate_limit = None)
+            hkex_obj.runChangeAnalysis()
+
+        self.assertEqual(job.status, AnalysisJob.DONE)
+
+        _, chg_summary = loadResults(AnalysisJob.objects.get(id = job.id))
+        pd.testing.assert_frame_equal(chg_summary, hkex_obj.chg_summary, check_dtype = False, rtol = 1e-14)
+
+        # An identical request is answered from the result cache
+        cached, created = submitJob('00700', '2022/09/12', '2022/09/19', 0.001)
+        self.assertTrue(created)
+        self.assertEqual(cached.status, AnalysisJob.DONE)
+
+    def test_cache_hits_skip_the_fetch(self):
+        from django.db import connection
+        from .fetchers import FetcherPool
+        from .hkex import HKEXInput, HKEXConnection
+        from .jobs import claimJob, runJob, submitJob
+        from .models import AnalysisJob
+
+        submitJob('00700', '2022/06/01', '2022/06/10', 0.001)
+        runJob(claimJob(), pool = FetcherPool(FakeFetcher), rate_limit = None)
+
+        # Results of the worker are kept where the web process reads them
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM hkex_summaries_cache')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        job, created = submitJob('700', '2022-06-01', '2022/06/10', 0.001)
+        self.assertEqual((job.status, created), (AnalysisJob.DONE, True))
+        self.assertEqual(claimJob(), None)
+
+        # A new threshold is applied to the cached holdings time series
+        hkex_obj = HKEXConnection(HKEXInput('00700', '2022/06/01', '2022/06/10', 0.01), pool = FetcherPool(FakeFetcher),
+                                  rate_limit = None, use_cache = True)
+        with mock.patch.object(HKEXConnection, 'loadSnapshots') as loadSnapshots:
+            hkex_obj.runChangeAnalysis()
+
+        loadSnapshots.assert_not_called()
+
+class JobResultsTests(TestCase):
+
+    def setUp(self):
+        import pandas as pd
+        from .changes import CHG_SUMMARY_COLUMNS
+        from .jobs import saveResults
+        from .models import AnalysisJob
+
+        shareholding_data, total_issue = syntheticFrame('00700', '2022/09/16')
+        shareholding_data['participant_pct_holding'] = shareholding_data['participant_shares'] / total_issue
+        self.shareholding_data = shareholding_data.sort_values('participant_pct_holding', ascending = False)
+
+        self.chg_summary = pd.DataFrame([('C00019', 'A', 0.012, '2022/09/13'),
+                                         ('C00019', 'A', -0.030, '2022/09/15'),
+                                         ('B01234', 'B', 0.005, '2022/09/14'),
+                                         ('C00100', 'C', -0.012, '2022/09/16')
+                                         ], columns = CHG_SUMMARY_COLUMNS)
+        self.chg_summary['Date of Transaction'] = pd.to_datetime(self.chg_summary['Date of Transaction'])
+
+        self.job = AnalysisJob.objects.create(stock_code = '00700', start_date = '2022/09/12', end_date = '2022/09/16',
+                                              chg_threshold = 0.001, status = AnalysisJob.DONE)
+        saveResults(self.job, self.shareholding_data, self.chg_summary)
+
+    def test_results_round_trip(self):
+        import pandas as pd
+        from .jobs import loadResults
+
+        shareholding_data, chg_summary = loadResults(self.job)
+
+        pd.testing.assert_frame_equal(shareholding_data, self.shareholding_data.reset_index(drop = True), check_dtype = False)
+        pd.testing.assert_frame_equal(chg_summary, self.chg_summary, check_dtype = False)
+
+    def test_changes_are_filtered_sorted_and_paginated(self):
+        response = self.client.get('/jobs/' + str(self.job.id) + '/changes/',
+                                   {'min_change': '0.01', 'sort': '-pct_change', 'page_size': 2, 'page': 2})
+        content = response.json()
+
+        self.assertEqual((content['count'], content['num_pages'], content['page']), (3, 2, 2))
+        self.assertEqual(content['results'], [{'participant_id': 'C00019', 'participant_name': 'A', 'pct_change': -0.03, 'transaction_date': '2022-09-15'}])
+
+        response = self.client.get('/jobs/' + str(self.job.id) + '/changes/', {'participant_id': 'c00019', 'date_from': '2022/09/14'})
+        self.assertEqual([row['transaction_date'] for row in response.json()['results']], ['2022-09-15'])
+
+        response = self.client.get('/jobs/' + str(self.job.id) + '/holdings/', {'min_change': '0.01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_streams_rows(self):
+        import pandas as pd
+        from io import StringIO
+
+        response = self.client.get('/jobs/' + str(self.job.id) + '/holdings.csv')
+        exported = pd.read_csv(StringIO(b''.join(response.streaming_content).decode()), keep_default_na = False)
+
+        self.assertTrue(response.streaming)
+        pd.testing.assert_frame_equal(exported, self.shareholding_data.reset_index(drop = True), check_dtype = False)
+
+    def test_job_page_renders_one_page_of_each_table(self):
+        response = self.client.get('/jobs/' + str(self.job.id) + '/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['holdings_page'].paginator.count, len(self.shareholding_data))
+        self.assertEqual(len(response.context['holdings_page'].object_list), min(len(self.shareholding_data), 50))
+        self.assertIn('C00019', response.context['chg_summary'])
+
+    def test_chart_of_a_final_window(self):
+        from django.core.cache import cache
+        from .charts import CHART_CACHE_TIMEOUT, renderTopParticipants
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        url = '/jobs/' + str(self.job.id) + '/chart.png'
+
+        with mock.patch('myapp.charts.renderTopParticipants', wraps = renderTopParticipants) as render:
+            response = self.client.get(url, {'top': 5})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(response.content.startswith(b'\x89PNG'))
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('max-age=' + str(CHART_CACHE_TIMEOUT), response['Cache-Control'])
+
+            # Only the plotted holdings are read
+            plotted = render.call_args[0][0]
+            self.assertEqual(list(plotted['participant_id']), list(self.shareholding_data['participant_id'].head(5)))
+
+            etag = response['ETag']
+            response = self.client.get(url, {'top': 5}, HTTP_IF_NONE_MATCH = etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+            # Other sizes are other charts, a repeated one comes from the cache
+            self.assertNotEqual(self.client.get(url, {'top': 10})['ETag'], etag)
+            self.client.get(url, {'top': 5})
+
+        self.assertEqual(render.call_count, 2)
+
+    def test_chart_of_a_window_ending_today(self):
+        import datetime
+        from django.core.cache import cache
+        from .charts import chartETag, chartKey
+        from .jobs import saveResults
+        from .models import AnalysisJob
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        today = datetime.date.today().strftime('%Y/%m/%d')
+        job = AnalysisJob.objects.create(stock_code = '00700', start_date = '2022/09/12', end_date = today,
+                                         chg_threshold = 0.001, status = AnalysisJob.DONE)
+        saveResults(job, self.shareholding_data, None)
+
+        # Today's holdings may still be revised, so the chart is neither tagged nor cached
+        response = self.client.get('/jobs/' + str(job.id) + '/chart.png', HTTP_IF_NONE_MATCH = '"' + chartETag('00700', today, 10) + '"')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertNotIn('ETag', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(cache.get(chartKey('00700', today, 10)), None)
+
+class ContactViewTests(TestCase):
+
+    FORM = {'stock_code': '700', 'start_date': '2022/09/12', 'end_date': '2022/09/19', 'change_threshold': '0.01'}
+
+    def test_invalid_input_is_a_form_error(self):
+        from .models import AnalysisJob
+
+        for field, value, error in [('start_date', '2022/13/45', 'Enter a date as YYYY/MM/DD.'),
+                                    ('end_date', 'yesterday', 'Enter a date as YYYY/MM/DD.'),
+                                    ('end_date', '2022/09/01', 'End date must not be before the start date.'),
+                                    ('change_threshold', 'one percent', 'Enter a number.')
+                                    ]:
+            with self.subTest(field = field, value = value):
+                response = self.client.post('/', dict(self.FORM, **{field: value}))
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.context['form'].errors[field], [error])
+
+        response = self.client.post('/', dict(self.FORM, start_date = 'soon'), HTTP_ACCEPT = 'application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('start_date', response.json()['errors'])
+
+        self.assertEqual(AnalysisJob.objects.count(), 0)
+
+    def test_valid_input_queues_a_job(self):
+        from .models import AnalysisJob
+
+        response = self.client.post('/', self.FORM)
+        job = AnalysisJob.objects.get()
+
+        self.assertRedirects(response, '/jobs/' + str(job.id) + '/', fetch_redirect_response = False)
+        self.assertEqual(self.client.post('/', self.FORM, HTTP_ACCEPT = 'application/json').json()['job_id'], job.id)
+
+class IncrementalChangeAnalysisTests(TestCase):
+
+    def setUp(self):
+        self.server = HKEXStandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connection(self, start_date, end_date):
+        from .hkex import HKEXInput, HKEXConnection
+
+        return HKEXConnection(HKEXInput('00700', start_date, end_date, 0.001), url = self.server.url, rate_limit = None, selenium_fallback = False)
+
+    def assertSameChanges(self, start_date, end_date):
+        import pandas as pd
+
+        incremental = self.connection(start_date, end_date)
+        incremental.runIncrementalChangeAnalysis()
+
+        full = self.connection(start_date, end_date)
+        full.runChangeAnalysis()
+
+        self.assertGreater(len(full.chg_summary), 0)
+        pd.testing.assert_frame_equal(incremental.chg_summary, full.chg_summary.sort_values(['Date of Transaction', 'Participant ID']).reset_index(drop = True),
+                                      check_dtype = False)
+
+    def test_rolling_windows_match_full_analysis(self):
+        self.assertSameChanges('2022/06/01', '2022/06/10')
+        self.assertSameChanges('2022/06/06', '2022/06/17')
+        self.assertSameChanges('2022/06/08', '2022/06/17')
+
+    def test_window_after_a_gap_in_the_stored_series(self):
+        from .models import ChangeAnalysisState
+        from .store import toDate
+
+        self.assertSameChanges('2022/06/01', '2022/06/10')
+
+        # Trading days between the stored series and the window are analysed as well
+        self.assertSameChanges('2022/06/27', '2022/06/30')
+        self.assertSameChanges('2022/06/22', '2022/06/30')
+
+        state = ChangeAnalysisState.objects.get(stock_code = '00700', chg_threshold = 0.001)
+        self.assertEqual((state.first_date, state.last_date), (toDate('2022/06/01'), toDate('2022/06/30')))
+
+    def test_window_before_the_stored_series_starts_a_new_one(self):
+        self.assertSameChanges('2022/06/13', '2022/06/17')
+        self.assertSameChanges('2022/06/01', '2022/06/17')
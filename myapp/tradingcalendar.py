@@ -0,0 +1,149 @@
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+HOLIDAYS_FILE = Path(__file__).resolve().parent / 'data' / 'hkex_holidays.csv'
+
+class TradingCalendar():
+
+    def __init__(self, path = HOLIDAYS_FILE):
+
+        """
+        Parameters
+        ----------
+        path : str or Path
+            CSV file of HKEX market holidays (date,holiday), dates as YYYY/MM/DD
+        """
+
+        holidays = pd.read_csv(path, comment = '#', dtype = str)
+
+        self.holidays = pd.DatetimeIndex(pd.to_datetime(holidays['date'], format = '%Y/%m/%d')).sort_values()
+        self.holiday_names = dict(zip(self.holidays, holidays['holiday']))
+
+        # Holidays after the last year listed are unknown
+        self.covered_until = pd.Timestamp(year = self.holidays[-1].year, month = 12, day = 31) if len(self.holidays) > 0 else None
+
+    def tradingDays(self, start_date, end_date):
+
+        """Returns the settlement dates (YYYY/MM/DD) between start and end date: weekdays that are not HKEX holidays"""
+
+        return list(pd.bdate_range(start_date, end_date, freq = 'C', holidays = self.holidays).strftime('%Y/%m/%d').values)
+
+    def isTradingDay(self, d):
+
+        d = pd.Timestamp(d)
+
+        return d.weekday() < 5 and d.normalize() not in self.holiday_names
+
+    def previousTradingDay(self, d):
+
+        """Returns the last trading day strictly before d (YYYY/MM/DD)"""
+
+        return (pd.Timestamp(d) - pd.offsets.CustomBusinessDay(1, holidays = self.holidays)).strftime('%Y/%m/%d')
+
+class DatePlan():
+
+    """Dates to fetch for an analysis and the fetches saved by skipping holidays and duplicate snapshots"""
+
+    def __init__(self, dates, holidays_skipped, uncovered = False):
+        self.dates = dates
+        self.holidays_skipped = holidays_skipped
+        self.duplicates_skipped = []
+        self.uncovered = uncovered
+
+    @property
+    def fetches_saved(self):
+        return len(self.holidays_skipped)
+
+    def __str__(self):
+
+        report = (str(len(self.dates)) + ' settlement dates planned, ' +
+                  str(len(self.holidays_skipped)) + ' holiday fetches saved, ' +
+                  str(len(self.duplicates_skipped)) + ' duplicate snapshots skipped')
+
+        if self.uncovered:
+            report += ' (range extends beyond the holiday calendar, weekdays assumed to be trading days)'
+
+        return report
+
+def planDates(start_date, end_date, calendar = None):
+
+    """
+    Parameters
+    ----------
+    start_date : str
+        Start date of analysis
+    end_date : str
+        End date of analysis
+    calendar : TradingCalendar, optional
+        Defaults to the bundled HKEX holiday calendar
+
+    Returns
+    -------
+    DatePlan
+    """
+
+    calendar = calendar if calendar != None else defaultCalendar()
+
+    weekdays = list(pd.bdate_range(start_date, end_date).strftime('%Y/%m/%d').values)
+    dates = calendar.tradingDays(start_date, end_date)
+
+    trading = set(dates)
+    holidays_skipped = [d for d in weekdays if d not in trading]
+
+    uncovered = calendar.covered_until == None or pd.Timestamp(end_date) > calendar.covered_until
+
+    return DatePlan(dates, holidays_skipped, uncovered)
+
+DEFAULT_CALENDAR = None
+
+def defaultCalendar():
+
+    """Returns the bundled HKEX holiday calendar, loaded once per process"""
+
+    global DEFAULT_CALENDAR
+
+    if DEFAULT_CALENDAR == None:
+        DEFAULT_CALENDAR = TradingCalendar()
+
+    return DEFAULT_CALENDAR
+
+def snapshotFingerprint(shareholding_data, total_issue):
+
+    """Digest of a snapshot's total issue and participant holdings, equal for identical snapshots"""
+
+    digest = hashlib.blake2b(str(int(total_issue)).encode(), digest_size = 16)
+    digest.update('\x1f'.join(shareholding_data['participant_id'].astype(str)).encode())
+    digest.update(np.ascontiguousarray(shareholding_data['participant_shares'].to_numpy(dtype = np.int64)).tobytes())
+
+    return digest.digest()
+
+def dropDuplicateSnapshots(snapshots):
+
+    """
+    Parameters
+    ----------
+    snapshots : dict
+        Maps dates, in date order, to (shareholding_data, total_issue)
+
+    Returns
+    -------
+    tuple
+        (snapshots, duplicates) without the dates whose snapshot is identical to the prior date's, which carry no change
+    """
+
+    unique = {}
+    duplicates = []
+    previous = None
+
+    for d, snapshot in snapshots.items():
+        fingerprint = snapshotFingerprint(*snapshot)
+        if fingerprint == previous:
+            duplicates.append(d)
+            continue
+        unique[d] = snapshot
+        previous = fingerprint
+
+    return unique, duplicates
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+from .changes import CHG_SUMMARY_COLUMNS
+
+TRANSFER_COLUMNS = ['stock_code', 'date', 'seller_id', 'seller_name', 'buyer_id', 'buyer_name', 'seller_change', 'buyer_change', 'confidence']
+
+# Neighbours of a seller within the sorted buyer keys considered as nearest and runner-up match
+NEIGHBOURS = np.array([-2, -1, 0, 1])
+
+def nearestBuyers(seller_keys, seller_groups, buyer_keys, buyer_groups):
+
+    """
+    Parameters
+    ----------
+    seller_keys, buyer_keys : ndarray
+        Composite sort keys, group code * 4 + amount scaled to [0, 1] by the largest amount of the group. buyer_keys sorted
+    seller_groups, buyer_groups : ndarray
+        Group code (stock code and date) of each seller and buyer
+
+    Returns
+    -------
+    tuple
+        (best, best_distance, second_distance) per seller: position of the nearest buyer of the same group in buyer_keys
+        (-1 if the group has no buyer), the key distance to it and to the runner-up (inf if there is none)
+    """
+
+    positions = np.searchsorted(buyer_keys, seller_keys)[:, None] + NEIGHBOURS
+
+    valid = (positions >= 0) & (positions < len(buyer_keys))
+    positions = np.clip(positions, 0, max(len(buyer_keys) - 1, 0))
+
+    if len(buyer_keys) > 0:
+        valid &= buyer_groups[positions] == seller_groups[:, None]
+        distances = np.where(valid, np.abs(buyer_keys[positions] - seller_keys[:, None]), np.inf)
+    else:
+        distances = np.full(positions.shape, np.inf)
+
+    order = np.argsort(distances, axis = 1, kind = 'stable')
+    rows = np.arange(len(seller_keys))
+
+    best = np.where(np.isfinite(distances[rows, order[:, 0]]), positions[rows, order[:, 0]], -1)
+
+    return best, distances[rows, order[:, 0]], distances[rows, order[:, 1]]
+
+def matchTransfers(changes, tolerance = 0.1, max_rounds = 10):
+
+    """
+    Pairs opposite-signed changes of near-equal size on the same stock code and date into probable transfers
+
+    Sellers and buyers of every stock code and date are placed on one sorted key axis, so that the nearest buyer of each
+    seller (and vice versa) is found by binary search for all groups at once. Mutually nearest pairs within tolerance
+    are matched, removed, and the search is repeated on the remaining legs.
+
+    Parameters
+    ----------
+    changes : DataFrame
+        One row per participant change with stock_code, date, participant_id, participant_name and change columns.
+        change is signed, in shares or in % of total issue (equivalent within a stock code and date)
+    tolerance : float
+        Maximum size difference of the two legs relative to the larger one
+    max_rounds : int
+        Maximum number of match-and-remove passes
+
+    Returns
+    -------
+    DataFrame
+        TRANSFER_COLUMNS rows ordered by stock code, date and descending confidence. confidence is the size similarity
+        of the legs (1 for equal sizes) weighted down when another buyer of similar size was a close runner-up
+    """
+
+    changes = changes[changes['change'] != 0].reset_index(drop = True)
+
+    if len(changes) == 0:
+        return pd.DataFrame(columns = TRANSFER_COLUMNS)
+
+    group_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([changes['stock_code'], changes['date']]))
+    amounts = np.abs(changes['change'].to_numpy(dtype = float))
+
+    # Scale amounts within each group so that keys of different groups never overlap
+    scale = pd.Series(amounts).groupby(group_codes).transform('max').to_numpy()
+    keys = group_codes * 4.0 + amounts / scale
+
+    is_seller = changes['change'].to_numpy(dtype = float) < 0
+
+    sellers = np.nonzero(is_seller)[0]
+    buyers = np.nonzero(~is_seller)[0]
+
+    matched_sellers = []
+    matched_buyers = []
+    confidences = []
+
+    for _ in range(max_rounds):
+        if len(sellers) == 0 or len(buyers) == 0:
+            break
+
+        buyers = buyers[np.argsort(keys[buyers], kind = 'stable')]
+        sellers = sellers[np.argsort(keys[sellers], kind = 'stable')]
+
+        best_buyer, buyer_distance, runner_up_distance = nearestBuyers(keys[sellers], group_codes[sellers], keys[buyers], group_codes[buyers])
+        best_seller, _, _ = nearestBuyers(keys[buyers], group_codes[buyers], keys[sellers], group_codes[sellers])
+
+        # Keep mutually nearest pairs within tolerance
+        candidates = np.nonzero(best_buyer >= 0)[0]
+        mutual = candidates[best_seller[best_buyer[candidates]] == candidates]
+
+        seller_amounts = amounts[sellers[mutual]]
+        buyer_amounts = amounts[buyers[best_buyer[mutual]]]
+        similarity = 1 - np.abs(seller_amounts - buyer_amounts) / np.maximum(seller_amounts, buyer_amounts)
+
+        within = similarity >= 1 - tolerance
+        mutual = mutual[within]
+
+        if len(mutual) == 0:
+            break
+
+        # A runner-up as close as the match halves the confidence, a distant or missing one leaves it unchanged
+        best = buyer_distance[mutual]
+        runner_up = runner_up_distance[mutual]
+        with np.errstate(invalid = 'ignore'):
+            uniqueness = np.where(np.isinf(runner_up), 1.0, np.where(best + runner_up > 0, runner_up / (best + runner_up), 0.5))
+
+        matched_sellers.append(sellers[mutual])
+        matched_buyers.append(buyers[best_buyer[mutual]])
+        confidences.append(similarity[within] * uniqueness)
+
+        sellers = np.delete(sellers, mutual)
+        buyers = np.delete(buyers, best_buyer[mutual])
+
+    if len(matched_sellers) == 0:
+        return pd.DataFrame(columns = TRANSFER_COLUMNS)
+
+    seller_rows = changes.iloc[np.concatenate(matched_sellers)].reset_index(drop = True)
+    buyer_rows = changes.iloc[np.concatenate(matched_buyers)].reset_index(drop = True)
+
+    transfers = pd.DataFrame({'stock_code': seller_rows['stock_code'],
+                              'date': seller_rows['date'],
+                              'seller_id': seller_rows['participant_id'],
+                              'seller_name': seller_rows['participant_name'],
+                              'buyer_id': buyer_rows['participant_id'],
+                              'buyer_name': buyer_rows['participant_name'],
+                              'seller_change': seller_rows['change'],
+                              'buyer_change': buyer_rows['change'],
+                              'confidence': np.concatenate(confidences)
+                              }, columns = TRANSFER_COLUMNS)
+
+    return (transfers.sort_values(['stock_code', 'date', 'confidence'], ascending = [True, True, False], kind = 'stable')
+            .reset_index(drop = True)
+            )
+
+def summaryChanges(chg_summary, stock_code = None):
+
+    """
+    Converts a change summary (CHG_SUMMARY_COLUMNS, with a leading 'Stock Code' column for batch reports) into the
+    changes layout of matchTransfers
+    """
+
+    return pd.DataFrame({'stock_code': chg_summary['Stock Code'] if 'Stock Code' in chg_summary.columns else stock_code,
+                         'date': chg_summary[CHG_SUMMARY_COLUMNS[3]],
+                         'participant_id': chg_summary[CHG_SUMMARY_COLUMNS[0]],
+                         'participant_name': chg_summary[CHG_SUMMARY_COLUMNS[1]],
+                         'change': chg_summary[CHG_SUMMARY_COLUMNS[2]].astype(float)
+                         })
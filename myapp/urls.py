@@ -3,4 +3,13 @@ from . import views
 
 urlpatterns = [
     path('', views.contact),
+    path('jobs/<int:job_id>/', views.job, name='job'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/chart.png', views.job_chart, name='job_chart'),
+    path('jobs/<int:job_id>/<str:table>/', views.job_table, name='job_table'),
+    path('jobs/<int:job_id>/<str:table>.<str:fmt>', views.job_export, name='job_export'),
+    path('metrics', views.metrics, name='metrics'),
+    path('participants/<str:participant_id>/', views.participant, name='participant'),
+    path('concentration/', views.concentration, name='concentration'),
+    path('concentration/<str:stock_code>/', views.stock_concentration, name='stock_concentration'),
 ]
@@ -1,63 +1,306 @@
-from django.shortcuts import render
-from django.http import HttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.urls import reverse
 from .forms import HKEXForm
-from .hkex import HKEXInput, HKEXConnection
-# Create your views here.
-def contact(request):
+from .jobs import submitJob
+from .instrumentation import METRICS
+from .models import AnalysisJob
+
+# pandas (through results, participants, charts and changes) is imported by the views that need it, so that workers
+# start, and submit analyses, without loading the analytics stack
+
+def wantsJson(request):
+    return 'application/json' in request.headers.get('Accept', '') or request.GET.get('format') == 'json'
+
+def pageIndex(page):
+
+    """Row numbers of the page within the whole table, as to_html printed them before pagination"""
+
+    start = (page.number - 1) * page.paginator.per_page
+
+    return range(start, start + len(page.object_list))
+
+def renderResults(job, request):
+
+    """
+    Renders one page of each stored result table of a completed job into form.html, the chart is served by job_chart.
+    Only the rows of the two pages are read from the database
+    """
 
-    import matplotlib.pyplot as plt
-    import matplotlib.ticker as mtick
-    from io import BytesIO
-    import base64
     import pandas as pd
+    from .changes import CHG_SUMMARY_COLUMNS
+    from .results import TABLE_FIELDS, paginateRows, resultTable
 
-    html = ''
-    chg_summary_html = ''
-    graphic = ''
+    holdings_page = paginateRows(resultTable(job, 'holdings'), request.GET.get('page'))
+    changes_page = paginateRows(resultTable(job, 'changes'), request.GET.get('changes_page'))
+
+    shareholding_data = pd.DataFrame.from_records(list(holdings_page.object_list), columns=TABLE_FIELDS['holdings'])
+    shareholding_data['participant_pct_holding'] = shareholding_data['participant_pct_holding'].astype(float).map("{:.2%}".format)
+    shareholding_data.columns = ['Participant ID', 'Participant Name', 'Participant Address', 'Shareholding', '% of Total Issue']
+    shareholding_data.index = pageIndex(holdings_page)
+    html = shareholding_data.to_html()
+
+    chg_summary = pd.DataFrame.from_records(list(changes_page.object_list), columns=TABLE_FIELDS['changes'])
+    chg_summary['pct_change'] = chg_summary['pct_change'].astype(float).map("{:.2%}".format)
+    chg_summary.columns = CHG_SUMMARY_COLUMNS
+    chg_summary.index = pageIndex(changes_page)
+    chg_summary_html = chg_summary.to_html()
+
+    return {'html': html,
+            'chg_summary': chg_summary_html,
+            'holdings_page': holdings_page,
+            'changes_page': changes_page,
+            'chart_url': reverse('job_chart', args=[job.id])
+            }
+
+# Create your views here.
+def contact(request):
 
     if request.method == 'POST':
+        from .store import toDate
+
         form = HKEXForm(request.POST)
         if form.is_valid():
             stock_code = form.cleaned_data['stock_code']
             start_date = form.cleaned_data['start_date']
             end_date = form.cleaned_data['end_date']
-            chg_threshold = float(form.cleaned_data['change_threshold'])
-
-            hkex_input = HKEXInput(stock_code, start_date, end_date, chg_threshold)
-
-            hkex_obj = HKEXConnection(hkex_input)
-            hkex_obj.setDate()
-            hkex_obj.runAnalysis()
-
-            fig, ax = plt.subplots(figsize=(16, 10))
-            hkex_obj.shareholding_data.head(10).plot.bar(title = 'Top 10 Participants by Shareholding',y = 'participant_pct_holding', x = 'participant_name', ax = ax)
-            ax.yaxis.set_major_formatter(mtick.PercentFormatter(1.0))
-
-            plt.tight_layout()
-
-            buffer = BytesIO()
-            plt.savefig(buffer, format='png')
-            buffer.seek(0)
-            image_png = buffer.getvalue()
-            buffer.close()
-
-            graphic = base64.b64encode(image_png)
-            graphic = graphic.decode('utf-8')
-
-            hkex_obj.shareholding_data['participant_pct_holding'] = hkex_obj.shareholding_data['participant_pct_holding'].astype(float).map("{:.2%}".format)
-            hkex_obj.shareholding_data.columns = ['Participant ID', 'Participant Name', 'Participant Address', 'Shareholding', '% of Total Issue']
-            html = hkex_obj.shareholding_data.to_html()
-
-            hkex_obj.runChangeAnalysis()
-            if hkex_obj.chg_summary == None:
-                hkex_obj.chg_summary = pd.DataFrame(columns = ['Participant ID',
-                                                      'Name of CCASS Participant',
-                                                      '% Change in total number of Issued Shares/ Warrants/ Units held',
-                                                      'Date of Transaction'
-                                                      ])
-            else:
-                hkex_obj.chg_summary['% Change in total number of Issued Shares/ Warrants/ Units held'] = hkex_obj.chg_summary['% Change in total number of Issued Shares/ Warrants/ Units held'].astype(float).map("{:.2%}".format)
-            chg_summary_html = hkex_obj.chg_summary.to_html()
-
-    form = HKEXForm()
-    return render(request, 'form.html', {'form':form, 'html':html, 'chg_summary': chg_summary_html, 'graphic':graphic})
+
+            try:
+                chg_threshold = float(form.cleaned_data['change_threshold'])
+            except ValueError:
+                form.add_error('change_threshold', 'Enter a number.')
+
+            # Dates are parsed again by the worker and the result cache, reject them here rather than fail there
+            dates = {}
+            for field in ['start_date', 'end_date']:
+                try:
+                    dates[field] = toDate(form.cleaned_data[field])
+                except ValueError:
+                    form.add_error(field, 'Enter a date as YYYY/MM/DD.')
+
+            if len(dates) == 2 and dates['start_date'] > dates['end_date']:
+                form.add_error('end_date', 'End date must not be before the start date.')
+
+        if form.is_valid():
+            # Queue the analysis and return straight away, identical pending requests share one job
+            job, created = submitJob(stock_code, start_date, end_date, chg_threshold)
+
+            if wantsJson(request):
+                return JsonResponse({'job_id': job.id,
+                                     'status': job.status,
+                                     'status_url': reverse('job_status', args=[job.id]),
+                                     'result_url': reverse('job', args=[job.id])
+                                     }, status=202)
+
+            return redirect('job', job_id=job.id)
+
+        if wantsJson(request):
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        return render(request, 'form.html', {'form':form}, status=400)
+
+    else:
+        form = HKEXForm()
+
+    return render(request, 'form.html', {'form':form})
+
+def job(request, job_id):
+
+    job = get_object_or_404(AnalysisJob, id=job_id)
+
+    form = HKEXForm(initial={'stock_code': job.stock_code,
+                             'start_date': job.start_date,
+                             'end_date': job.end_date,
+                             'change_threshold': job.chg_threshold
+                             })
+
+    context = {'form': form, 'job': job}
+    if job.status == AnalysisJob.DONE:
+        context.update(renderResults(job, request))
+
+    return render(request, 'form.html', context)
+
+def job_status(request, job_id):
+
+    job = get_object_or_404(AnalysisJob, id=job_id)
+
+    return JsonResponse({'job_id': job.id,
+                         'status': job.status,
+                         'dates_fetched': job.dates_fetched,
+                         'dates_total': job.dates_total,
+                         'error': job.error,
+                         'result_url': reverse('job', args=[job.id])
+                         })
+
+def job_chart(request, job_id):
+
+    from .charts import CHART_CACHE_TIMEOUT, chartETag, topParticipantsChart
+    from .results import TABLE_FIELDS, resultTable
+    from .store import isFinal
+
+    job = get_object_or_404(AnalysisJob, id=job_id, status=AnalysisJob.DONE)
+
+    try:
+        top_n = min(max(int(request.GET.get('top', 10)), 1), 50)
+    except ValueError:
+        top_n = 10
+
+    # The chart only depends on the holdings of the stock code as of the end date
+    etag = '"' + chartETag(job.stock_code, job.end_date, top_n) + '"'
+    final = isFinal(job.end_date)
+
+    if final and etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        def loadHoldings():
+            import pandas as pd
+
+            # Holdings are stored in % holding order, only the bars plotted are read
+            return pd.DataFrame.from_records(list(resultTable(job, 'holdings')[:top_n]), columns=TABLE_FIELDS['holdings'])
+
+        png = topParticipantsChart(job.stock_code, job.end_date, top_n, loadHoldings)
+        response = HttpResponse(png, content_type='image/png')
+
+    if final:
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=CHART_CACHE_TIMEOUT)
+    else:
+        patch_cache_control(response, no_cache=True)
+
+    return response
+
+def job_table(request, job_id, table):
+
+    from .results import TABLE_FIELDS, paginateRows, queryTable, resultTable, rowRecords
+
+    job = get_object_or_404(AnalysisJob, id=job_id, status=AnalysisJob.DONE)
+
+    if table not in TABLE_FIELDS:
+        raise Http404('Unknown table')
+
+    try:
+        rows = queryTable(resultTable(job, table),
+                          participant_id=request.GET.get('participant_id'),
+                          date_from=request.GET.get('date_from'),
+                          date_to=request.GET.get('date_to'),
+                          min_change=request.GET.get('min_change') or None,
+                          sort=request.GET.get('sort')
+                          )
+        page = paginateRows(rows, request.GET.get('page'), request.GET.get('page_size', 50))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'job_id': job.id,
+                         'table': table,
+                         'count': page.paginator.count,
+                         'page': page.number,
+                         'num_pages': page.paginator.num_pages,
+                         'page_size': page.paginator.per_page,
+                         'has_next': page.has_next(),
+                         'has_previous': page.has_previous(),
+                         'results': rowRecords(page.object_list)
+                         })
+
+def job_export(request, job_id, table, fmt):
+
+    from .results import TABLE_FIELDS, iterCsv, iterParquet, queryTable, resultTable
+
+    job = get_object_or_404(AnalysisJob, id=job_id, status=AnalysisJob.DONE)
+
+    if table not in TABLE_FIELDS or fmt not in ['csv', 'parquet']:
+        raise Http404('Unknown export')
+
+    try:
+        rows = queryTable(resultTable(job, table),
+                          participant_id=request.GET.get('participant_id'),
+                          date_from=request.GET.get('date_from'),
+                          date_to=request.GET.get('date_to'),
+                          min_change=request.GET.get('min_change') or None,
+                          sort=request.GET.get('sort')
+                          )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if fmt == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            return JsonResponse({'error': 'Parquet export requires pyarrow'}, status=501)
+        response = StreamingHttpResponse(iterParquet(rows), content_type='application/vnd.apache.parquet')
+    else:
+        response = StreamingHttpResponse(iterCsv(rows), content_type='text/csv')
+
+    response['Content-Disposition'] = 'attachment; filename="' + job.stock_code + '_' + table + '_' + str(job.id) + '.' + fmt + '"'
+
+    return response
+
+def participant(request, participant_id):
+
+    from .participants import participantMoves, participantStocks
+    from .results import frameRecords
+
+    participant_id = participant_id.strip().upper()
+
+    try:
+        start_date = request.GET.get('start_date') or None
+        end_date = request.GET.get('end_date') or None
+        min_change = float(request.GET.get('min_change') or 0)
+
+        stocks = participantStocks(participant_id, start_date, end_date, min_change)
+
+        # Individual moves are listed for a single stock code at a time
+        moves = None
+        if request.GET.get('stock_code'):
+            from .hkex import normalizeStockCode
+            moves = frameRecords(participantMoves(participant_id, start_date, end_date, min_change, normalizeStockCode(request.GET['stock_code'])).rename(columns={'date': 'transaction_date'}))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'participant_id': participant_id,
+                         'start_date': start_date,
+                         'end_date': end_date,
+                         'min_change': min_change,
+                         'stocks': stocks,
+                         'moves': moves
+                         })
+
+def concentration(request):
+
+    from .concentration import CONCENTRATION_FIELDS, latestConcentrationDate, screenConcentration
+
+    try:
+        d = request.GET.get('date') or latestConcentrationDate()
+        limit = min(max(int(request.GET.get('limit', 100)), 1), 1000)
+
+        # Bounds are passed as min_<field> / max_<field>, e.g. min_top10_pct=0.6
+        minimums = {field: float(request.GET['min_' + field]) for field in CONCENTRATION_FIELDS if request.GET.get('min_' + field)}
+        maximums = {field: float(request.GET['max_' + field]) for field in CONCENTRATION_FIELDS if request.GET.get('max_' + field)}
+
+        stocks = screenConcentration(d, request.GET.get('sort', '-top10_pct'), limit, minimums, maximums) if d != None else []
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'date': d, 'stocks': stocks})
+
+def stock_concentration(request, stock_code):
+
+    from .concentration import concentrationSeries
+    from .hkex import normalizeStockCode
+    from .results import frameRecords
+
+    stock_code = normalizeStockCode(stock_code)
+
+    try:
+        series = concentrationSeries(stock_code, request.GET.get('start_date') or None, request.GET.get('end_date') or None)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'stock_code': stock_code,
+                         'series': frameRecords(series.drop(columns='stock_code'))
+                         })
+
+def metrics(request):
+
+    # Instrumentation of this process only, hkex_worker exports its own with --metrics-file
+    return HttpResponse(METRICS.prometheusText(), content_type='text/plain; version=0.0.4; charset=utf-8')